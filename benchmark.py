@@ -0,0 +1,301 @@
+"""Headless benchmarks for scanning, storage and scheduling.
+
+Generates a synthetic ``flashcards/`` tree and ``flashcard_data.json`` in a
+temporary directory for every requested size and times the core operations
+without importing PyQt.  Results are printed (or written with ``--output``)
+as JSON; ``--compare`` checks them against an earlier run and exits with
+status 1 when an operation got slower than ``--threshold`` times its old time.
+
+Examples::
+
+    python benchmark.py --sizes 1000,10000 --output bench.json
+    python benchmark.py --sizes 1000,10000 --compare bench.json
+"""
+
+import os
+import io
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import tempfile
+import tracemalloc
+import contextlib
+
+from japan_niche import cards, data, decks, kana
+from japan_niche.migrations import SCHEMA_VERSION
+from japan_niche.storage import STORAGE_BACKENDS, empty_data
+
+HIRAGANA = (
+    'あいうえおかきくけこさしすせそたちつてと'
+    'なにぬねのはひふへほまみむめもやゆよらりるれろわをん'
+)
+CARDS_PER_FILE = 1000
+# Typed one character at a time for the search operation.
+SEARCH_QUERIES = ('meaning 12', 'word99', 'category:category 3', 'あい')
+
+
+def generate_corpus(directory, n_cards, seed=0):
+    """Write ``n_cards`` entries as markdown files below ``directory``.
+
+    Files hold ``CARDS_PER_FILE`` entries each and are spread over nested
+    subdirectories, ten files per directory.
+    """
+    rng = random.Random(seed)
+    for start in range(0, n_cards, CARDS_PER_FILE):
+        file_no = start // CARDS_PER_FILE
+        sub = os.path.join(directory, f'part{file_no // 10:04d}')
+        os.makedirs(sub, exist_ok=True)
+        lines = [f'# Category {file_no}\n']
+        for i in range(start, min(start + CARDS_PER_FILE, n_cards)):
+            length = rng.randint(2, 6)
+            hira = ''.join(rng.choice(HIRAGANA) for _ in range(length))
+            lines.append(f'- word{i}: Meaning number {i}. [w{i}] [{hira}]\n')
+        with open(os.path.join(sub, f'cards{file_no:05d}.md'), 'w',
+                  encoding='utf-8') as f:
+            f.writelines(lines)
+
+
+def generate_data(n_cards, seed=0):
+    """Return a collection of ``n_cards`` cards with random progress."""
+    rng = random.Random(seed)
+    collection = {
+        'schema_version': SCHEMA_VERSION,
+        'cards': {},
+        'study_deck': [],
+        'last_session': None,
+    }
+    for i in range(n_cards):
+        cid = f'word{i}'
+        card = cards.new_card(cid, f'Meaning number {i}.', f'w{i}', 'あ')
+        deck = rng.choices(('no_deck', 'review', 'study'), (5, 4, 1))[0]
+        card['deck'] = deck
+        if deck != 'no_deck':
+            for d in ('J2E', 'E2J'):
+                card['struggle'][d] = rng.randint(0, 6)
+                card['last_study'][d] = 1.7e9 + rng.random() * 1e7
+        if deck == 'study':
+            collection['study_deck'].append(cid)
+        collection['cards'][cid] = card
+    return collection
+
+
+def measure(fn, setup=None, repeat=3):
+    """Time ``fn`` and record its peak traced memory.
+
+    ``setup`` runs before every call and is not timed; its return value is
+    passed to ``fn``.  Returns the best wall time of ``repeat`` runs and the
+    peak memory in KiB of one extra run under ``tracemalloc``.
+    """
+    best = None
+    for _ in range(repeat):
+        arg = setup() if setup else None
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            fn(arg)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    arg = setup() if setup else None
+    tracemalloc.start()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            fn(arg)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return best, peak / 1024
+
+
+def run_size(n_cards, repeat=3, grades=1000, storage='json'):
+    """Benchmark every operation on a collection of ``n_cards`` cards."""
+    results = []
+
+    def record(op, fn, items, setup=None):
+        seconds, peak_kb = measure(fn, setup, repeat)
+        results.append({
+            'op': op,
+            'cards': n_cards,
+            'items': items,
+            'seconds': seconds,
+            'throughput': items / seconds if seconds > 0 else None,
+            'peak_kb': round(peak_kb, 1),
+        })
+
+    def fresh_data():
+        return data.load_data()
+
+    def reset_parse_cache():
+        cards._parse_cache = None
+        if os.path.exists(cards.PARSE_CACHE_FILE):
+            os.remove(cards.PARSE_CACHE_FILE)
+        return empty_data()
+
+    def warm_scan():
+        collection = fresh_data()
+        with contextlib.redirect_stdout(io.StringIO()):
+            cards.scan_files(collection)
+        return collection
+
+    def study_grades(collection):
+        rng = random.Random(1)
+        queue = collection['study_deck']
+        for _ in range(grades):
+            if not queue:
+                break
+            cid = queue.choice(rng)
+            direction = rng.choice(('J2E', 'E2J'))
+            cards.apply_rating(
+                collection, cid, direction, rng.choice('ASDF'), now=0.0
+            )
+
+    with tempfile.TemporaryDirectory() as tmp:
+        cwd = os.getcwd()
+        os.chdir(tmp)
+        try:
+            data.use_storage({'storage': storage, 'save_interval': 0})
+            generate_corpus(cards.FLASHCARD_DIR, n_cards)
+            record(
+                'parse_markdown_files',
+                lambda _: cards.parse_markdown_files(),
+                n_cards,
+            )
+            record(
+                'scan_files_cold', cards.scan_files, n_cards,
+                setup=reset_parse_cache,
+            )
+            record(
+                'scan_files_unchanged', cards.scan_files, n_cards,
+                setup=warm_scan,
+            )
+            readings = [
+                c['hira'] for c in cards.parse_markdown_files().values()
+            ]
+            record(
+                'transliterate',
+                lambda _: [kana.segments(r) for r in readings],
+                n_cards,
+                # Time the segmentation itself, not the cache.
+                setup=kana.segments.cache_clear,
+            )
+            record(
+                'build_search_index', cards.search_index, n_cards,
+                setup=warm_scan,
+            )
+            index = cards.search_index(warm_scan())
+            typed = [
+                q[:i] for q in SEARCH_QUERIES for i in range(1, len(q) + 1)
+            ]
+            record(
+                'search',
+                lambda _: [index.search(q) for q in typed],
+                len(typed),
+                # Search-as-you-type starts over with every new query.
+                setup=index.cache_clear,
+            )
+
+            collection = generate_data(n_cards)
+            data.save_data(collection)
+            record('load_data', lambda _: data.load_data(), n_cards)
+            record('save_data', data.save_data, n_cards, setup=fresh_data)
+            config = {'new_cards': 35, 'review_cards': 100}
+            record(
+                'start_new_day',
+                lambda c: cards.start_new_day(c, config),
+                n_cards,
+                setup=fresh_data,
+            )
+            record(
+                'select_review_cards',
+                lambda c: cards.select_review_cards(c, 100),
+                n_cards,
+                setup=fresh_data,
+            )
+            record('rate', study_grades, grades, setup=fresh_data)
+        finally:
+            data.close_storage()
+            os.chdir(cwd)
+    return results
+
+
+def compare(results, baseline, threshold):
+    """Return lines describing changes against ``baseline`` results.
+
+    The second value is True if any operation regressed beyond
+    ``threshold``.
+    """
+    old = {(r['op'], r['cards']): r for r in baseline['results']}
+    lines = []
+    regressed = False
+    for r in results:
+        before = old.get((r['op'], r['cards']))
+        if before is None:
+            continue
+        ratio = r['seconds'] / before['seconds'] if before['seconds'] else 1.0
+        flag = ''
+        if ratio > threshold:
+            flag = '  REGRESSION'
+            regressed = True
+        lines.append(
+            f"{r['op']:<22} {r['cards']:>8} cards  "
+            f"{before['seconds'] * 1000:10.2f} ms -> "
+            f"{r['seconds'] * 1000:10.2f} ms  x{ratio:.2f}{flag}"
+        )
+    return lines, regressed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        '--sizes', default='1000,10000',
+        help='comma separated collection sizes (default: 1000,10000)',
+    )
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--grades', type=int, default=1000,
+                        help='number of grades timed for the rate operation')
+    parser.add_argument('--output', help='write the JSON results to a file')
+    parser.add_argument('--compare', metavar='FILE',
+                        help='compare against results from an earlier run')
+    parser.add_argument('--threshold', type=float, default=1.25,
+                        help='slowdown ratio reported as a regression')
+    parser.add_argument('--storage', default='json',
+                        choices=sorted(STORAGE_BACKENDS),
+                        help='storage backend to benchmark (default: json)')
+    parser.add_argument('--engine', default='auto',
+                        choices=decks.REVIEW_ENGINES,
+                        help='review engine used for New Day (default: auto)')
+    args = parser.parse_args(argv)
+    engine = decks.use_review_engine(args.engine)
+
+    results = []
+    for size in (int(s) for s in args.sizes.split(',')):
+        print(f'Benchmarking {size} cards...', file=sys.stderr)
+        results.extend(
+            run_size(size, args.repeat, args.grades, args.storage)
+        )
+    report = {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'storage': args.storage,
+        'review_engine': engine,
+        'results': results,
+    }
+    text = json.dumps(report, indent=4)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text)
+    else:
+        print(text)
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        lines, regressed = compare(results, baseline, args.threshold)
+        print('\n'.join(lines), file=sys.stderr)
+        return 1 if regressed else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
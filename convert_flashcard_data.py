@@ -1,7 +1,198 @@
-import json
+"""Upgrade an old ``flashcard_data.json`` to the current format.
+
+Large legacy exports are converted as a stream: the file is read card by
+card, the J2E and E2J halves of a word are merged within a sliding window and
+finished cards are written out straight away.  Apart from the window only
+the ids of written cards and the directions merged into each word are kept
+in memory.  The result is the same as running the migrations up to
+:func:`~japan_niche.migrations.merge_directions`; any later migrations run
+when the program loads the result.
+"""
+
 import os
+import json
+import tempfile
+from collections import OrderedDict
+
+from japan_niche.jsonstream import JsonReader
+from japan_niche.migrations import (
+    MIGRATIONS,
+    SCHEMA_VERSION,
+    is_split_card,
+    merge_directions,
+    merge_into,
+    schema_version,
+    split_progress,
+    upgrade_front_back,
+)
 
 DATA_FILE = 'flashcard_data.json'
+# Format version produced by this converter.
+CONVERTED_VERSION = next(
+    version for version, step in MIGRATIONS if step is merge_directions
+)
+# Number of words kept open for their other half to arrive.  Halves that
+# arrive later are merged by a second pass over the output.
+MERGE_WINDOW = 10000
+PROGRESS_STEP = 10
+
+
+def _scan_top_level(path):
+    """Read every top-level value except ``cards`` (which is skipped)."""
+    top = {}
+    with open(path, 'rb') as f:
+        reader = JsonReader(f)
+        for key in reader.members():
+            if key == 'cards':
+                for _ in reader.members():
+                    reader.value()
+            else:
+                top[key] = reader.value()
+    return top
+
+
+class _Progress:
+    def __init__(self, total):
+        self.total = total
+        self.next_step = PROGRESS_STEP
+
+    def update(self, done, cards):
+        if not self.total:
+            return
+        percent = 100 * done // self.total
+        if percent >= self.next_step:
+            print(f'{percent}% read, {cards} cards processed')
+            self.next_step = (percent // PROGRESS_STEP + 1) * PROGRESS_STEP
+
+
+def _write_card(out, first, cid, card):
+    if not first:
+        out.write(',\n')
+    out.write(f'        {json.dumps(cid)}: {json.dumps(card)}')
+
+
+def _merge_word(card, word, directions):
+    """Merge ``word``, built from split halves, into the word card ``card``.
+
+    Gives the same card as merging the halves one by one with
+    :func:`merge_into`; ``directions`` are the directions of the halves.
+    """
+    for k in ('en', 'pron', 'hira'):
+        if word.get(k):
+            card[k] = word[k]
+    if word.get('deck', 'no_deck') != 'no_deck':
+        card['deck'] = word['deck']
+    for direction in directions:
+        for key in ('skill', 'struggle', 'last_study', 'ratings'):
+            card[key][direction] = word[key][direction]
+    return card
+
+
+def _stream_cards(path, out, study_ids):
+    """Convert the cards of ``path`` and write them to ``out``.
+
+    Returns the number of cards read and written, the new id of every
+    legacy id in ``study_ids``, by word the ``(id, card)`` pairs that
+    arrived after their word was already written, and the directions merged
+    into every word built from halves.  Word cards take precedence over the
+    halves of their word wherever they appear in the file, as in
+    :func:`~japan_niche.migrations.merge_directions`.
+    """
+    pending = OrderedDict()
+    written = set()
+    late = {}
+    directions = {}
+    id_map = {}
+    read = 0
+    progress = _Progress(os.path.getsize(path))
+
+    def emit(cid, card):
+        _write_card(out, not written, cid, card)
+        written.add(cid)
+
+    with open(path, 'rb') as f:
+        reader = JsonReader(f)
+        for key in reader.members():
+            if key != 'cards':
+                reader.value()
+                continue
+            for cid in reader.members():
+                card = reader.value()
+                read += 1
+                upgrade_front_back(card)
+                split_progress(card)
+                if is_split_card(cid, card):
+                    jp = card.get('jp')
+                    if jp and jp in written:
+                        late.setdefault(jp, []).append((cid, card))
+                        new_id = jp
+                    else:
+                        new_id = merge_into(pending, card)
+                    if new_id is not None:
+                        directions.setdefault(new_id, set()).add(
+                            card.get('direction', 'J2E')
+                        )
+                else:
+                    new_id = cid
+                    if cid in written:
+                        late.setdefault(cid, []).append((cid, card))
+                    elif cid in directions:
+                        pending[cid] = _merge_word(
+                            card, pending[cid], directions[cid]
+                        )
+                    else:
+                        pending[cid] = card
+                if cid in study_ids and new_id is not None:
+                    id_map[cid] = new_id
+                while len(pending) > MERGE_WINDOW:
+                    emit(*pending.popitem(last=False))
+                progress.update(reader.position, read)
+    while pending:
+        emit(*pending.popitem(last=False))
+    return read, len(written), id_map, late, directions
+
+
+def _merge_late(path, late, directions):
+    """Merge cards that arrived too late into the written file ``path``."""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp = tempfile.mkstemp(suffix='.tmp', dir=directory)
+    try:
+        _rewrite_with_late(fd, path, late, directions)
+    except BaseException:
+        os.remove(tmp)
+        raise
+    os.replace(tmp, path)
+
+
+def _rewrite_with_late(fd, path, late, directions):
+    with os.fdopen(fd, 'w', encoding='utf-8') as out, open(path, 'rb') as f:
+        reader = JsonReader(f)
+        out.write('{\n')
+        first_key = True
+        for key in reader.members():
+            if not first_key:
+                out.write(',\n')
+            first_key = False
+            out.write(f'    {json.dumps(key)}: ')
+            if key != 'cards':
+                out.write(json.dumps(reader.value()))
+                continue
+            out.write('{\n')
+            first = True
+            for cid in reader.members():
+                card = reader.value()
+                for late_id, late_card in late.pop(cid, ()):
+                    if is_split_card(late_id, late_card):
+                        merge_into({cid: card}, late_card)
+                    elif cid in directions:
+                        # The word card came after its halves were written.
+                        card = _merge_word(late_card, card, directions[cid])
+                    else:
+                        card = late_card
+                _write_card(out, first, cid, card)
+                first = False
+            out.write('\n    }')
+        out.write('\n}\n')
 
 
 def convert():
@@ -9,85 +200,54 @@ def convert():
         print('flashcard_data.json not found')
         return
 
-    with open(DATA_FILE, 'r', encoding='utf-8') as f:
-        data = json.load(f)
-
-    # Detect already converted format by ensuring *all* cards have simple
-    # Japanese IDs (no `|` separator) and the ratings field is a dict. The
-    # previous implementation only looked at a single card which caused a
-    # mix of old and new formats to be incorrectly detected as converted.
-    already_new = True
-    for card in data.get('cards', {}).values():
-        if not isinstance(card.get('ratings'), dict) or '|' in card.get('id', ''):
-            already_new = False
-            break
-    if already_new:
+    top = _scan_top_level(DATA_FILE)
+    if schema_version(top) >= CONVERTED_VERSION:
         print('Data already in new format')
         return
-
-    old_cards = data.get('cards', {})
-    new_cards = {}
-    id_map = {}
-
-    for cid, card in old_cards.items():
-        jp = card.get('jp')
-        en = card.get('en')
-        pron = card.get('pron')
-        hira = card.get('hira')
-        direction = card.get('direction', 'J2E')
-
-        if not jp:
-            continue
-
-        new_id = jp
-        target = new_cards.get(new_id)
-        if target is None:
-            target = {
-                'id': new_id,
-                'jp': jp,
-                'en': en,
-                'pron': pron,
-                'hira': hira,
-                'deck': card.get('deck', 'no_deck'),
-                'ratings': {'J2E': [], 'E2J': []},
-                'skill': {'J2E': 0, 'E2J': 0},
-                'struggle': {'J2E': 0, 'E2J': 0},
-                'last_study': {'J2E': None, 'E2J': None},
-            }
-            new_cards[new_id] = target
-        else:
-            # Update details if present
-            for k, v in [('en', en), ('pron', pron), ('hira', hira)]:
-                if v:
-                    target[k] = v
-            if card.get('deck', 'no_deck') != 'no_deck':
-                target['deck'] = card['deck']
-
-        target['ratings'][direction] = card.get('ratings', [])
-        target['skill'][direction] = card.get('skill', 0)
-        target['struggle'][direction] = card.get('struggle', 0)
-        target['last_study'][direction] = card.get('last_study')
-
-        id_map[cid] = new_id
-
-    new_study_deck = []
-    for cid in data.get('study_deck', []):
-        nid = id_map.get(cid)
-        if nid and nid not in new_study_deck:
-            new_study_deck.append(nid)
-
-    new_data = {
-        'cards': new_cards,
-        'study_deck': new_study_deck,
-        'last_session': data.get('last_session'),
-    }
+    study_ids = set(top.get('study_deck', []))
+
+    directory = os.path.dirname(os.path.abspath(DATA_FILE))
+    fd, tmp = tempfile.mkstemp(
+        prefix=DATA_FILE + '.', suffix='.tmp', dir=directory
+    )
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as out:
+            out.write('{\n')
+            out.write(f'    "schema_version": {CONVERTED_VERSION},\n')
+            out.write('    "cards": {\n')
+            read, written, id_map, late, directions = _stream_cards(
+                DATA_FILE, out, study_ids
+            )
+            out.write('\n    },\n')
+            study_deck = []
+            seen = set()
+            for cid in top.get('study_deck', []):
+                nid = id_map.get(cid)
+                if nid and nid not in seen:
+                    seen.add(nid)
+                    study_deck.append(nid)
+            out.write(f'    "study_deck": {json.dumps(study_deck)}')
+            for key, value in top.items():
+                if key not in ('schema_version', 'study_deck'):
+                    out.write(f',\n    {json.dumps(key)}: {json.dumps(value)}')
+            out.write('\n}\n')
+            out.flush()
+            os.fsync(out.fileno())
+        if late:
+            print(f'Merging {len(late)} cards whose halves were far apart.')
+            _merge_late(tmp, late, directions)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
 
     backup = DATA_FILE + '.bak'
-    os.rename(DATA_FILE, backup)
-    with open(DATA_FILE, 'w', encoding='utf-8') as f:
-        json.dump(new_data, f, indent=4)
-    print(f'Converted {len(old_cards)} cards to {len(new_cards)} cards.')
+    os.replace(DATA_FILE, backup)
+    os.replace(tmp, DATA_FILE)
+    print(f'Converted {read} cards to {written} cards.')
     print(f'Backup created at {backup}')
+    if CONVERTED_VERSION < SCHEMA_VERSION:
+        print('Remaining upgrades run the next time the program starts.')
 
 
 if __name__ == '__main__':
@@ -1,13 +1,205 @@
+import io
 import os
 import re
+import json
+import time
+import bisect
+import hashlib
 import datetime
-from .data import save_data
+from itertools import islice
+from .data import assign_sources, record_card, save_cards, get_storage
+from .persist import atomic_write
+from .model import Card
+from .history import record_review
+from .profiling import count, timed
+from .search import SearchIndex
+from .decks import (
+    deck_index,
+    set_deck,
+    add_card,
+    remove_card,
+    _total_struggle,
+    _last_study,
+)
 
 FLASHCARD_DIR = 'flashcards'
+PARSE_CACHE_FILE = 'flashcard_cache.json'
+# Bumped when the cached entries change shape; older caches are dropped.
+PARSE_CACHE_VERSION = 3
 SCORE_MAP = {'A': -2, 'S': -1, 'D': 1, 'F': 2}
+CARD_TEXT_FIELDS = ('jp', 'en', 'pron', 'hira')
 
+# Parse cache kept in memory after the first scan so later rescans in the
+# same session only need to stat the markdown files.
+_parse_cache = None
+# Set when files were merged by :func:`apply_file_changes` but the parse
+# cache was not written yet (see :func:`flush_parse_cache`).
+_cache_dirty = False
+# Card id -> paths of the cached files that contain it, in walk order.  Built
+# on the first incremental merge and dropped by every full scan.
+_owners = None
 
-def parse_markdown_files(existing_ids=None):
+ENTRY_RE = re.compile(r'-\s*(.+?):\s*(.+?)\s*\[(.+?)\]\s*\[(.+?)\]')
+
+
+def _markdown_paths():
+    """Return every ``.md`` file below ``FLASHCARD_DIR`` in sorted order."""
+    paths = []
+    for root, dirs, files in os.walk(FLASHCARD_DIR):
+        dirs.sort()
+        for fname in sorted(files):
+            if fname.endswith('.md'):
+                paths.append(os.path.join(root, fname))
+    return paths
+
+
+def _walk_key(path):
+    """Sort key that orders paths the way :func:`_markdown_paths` lists them.
+
+    ``os.walk`` lists the files of a directory before its subdirectories, so
+    plain string order is not enough.
+    """
+    parts = os.path.relpath(path, FLASHCARD_DIR).split(os.sep)
+    return [(1, p) for p in parts[:-1]] + [(0, parts[-1])]
+
+
+def _parse_entries(raw):
+    """Return the entries found in a file's bytes.
+
+    Each entry is ``[jp, en, pron, hira, category]`` where ``category`` is
+    the text of the last ``#`` header above it (None before the first).
+    """
+    entries = []
+    category = None
+    for line in io.TextIOWrapper(io.BytesIO(raw), encoding='utf-8'):
+        line = line.strip()
+        if line.startswith('#'):
+            category = line.lstrip('#').strip() or None
+            continue
+        if line.startswith('-'):
+            m = ENTRY_RE.match(line)
+            if m:
+                entries.append(list(m.groups()) + [category])
+    return entries
+
+
+def _file_unchanged(entry, st):
+    return (
+        entry is not None
+        and entry['mtime'] == st.st_mtime_ns
+        and entry['size'] == st.st_size
+    )
+
+
+def _read_markdown_file(path, old_hash=None):
+    """Read and parse one markdown file.
+
+    Runs in worker processes during parallel ingestion, so it only returns
+    plain data: the new cache entry, whether the content changed compared to
+    ``old_hash`` and the per-file statistics.
+    """
+    start = time.perf_counter()
+    st = os.stat(path)
+    with open(path, 'rb') as f:
+        raw = f.read()
+    digest = hashlib.sha1(raw).hexdigest()
+    entries = _parse_entries(raw) if digest != old_hash else None
+    entry = {
+        'mtime': st.st_mtime_ns,
+        'size': st.st_size,
+        'hash': digest,
+        'entries': entries,
+    }
+    stat = {
+        'path': path,
+        'bytes': len(raw),
+        'entries': len(entries) if entries is not None else 0,
+        'seconds': time.perf_counter() - start,
+    }
+    return entry, stat
+
+
+def _refresh_cache(cache, paths, workers=1, stats=None):
+    """Bring the per-file parse ``cache`` up to date with ``paths``.
+
+    Files whose mtime and size match the cache are not opened.  Files that
+    were touched are re-read and only re-parsed when their content hash
+    changed.  With ``workers`` above one the files are read and parsed in a
+    process pool; results are merged back in ``paths`` order so the outcome
+    does not depend on which worker finishes first.  Per-file statistics are
+    appended to ``stats`` if given.  Returns the list of paths whose entries
+    changed.
+    """
+    todo = []
+    for path in paths:
+        entry = cache.get(path)
+        if not _file_unchanged(entry, os.stat(path)):
+            todo.append((path, entry['hash'] if entry else None))
+
+    if workers > 1 and len(todo) > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        chunksize = max(1, len(todo) // (workers * 4))
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(
+                _read_markdown_file, *zip(*todo), chunksize=chunksize
+            ))
+    else:
+        results = [_read_markdown_file(path, h) for path, h in todo]
+
+    changed = []
+    for (path, _), (entry, stat) in zip(todo, results):
+        if entry['entries'] is None:
+            entry['entries'] = cache[path]['entries']
+        else:
+            changed.append(path)
+        cache[path] = entry
+        count('files_read')
+        count('cards_parsed', stat['entries'])
+        if stats is not None:
+            stats.append(stat)
+    current = set(paths)
+    for path in [p for p in cache if p not in current]:
+        del cache[path]
+        changed.append(path)
+    return changed
+
+
+def ingest_report(stats, seconds, workers=1):
+    """Summarize per-file statistics collected by :func:`parse_markdown_files`.
+
+    Returns a multi-line string with the overall throughput followed by the
+    slowest files.
+    """
+    total_bytes = sum(s['bytes'] for s in stats)
+    total_entries = sum(s['entries'] for s in stats)
+    rate = total_entries / seconds if seconds > 0 else 0.0
+    lines = [
+        f"Parsed {len(stats)} files ({total_bytes / 1e6:.1f} MB, "
+        f"{total_entries} entries) in {seconds:.2f}s with {workers} "
+        f"worker(s): {rate:.0f} entries/s."
+    ]
+    for s in sorted(stats, key=lambda s: s['seconds'], reverse=True)[:5]:
+        lines.append(
+            f"  {s['path']}: {s['entries']} entries in "
+            f"{s['seconds'] * 1000:.1f} ms"
+        )
+    return '\n'.join(lines)
+
+
+def resolve_workers(workers):
+    """Translate the ``ingest_workers`` setting, where 0 means all CPUs."""
+    if not workers:
+        return os.cpu_count() or 1
+    return max(1, int(workers))
+
+
+def new_card(jp, en, pron, hira):
+    return Card(jp, jp, en, pron, hira)
+
+
+@timed('parse_markdown_files')
+def parse_markdown_files(existing_ids=None, cache=None, workers=1,
+                         stats=None, sources=None):
     """Parse markdown files into card objects.
 
     Parameters
@@ -15,122 +207,454 @@ def parse_markdown_files(existing_ids=None):
     existing_ids : Iterable[str], optional
         Set of ids that already exist in the data file so we can avoid
         collisions when generating ids for duplicate cards.
+    cache : dict, optional
+        Per-file parse cache (see :func:`load_parse_cache`).  Files that are
+        unchanged since they were cached are not read again.  The cache is
+        updated in place.
+    workers : int, optional
+        Number of worker processes used to parse changed files.  Cards are
+        merged in file path order, so duplicate ids are resolved the same way
+        for any number of workers.
+    stats : list, optional
+        Receives one dict per file that was read, with its ``path``,
+        ``bytes``, ``entries`` and parse time in ``seconds``.
+    sources : dict, optional
+        Receives the ``(path, category)`` each returned card comes from.
     """
     if existing_ids is None:
         existing_ids = set()
-    cards = {}
-    if not os.path.isdir(FLASHCARD_DIR):
-        return cards
+    if cache is None:
+        cache = {}
+    paths = _markdown_paths()
+    _refresh_cache(cache, paths, workers, stats)
 
-    entry_re = re.compile(r'-\s*(.+?):\s*(.+?)\s*\[(.+?)\]\s*\[(.+?)\]')
-    for fname in os.listdir(FLASHCARD_DIR):
-        if not fname.endswith('.md'):
-            continue
-        path = os.path.join(FLASHCARD_DIR, fname)
-        with open(path, 'r', encoding='utf-8') as f:
-            for line in f:
-                line = line.strip()
-                if line.startswith('#'):
-                    # category headers are ignored in the new format
-                    continue
-                if line.startswith('-'):
-                    m = entry_re.match(line)
-                    if not m:
-                        continue
-                    jp, en, pron, hira = m.groups()
-                    cid = jp
-                    if cid in existing_ids or cid in cards:
-                        print(f"Duplicate card id '{cid}' found in {fname}")
-                        continue
-
-                    cards[cid] = {
-                        'id': cid,
-                        'jp': jp,
-                        'en': en,
-                        'pron': pron,
-                        'hira': hira,
-                        'deck': 'no_deck',
-                        'ratings': {'J2E': [], 'E2J': []},
-                        'skill': {'J2E': 0, 'E2J': 0},
-                        'struggle': {'J2E': 0, 'E2J': 0},
-                        'last_study': {'J2E': None, 'E2J': None},
-                    }
+    cards = {}
+    for path in paths:
+        fname = os.path.basename(path)
+        for jp, en, pron, hira, category in cache[path]['entries']:
+            cid = jp
+            if cid in existing_ids or cid in cards:
+                print(f"Duplicate card id '{cid}' found in {fname}")
+                continue
+            cards[cid] = new_card(jp, en, pron, hira)
+            if sources is not None:
+                sources[cid] = (path, category)
     return cards
 
 
-def scan_files(data):
-    """Read markdown files and synchronize cards with the markdown files."""
-    new_cards = parse_markdown_files()
+def load_parse_cache():
+    """Load the parse cache written by the previous :func:`scan_files`."""
+    global _parse_cache
+    if _parse_cache is None:
+        _parse_cache = {
+            'version': PARSE_CACHE_VERSION, 'files': {}, 'collection': None
+        }
+        if os.path.exists(PARSE_CACHE_FILE):
+            try:
+                with open(PARSE_CACHE_FILE, 'r', encoding='utf-8') as f:
+                    cache = json.load(f)
+            except ValueError:
+                cache = {}
+            if cache.get('version') == PARSE_CACHE_VERSION:
+                _parse_cache = cache
+    return _parse_cache
+
+
+def save_parse_cache(cache):
+    global _parse_cache, _cache_dirty
+    _parse_cache = cache
+    _cache_dirty = False
+    atomic_write(
+        PARSE_CACHE_FILE,
+        json.dumps(cache, ensure_ascii=False, separators=(',', ':')),
+    )
+
+
+def diff_cards(data, new_cards, only=None):
+    """Compare parsed cards against ``data``.
 
-    matched = set()
+    Returns a dict with the ids of cards to be ``added``, ``updated`` (text
+    fields differ) and ``removed``.  With ``only``, the text is only compared
+    for those ids; cards of backends that load lazily are then not read.
+    """
+    cards = data['cards']
+    added = []
+    updated = []
     for cid, card in new_cards.items():
-        matched.add(cid)
-        if cid not in data['cards']:
-            data['cards'][cid] = card
-        else:
-            existing = data['cards'][cid]
-            for k in ['jp', 'en', 'pron', 'hira']:
-                existing[k] = card[k]
+        existing = cards.get(cid)
+        if existing is None:
+            added.append(cid)
+        elif only is not None and cid not in only:
+            continue
+        elif any(existing.get(k) != card[k] for k in CARD_TEXT_FIELDS):
+            updated.append(cid)
+    removed = [cid for cid in cards if cid not in new_cards]
+    return {'added': added, 'updated': updated, 'removed': removed}
 
-    removed = []
-    for cid in list(data['cards'].keys()):
-        if cid not in matched:
-            removed.append(cid)
-            data['cards'].pop(cid)
-            if cid in data['study_deck']:
-                data['study_deck'].remove(cid)
 
-    save_data(data)
+@timed('scan_files')
+def scan_files(data, workers=1):
+    """Read markdown files and synchronize cards with the markdown files.
+
+    Only files that changed since the last scan are parsed again and only
+    the cards that were added, changed or removed are touched; when the
+    cache describes ``data`` only the cards of changed files are compared.
+    The data is not saved when nothing changed, and otherwise only the
+    changed cards are written (see :func:`~japan_niche.data.save_cards`).
+    ``workers`` is the number of processes used to parse changed files.
+    Returns the diff from :func:`diff_cards`.
+    """
+    cache = load_parse_cache()
+    files = cache['files']
+    paths = _markdown_paths()
+    synced = _cache_matches(cache, data)
+    if (
+        synced
+        and len(paths) == len(files)
+        and all(_file_unchanged(files.get(p), os.stat(p)) for p in paths)
+    ):
+        assign_card_sources(data)
+        print(f"No changes. Total cards: {len(data['cards'])}.")
+        return {'added': [], 'updated': [], 'removed': []}
+    before = {path: entry['entries'] for path, entry in files.items()}
+
+    global _owners
+    _owners = None
+    stats = []
+    sources = {}
+    start = time.perf_counter()
+    new_cards = parse_markdown_files(
+        cache=files, workers=workers, stats=stats, sources=sources
+    )
+    if stats:
+        print(ingest_report(stats, time.perf_counter() - start, workers))
+    only = None
+    if synced:
+        # Parsing keeps the entry list of files whose content is the same,
+        # so any other list belongs to a file that was added, changed or
+        # removed, and only its cards can have new text.
+        only = set()
+        for path in set(before) | set(files):
+            old = before.get(path)
+            new = files[path]['entries'] if path in files else None
+            if old is not new:
+                for entries in (old, new):
+                    only.update(e[0] for e in entries or ())
+    diff = diff_cards(data, new_cards, only)
+    for cid in diff['added']:
+        add_card(data, new_cards[cid])
+    for cid in diff['updated']:
+        existing = data['cards'][cid]
+        for k in CARD_TEXT_FIELDS:
+            existing[k] = new_cards[cid][k]
+    for cid in diff['removed']:
+        remove_card(data, cid)
+    search = data.get('_search_index')
+    if search is not None:
+        for cid in diff['removed']:
+            search.remove(cid)
+        changed = set(diff['added']) | set(diff['updated'])
+        for cid, source in sources.items():
+            if cid in changed or search.sources.get(cid) != source:
+                search.add(cid, data['cards'][cid], *source)
+
+    moved = assign_sources({cid: path for cid, (path, _) in sources.items()})
+    changed = diff['added'] + diff['updated'] + diff['removed'] + moved
+    if changed:
+        save_cards(data, changed)
+    cache['collection'] = collection_fingerprint(data['cards'])
+    save_parse_cache(cache)
     msg = (
         f"Imported {len(new_cards)} cards. "
         f"Total cards: {len(data['cards'])}. "
-        f"Removed {len(removed)} cards."
+        f"Added {len(diff['added'])}, updated {len(diff['updated'])}, "
+        f"removed {len(diff['removed'])} cards."
     )
     print(msg)
+    return diff
+
+
+def read_file_changes(paths, hashes):
+    """Read the markdown files ``paths`` for :func:`apply_file_changes`.
+
+    ``hashes`` maps paths to their cached content hash so unchanged content
+    is not parsed again.  Neither the cards nor the parse cache are touched,
+    so this can run in a background thread while the UI keeps using the
+    data.  Returns ``(path, entry)`` pairs with ``entry`` None for files that
+    no longer exist.
+    """
+    changes = []
+    for path in paths:
+        try:
+            entry, _ = _read_markdown_file(path, hashes.get(path))
+        except FileNotFoundError:
+            entry = None
+        changes.append((path, entry))
+    return changes
+
+
+def _owner_index(files):
+    owners = {}
+    for path in sorted(files, key=_walk_key):
+        for entry in files[path]['entries']:
+            paths = owners.setdefault(entry[0], [])
+            if not paths or paths[-1] != path:
+                paths.append(path)
+    return owners
+
 
+def apply_file_changes(data, changes):
+    """Merge re-read markdown files into ``data``.
 
-def _total_struggle(card):
-    return card['struggle']['J2E'] + card['struggle']['E2J']
+    ``changes`` comes from :func:`read_file_changes`.  Only the cards named
+    in the old or new version of those files are looked at; when several
+    files define the same card the one listed first by a full scan wins, as
+    in :func:`parse_markdown_files`.  Changed cards are written with
+    :func:`~japan_niche.data.record_card`, or together with
+    :func:`~japan_niche.data.save_cards` when cards were removed.  The parse
+    cache is updated in memory and written by the next full scan or
+    :func:`flush_parse_cache`.  Returns the diff in the format of
+    :func:`diff_cards`.
+    """
+    global _owners, _cache_dirty
+    cache = load_parse_cache()
+    if not _cache_matches(cache, data):
+        # The cache does not describe these cards (first run or a crash
+        # before it was written), so only a full scan can merge correctly.
+        return scan_files(data)
+    files = cache['files']
+    if _owners is None:
+        _owners = _owner_index(files)
+    owners = _owners
+
+    affected = set()
+    for path, entry in changes:
+        old = files.get(path)
+        if entry is not None and entry['entries'] is None:
+            if old is not None and old['hash'] == entry['hash']:
+                # Touched but the content is the same.
+                entry['entries'] = old['entries']
+                files[path] = entry
+                continue
+            # A full scan changed the cache while the file was being read.
+            entry, _ = _read_markdown_file(path)
+        if old is not None:
+            for jp in {e[0] for e in old['entries']}:
+                owners[jp].remove(path)
+                if not owners[jp]:
+                    del owners[jp]
+                affected.add(jp)
+            del files[path]
+        if entry is not None:
+            files[path] = entry
+            for jp in {e[0] for e in entry['entries']}:
+                bisect.insort(owners.setdefault(jp, []), path, key=_walk_key)
+                affected.add(jp)
+        _cache_dirty = True
+
+    diff = {'added': [], 'updated': [], 'removed': []}
+    lookups = {}
+    assigned = {}
+    cards = data['cards']
+    search = data.get('_search_index')
+    for cid in affected:
+        paths = owners.get(cid)
+        if not paths:
+            if cid in cards:
+                remove_card(data, cid)
+                diff['removed'].append(cid)
+                if search is not None:
+                    search.remove(cid)
+            continue
+        path = assigned[cid] = paths[0]
+        if path not in lookups:
+            # Reversed so the first entry of a duplicated id wins.
+            lookups[path] = {e[0]: e for e in reversed(files[path]['entries'])}
+        entry = lookups[path][cid]
+        card = new_card(*entry[:4])
+        existing = cards.get(cid)
+        if existing is None:
+            add_card(data, card)
+            diff['added'].append(cid)
+        elif any(existing.get(k) != card[k] for k in CARD_TEXT_FIELDS):
+            for k in CARD_TEXT_FIELDS:
+                existing[k] = card[k]
+            diff['updated'].append(cid)
+        if search is not None:
+            # Only cards of the changed files get here; re-indexing them also
+            # picks up moves to another file or category.
+            search.add(cid, cards[cid], path, entry[4])
+
+    moved = assign_sources(assigned)
+    changed = diff['added'] + diff['updated'] + moved
+    if diff['removed']:
+        save_cards(data, changed + diff['removed'])
+    else:
+        for cid in changed:
+            record_card(data, cid)
+    cache['collection'] = collection_fingerprint(cards)
+    return diff
+
+
+def flush_parse_cache():
+    """Write the parse cache if :func:`apply_file_changes` changed it."""
+    if _cache_dirty:
+        save_parse_cache(_parse_cache)
+
+
+def collection_fingerprint(cards):
+    """Fingerprint of the card ids in ``cards``, whatever their order.
+
+    The parse cache stores it to recognise the collection it was written
+    for; the ids are hashed one by one, so no card is loaded.
+    """
+    total = 0
+    for cid in cards:
+        digest = hashlib.blake2b(cid.encode('utf-8'), digest_size=8).digest()
+        total += int.from_bytes(digest, 'little')
+    return f"{len(cards)}-{total & 0xffffffffffffffff:016x}"
 
 
-def _last_study(card):
-    times = [t for t in card['last_study'].values() if t is not None]
-    return min(times) if times else 0
+def _cache_matches(cache, data):
+    """True if the parse ``cache`` was written for the cards of ``data``."""
+    return cache['collection'] == collection_fingerprint(data['cards'])
+
+
+def assign_card_sources(data):
+    """Tell a backend that stores cards by markdown file where they are.
+
+    The files are taken from the parse cache, so no markdown file is read.
+    Does nothing unless the backend asks for it (see
+    :meth:`~japan_niche.storage.Storage.needs_sources`), e.g. after cards
+    were migrated from a JSON file.  Cards that move are saved.
+    """
+    if not get_storage().needs_sources():
+        return []
+    cards = data['cards']
+    sources = _card_sources(load_parse_cache()['files'])
+    moved = assign_sources({
+        cid: path for cid, (path, _) in sources.items() if cid in cards
+    })
+    if moved:
+        save_cards(data, moved)
+    return moved
+
+
+def _card_sources(files):
+    """``(path, category)`` of every card id in the parse cache ``files``."""
+    sources = {}
+    for path in sorted(files, key=_walk_key):
+        for entry in files[path]['entries']:
+            if entry[0] not in sources:
+                sources[entry[0]] = (path, entry[4])
+    return sources
+
+
+def search_index(data):
+    """Return the search index of ``data``, building it if necessary.
+
+    Scans update an index that was built, so it is only built once per
+    session.
+    """
+    index = data.get('_search_index')
+    if index is None:
+        sources = _card_sources(load_parse_cache()['files'])
+        index = data['_search_index'] = SearchIndex()
+        index.add_many(
+            (cid, card) + sources.get(cid, (None, None))
+            for cid, card in data['cards'].items()
+        )
+    return index
+
+
+def deck_counts(data):
+    """Return the number of cards in the study, review and no_deck decks.
+
+    Indexed backends are asked directly unless writes are still queued on
+    the background writer; the counts then come from the in-memory deck
+    index, so refreshing them after a grade never waits for the disk.
+    """
+    storage = get_storage()
+    if storage.indexed and not storage.pending_writes():
+        return storage.deck_counts()
+    return deck_index(data).counts()
 
 
 def select_review_cards(data, count):
-    review = [c for c in data['cards'].values() if c['deck'] == 'review']
-    review.sort(key=lambda c: (-_total_struggle(c), _last_study(c)))
-    return [c['id'] for c in review[:count]]
+    storage = get_storage()
+    if storage.indexed:
+        return storage.select_review_cards(count)
+    return deck_index(data).top_review(count)
 
 
 def select_new_cards(data, count):
-    no_deck = [
-        c['id'] for c in data['cards'].values() if c['deck'] == 'no_deck'
-    ]
-    return no_deck[:count]
+    storage = get_storage()
+    if storage.indexed:
+        return storage.select_new_cards(count)
+    return list(islice(deck_index(data).ids('no_deck'), count))
+
+
+def graduate(data, cid):
+    """Move a finished card from the study deck to the review deck."""
+    data['cards'][cid].reset_progress()
+    set_deck(data, cid, 'review')
+    data['study_deck'].remove(cid)
+
 
+def apply_rating(data, cid, direction, rating, now=None):
+    """Record ``rating`` (one of ``SCORE_MAP``) for one direction of a card.
 
+    Keeps the last three ratings, recomputes the skill, adds to the struggle
+    for wrong or unsure answers and graduates the card once both directions
+    reach a skill of 2.  The grade is also logged in the review history if
+    one is open (see :mod:`japan_niche.history`).  Returns True if the card
+    graduated.
+    """
+    card = data['cards'][cid]
+    deck = card.get('deck')
+    ratings = card['ratings'][direction]
+    ratings.append(rating)
+    if len(ratings) > 3:
+        ratings.pop(0)
+    card['skill'][direction] = sum(SCORE_MAP[x] for x in ratings)
+    if rating == 'A':
+        card['struggle'][direction] += 3
+    elif rating == 'S':
+        card['struggle'][direction] += 1
+    if now is None:
+        now = datetime.datetime.now().timestamp()
+    card['last_study'][direction] = now
+    record_review(cid, direction, rating, now, deck)
+    if card['skill']['J2E'] >= 2 and card['skill']['E2J'] >= 2:
+        graduate(data, cid)
+        return True
+    return False
+
+
+@timed('start_new_day')
 def start_new_day(data, config):
-    for cid in list(data['study_deck']):
-        card = data['cards'][cid]
-        card['ratings'] = {'J2E': [], 'E2J': []}
-        card['skill'] = {'J2E': 0, 'E2J': 0}
-        card['struggle'] = {'J2E': 0, 'E2J': 0}
+    """Reset the study deck and fill it with new and review cards.
+
+    ``config['new_cards']`` and ``config['review_cards']`` say how many cards
+    are added.  Only picking the review cards depends on the size of the
+    collection and goes through the review engine (see
+    :func:`~japan_niche.decks.use_review_engine`).  The resets stay a loop
+    over the day's cards: progress lives on the :class:`Card` objects, not
+    in the engine's arrays, and there are only a few hundred of them.
+    """
+    cards = data['cards']
+    for cid in data['study_deck']:
+        cards[cid].reset_progress()
     for cid in select_new_cards(data, config['new_cards']):
-        card = data['cards'][cid]
-        card['deck'] = 'study'
-        card['ratings'] = {'J2E': [], 'E2J': []}
-        card['skill'] = {'J2E': 0, 'E2J': 0}
-        card['struggle'] = {'J2E': 0, 'E2J': 0}
+        set_deck(data, cid, 'study')
+        cards[cid].reset_progress()
         data['study_deck'].append(cid)
     for cid in select_review_cards(data, config['review_cards']):
-        card = data['cards'][cid]
-        card['deck'] = 'study'
-        card['ratings'] = {'J2E': [], 'E2J': []}
-        card['skill'] = {'J2E': 0, 'E2J': 0}
-        card['struggle'] = {'J2E': 0, 'E2J': 0}
+        set_deck(data, cid, 'study')
+        cards[cid].reset_progress()
         data['study_deck'].append(cid)
     data['last_session'] = str(datetime.date.today())
-    save_data(data)
+    count('cards_reset', len(data['study_deck']))
+    # Every card of the study deck was reset or added to it.
+    save_cards(data, list(data['study_deck']))
     print(f"New study session with {len(data['study_deck'])} cards.")
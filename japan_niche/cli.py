@@ -0,0 +1,159 @@
+"""Command line interface that works without Qt.
+
+::
+
+    python main.py scan        # synchronize cards with flashcards/
+    python main.py new-day     # start a new study session
+    python main.py stats       # deck counts and study progress
+    python main.py history     # retention and the hardest cards
+    python main.py search mizu # cards matching a query
+    python main.py serve       # study server for several learners
+
+The same commands are available as ``python -m japan_niche.cli``.  Nothing
+here imports PyQt, so these commands start quickly and run on machines
+without a display.
+"""
+
+import os
+import sys
+import argparse
+
+from .data import load_config, close_storage
+from .cards import (
+    deck_counts,
+    resolve_workers,
+    scan_files,
+    search_index,
+    start_new_day,
+)
+from .decks import use_review_engine
+from .history import close_history, get_history, open_history
+from .session import open_collection
+
+
+def cmd_scan(data, config, args):
+    workers = args.workers
+    if workers is None:
+        workers = config.get('ingest_workers', 1)
+    scan_files(data, resolve_workers(workers))
+
+
+def cmd_new_day(data, config, args):
+    use_review_engine(config.get('review_engine', 'auto'))
+    start_new_day(data, config)
+
+
+def cmd_stats(data, config, args):
+    counts = deck_counts(data)
+    print(f"Cards: {len(data['cards'])}")
+    print(f"Study: {counts['study']}")
+    print(f"Review: {counts['review']}")
+    print(f"No Deck: {counts['no_deck']}")
+    print(f"Last session: {data.get('last_session') or 'never'}")
+
+
+def cmd_history(data, config, args):
+    history = get_history() or open_history()
+    days = args.days
+    retention = history.retention(days)
+    trend = history.struggle_trend(days)
+    reviews = sum(day['reviews'] for day in trend)
+    print(f"Reviews in the last {days} days: {reviews}")
+    if retention is not None:
+        print(f"Retention: {retention:.1%}")
+    hardest = history.hardest_cards(days, args.limit)
+    if hardest:
+        print("Hardest cards:")
+        for cid, struggle, count in hardest:
+            print(f"  {cid}: struggle {struggle} in {count} reviews")
+    print("Per day (reviews, struggle):")
+    for day in trend:
+        if day['reviews']:
+            print(f"  {day['date']}: {day['reviews']}, {day['struggle']}")
+
+
+def cmd_search(data, config, args):
+    index = search_index(data)
+    query = ' '.join(args.query)
+    found = index.matches(query)
+    print(f"{len(found)} matches")
+    for cid in index.search(query, args.limit):
+        card = data['cards'][cid]
+        path, category = index.sources[cid]
+        where = os.path.basename(path) if path else '?'
+        if category:
+            where += f" / {category}"
+        print(f"  {card['jp']}  {card['hira']}  {card['en']}  ({where})")
+
+
+def cmd_serve(config, args):
+    from .server import serve
+    workers = args.workers
+    if workers is None:
+        workers = config.get('ingest_workers', 1)
+    serve(config, args.host, args.port, resolve_workers(workers))
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog='main.py',
+        description='Japanese flashcards. Without a command the GUI starts.',
+    )
+    sub = parser.add_subparsers(dest='command', required=True)
+    scan = sub.add_parser('scan', help='synchronize cards with flashcards/')
+    scan.add_argument(
+        '--workers', type=int,
+        help='parser processes, 0 for all CPUs (default: ingest_workers)',
+    )
+    scan.set_defaults(func=cmd_scan)
+    sub.add_parser(
+        'new-day', help='start a new study session'
+    ).set_defaults(func=cmd_new_day)
+    sub.add_parser(
+        'stats', help='show deck counts'
+    ).set_defaults(func=cmd_stats)
+    history = sub.add_parser(
+        'history', help='show retention and the hardest cards'
+    )
+    history.add_argument('--days', type=int, default=30)
+    history.add_argument('--limit', type=int, default=10)
+    history.set_defaults(func=cmd_history)
+    search = sub.add_parser(
+        'search', help='list the cards matching a query'
+    )
+    search.add_argument(
+        'query', nargs='+', help='terms that must all match, e.g. water'
+    )
+    search.add_argument('--limit', type=int, default=20)
+    search.set_defaults(func=cmd_search)
+    serve = sub.add_parser(
+        'serve', help='serve study sessions for several learners over HTTP'
+    )
+    serve.add_argument('--host', default='127.0.0.1')
+    serve.add_argument('--port', type=int, default=8765)
+    serve.add_argument(
+        '--workers', type=int,
+        help='parser processes, 0 for all CPUs (default: ingest_workers)',
+    )
+    # The server keeps one store per learner instead of the collection.
+    serve.set_defaults(func=cmd_serve, collection=False)
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    config = load_config()
+    if not getattr(args, 'collection', True):
+        args.func(config, args)
+        return 0
+    data = open_collection(config)
+    try:
+        args.func(data, config, args)
+    finally:
+        close_history()
+        close_storage()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
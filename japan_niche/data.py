@@ -1,13 +1,35 @@
 import os
 import json
+import atexit
+from .persist import atomic_write
+from .profiling import timed
 
 CONFIG_FILE = 'config.json'
 DATA_FILE = 'flashcard_data.json'
+JOURNAL_FILE = 'flashcard_data.journal'
+SQLITE_FILE = 'flashcard_data.sqlite3'
+BINARY_FILE = 'flashcard_data.snap'
+BINARY_JOURNAL_FILE = 'flashcard_data.snap.journal'
+SHARD_DIR = 'flashcard_shards'
+LEARNER_DIR = 'flashcard_learners'
+
+_storage = None
 
 
 def load_config():
     if not os.path.exists(CONFIG_FILE):
-        config = {"new_cards": 35, "review_cards": 100, "window_size": [80, 24]}
+        config = {
+            "new_cards": 35,
+            "review_cards": 100,
+            "window_size": [80, 24],
+            "storage": "json",
+            "ingest_workers": 1,
+            "save_interval": 1.0,
+            "review_engine": "auto",
+            "watch_files": True,
+            "profile": False,
+            "review_history": True,
+        }
         save_config(config)
     else:
         with open(CONFIG_FILE, 'r', encoding='utf-8') as f:
@@ -16,89 +38,98 @@ def load_config():
 
 
 def save_config(config):
-    with open(CONFIG_FILE, 'w', encoding='utf-8') as f:
-        json.dump(config, f, indent=4)
+    atomic_write(CONFIG_FILE, json.dumps(config, indent=4))
+
+
+def get_storage():
+    """Return the active storage backend, JSON files unless configured."""
+    global _storage
+    if _storage is None:
+        from .storage import JsonStorage
+        _storage = JsonStorage()
+    return _storage
+
+
+def use_storage(config):
+    """Switch to the storage backend named by ``config['storage']``.
+
+    ``config['save_interval']`` seconds (0 to write synchronously) is how
+    often pending changes are written by the background writer.
+    """
+    global _storage
+    from .storage import open_storage
+    close_storage()
+    _storage = open_storage(
+        config.get('storage', 'json'), config.get('save_interval', 0)
+    )
+    return _storage
+
+
+def set_storage(storage):
+    """Make ``storage`` the active backend and return the one it replaces.
+
+    The replaced backend is neither flushed nor closed, so it can be put back
+    with another call.
+    """
+    global _storage
+    previous, _storage = _storage, storage
+    return previous
+
+
+def close_storage():
+    """Write any pending changes and close the active storage backend."""
+    global _storage
+    if _storage is not None:
+        try:
+            _storage.close()
+        finally:
+            _storage = None
+
 
+def check_storage():
+    """Raise :class:`~japan_niche.persist.SaveError` if saves failed.
 
+    Background writes report failures here (and from
+    :func:`close_storage`) since they happen after the call that asked for
+    them returned.
+    """
+    get_storage().check()
+
+
+atexit.register(close_storage)
+
+
+@timed('load_data')
 def load_data():
-    if not os.path.exists(DATA_FILE):
-        return {"cards": {}, "study_deck": [], "last_session": None}
-    with open(DATA_FILE, 'r', encoding='utf-8') as f:
-        data = json.load(f)
-    if _upgrade_data_format(data):
-        save_data(data)
-    return data
+    return get_storage().load()
 
 
+@timed('save_data')
 def save_data(data):
-    with open(DATA_FILE, 'w', encoding='utf-8') as f:
-        json.dump(data, f, indent=4)
-
-
-def _upgrade_data_format(data):
-    """Migrate cards from the old 'front/back' format to the new fields."""
-    changed = False
-    cards = data.get('cards', {})
-    for card in cards.values():
-        # ------------------------------------------------------------------
-        # Convert the original front/back format (pre refactor) to the new
-        # explicit field format (jp/en/pron/hira) used by the GUI.  These old
-        # cards stored all of their information in the ``id`` and ``back``
-        # fields.
-        # ------------------------------------------------------------------
-        if 'jp' not in card or 'en' not in card:
-            parts = card.get('id', '').split('|')
-            if len(parts) >= 5:
-                jp = parts[2]
-                en = parts[3]
-                direction = parts[4]
-            else:
-                continue
-            back = card.get('back', '')
-            import re
-            m = re.match(r"(.+?)\s*\[(.+?)\]\s*\[(.+?)\]", back)
-            if not m:
-                continue
-            val1, pron, hira = m.groups()
-            if direction == 'J2E':
-                en = val1
-            else:
-                jp = val1
-            card.update({
-                'jp': jp,
-                'en': en,
-                'pron': pron,
-                'hira': hira,
-                'direction': direction,
-                'front': jp if direction == 'J2E' else en,
-            })
-            changed = True
-
-        # ------------------------------------------------------------------
-        # Convert rating/skill/struggle fields from a single direction list
-        # into the newer per-direction dictionaries.  Older versions of the
-        # program kept ``ratings`` as a list and ``skill``/``struggle`` as
-        # integers keyed by ``direction``.  The GUI expects dictionaries so
-        # upgrade the structure if necessary.
-        # ------------------------------------------------------------------
-        if not isinstance(card.get('ratings'), dict):
-            direction = card.get('direction', 'J2E')
-            ratings = card.get('ratings', [])
-            skill = card.get('skill', 0)
-            struggle = card.get('struggle', 0)
-            last = card.get('last_study')
-
-            card['ratings'] = {'J2E': [], 'E2J': []}
-            card['ratings'][direction] = ratings
-
-            card['skill'] = {'J2E': 0, 'E2J': 0}
-            card['skill'][direction] = skill
-
-            card['struggle'] = {'J2E': 0, 'E2J': 0}
-            card['struggle'][direction] = struggle
-
-            card['last_study'] = {'J2E': None, 'E2J': None}
-            card['last_study'][direction] = last
-
-            changed = True
-    return changed
+    """Write the whole collection."""
+    get_storage().save(data)
+
+
+def record_card(data, cid):
+    """Persist a change to the single card ``cid`` (and its deck membership)."""
+    get_storage().record_card(data, cid)
+
+
+@timed('save_cards')
+def save_cards(data, cids):
+    """Persist changes to the cards ``cids`` and the study deck.
+
+    ``cids`` may name cards that were removed from ``data['cards']``.
+    Backends that cannot write part of the collection save all of it.
+    """
+    get_storage().save_cards(data, cids)
+
+
+def assign_sources(sources):
+    """Tell the storage backend which markdown file each card comes from.
+
+    ``sources`` maps card ids to file paths.  Returns the ids of the cards
+    that have to be written again because of it, which is none unless the
+    backend partitions the cards by file.
+    """
+    return get_storage().assign_sources(sources)
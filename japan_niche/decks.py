@@ -0,0 +1,275 @@
+"""In-memory index of which cards are in which deck.
+
+The index lives in ``data['_deck_index']`` (keys starting with an underscore
+are derived state and never saved) and is built on first use.  From then on
+every deck transition has to go through :func:`set_deck`, :func:`add_card` or
+:func:`remove_card` so the index stays in step with ``card['deck']``.
+
+Review priorities are kept either in a lazily invalidated heap
+(:class:`ReviewHeap`) or, when NumPy is installed, in the array columns of
+:class:`~japan_niche.vectorized.ReviewColumns`; both return the same cards
+in the same order.  :func:`use_review_engine` picks one.
+"""
+
+import heapq
+
+DECKS = ('study', 'review', 'no_deck')
+REVIEW_ENGINES = ('auto', 'heap', 'numpy')
+
+_review_engine = 'auto'
+
+
+def _total_struggle(card):
+    return card['struggle']['J2E'] + card['struggle']['E2J']
+
+
+def _last_study(card):
+    """Earliest of the per-direction study times, 0 if never studied."""
+    last = card['last_study']
+    j2e = last.get('J2E')
+    e2j = last.get('E2J')
+    if j2e is None:
+        return 0 if e2j is None else e2j
+    if e2j is None:
+        return j2e
+    return min(j2e, e2j)
+
+
+def use_review_engine(name):
+    """Select how review priorities are kept for indexes built from now on.
+
+    ``'heap'`` is pure Python, ``'numpy'`` needs NumPy and ``'auto'`` uses
+    NumPy when it is installed.  Asking for ``'numpy'`` without NumPy prints
+    a warning and falls back to ``'heap'``.  Returns the engine that will be
+    used.
+    """
+    global _review_engine
+    if name not in REVIEW_ENGINES:
+        raise ValueError(
+            f"unknown review engine {name!r}, expected one of "
+            f"{', '.join(REVIEW_ENGINES)}"
+        )
+    if name == 'numpy':
+        from .vectorized import HAVE_NUMPY
+        if not HAVE_NUMPY:
+            print("NumPy is not installed, using the 'heap' review engine.")
+            name = 'heap'
+    _review_engine = name
+    return review_engine()
+
+
+def review_engine():
+    """Name of the engine new indexes use, with ``'auto'`` resolved."""
+    if _review_engine != 'auto':
+        return _review_engine
+    from .vectorized import HAVE_NUMPY
+    return 'numpy' if HAVE_NUMPY else 'heap'
+
+
+class ReviewHeap:
+    """Review cards in a heap ordered by :meth:`DeckIndex.review_key`.
+
+    Entries are invalidated lazily: entries of cards that left the review
+    deck are dropped when they surface, and entries whose key is out of
+    date are pushed again with the current key.
+    """
+
+    def __init__(self, index):
+        self.index = index
+        self.rebuild()
+
+    def rebuild(self):
+        index = self.index
+        self.heap = [(index.review_key(cid), cid) for cid in index.ids('review')]
+        heapq.heapify(self.heap)
+
+    def update(self, cid):
+        if len(self.heap) > 2 * self.index.count('review') + 64:
+            # Mostly stale entries; rebuilding also covers ``cid``.
+            self.rebuild()
+        else:
+            heapq.heappush(self.heap, (self.index.review_key(cid), cid))
+
+    def discard(self, cid):
+        pass
+
+    def top(self, count):
+        """Runs in O(k log N) plus the cost of discarding stale entries."""
+        index = self.index
+        heap = self.heap
+        found = []
+        seen = set()
+        while heap and len(found) < count:
+            key, cid = heapq.heappop(heap)
+            if index.deck_of.get(cid) != 'review' or cid in seen:
+                continue
+            current = index.review_key(cid)
+            if current != key:
+                heapq.heappush(heap, (current, cid))
+                continue
+            seen.add(cid)
+            found.append((key, cid))
+        for entry in found:
+            heapq.heappush(heap, entry)
+        return [cid for _, cid in found]
+
+
+class DeckIndex:
+    """Per-deck membership sets and counts.
+
+    Members of each deck are kept in insertion-ordered dicts.  Cards only
+    enter ``no_deck`` when they are first added, so iterating ``no_deck``
+    yields cards in the same order as ``data['cards']``.  ``seq`` records each
+    card's position in ``data['cards']`` so other decks can be ordered the
+    same way.
+
+    Review cards are also kept ordered by :meth:`review_key` by the review
+    engine (see :func:`use_review_engine`) so :meth:`top_review` can return
+    the most urgent cards without sorting the whole review deck.  Code that
+    changes ``struggle`` or ``last_study`` of a card that is already in the
+    review deck must call :meth:`update`.
+    """
+
+    def __init__(self, cards=None, engine=None):
+        self.cards = {} if cards is None else cards
+        self.decks = {deck: {} for deck in DECKS}
+        self.deck_of = {}
+        self.seq = {}
+        self._next_seq = 0
+        for cid, card in self.cards.items():
+            deck = card.get('deck', 'no_deck')
+            self.decks.setdefault(deck, {})[cid] = None
+            self.deck_of[cid] = deck
+            self.seq[cid] = self._next_seq
+            self._next_seq += 1
+        # The review engine is built by the first :meth:`top_review`, so
+        # only counting cards never pays for ranking them.
+        self.engine = engine
+        self._review = None
+
+    def add(self, cid, deck):
+        if cid in self.deck_of:
+            self.move(cid, deck)
+            return
+        self.decks.setdefault(deck, {})[cid] = None
+        self.deck_of[cid] = deck
+        self.seq[cid] = self._next_seq
+        self._next_seq += 1
+        self.update(cid)
+
+    def remove(self, cid):
+        if self.deck_of[cid] == 'review' and self._review is not None:
+            self._review.discard(cid)
+        deck = self.deck_of.pop(cid)
+        del self.decks[deck][cid]
+        del self.seq[cid]
+
+    def move(self, cid, deck):
+        old = self.deck_of[cid]
+        if old == deck:
+            return
+        if old == 'review' and self._review is not None:
+            self._review.discard(cid)
+        del self.decks[old][cid]
+        self.decks.setdefault(deck, {})[cid] = None
+        self.deck_of[cid] = deck
+        self.update(cid)
+
+    def update(self, cid):
+        """Re-prioritize ``cid`` after its struggle or last study changed."""
+        if self.deck_of.get(cid) == 'review' and self._review is not None:
+            self._review.update(cid)
+
+    def review_key(self, cid):
+        """Sort key of a review card: highest struggle, then oldest study.
+
+        Ties are broken by the position of the card in ``data['cards']``.
+        """
+        card = self.cards[cid]
+        return (-_total_struggle(card), _last_study(card), self.seq[cid])
+
+    def top_review(self, count):
+        """Return the ids of the first ``count`` review cards by priority."""
+        if count <= 0:
+            return []
+        if self._review is None:
+            self.engine = self.engine or review_engine()
+            if self.engine == 'numpy':
+                from .vectorized import ReviewColumns
+                self._review = ReviewColumns(self)
+            else:
+                self._review = ReviewHeap(self)
+        return self._review.top(count)
+
+    def ids(self, deck):
+        """Iterate over the ids of the cards in ``deck``."""
+        return iter(self.decks.get(deck, ()))
+
+    def count(self, deck):
+        return len(self.decks.get(deck, ()))
+
+    def counts(self):
+        return {deck: self.count(deck) for deck in DECKS}
+
+    def verify(self, cards):
+        """Compare the index with a full recount of ``cards``.
+
+        Returns a list of human readable mismatches, empty when the index is
+        consistent.
+        """
+        problems = []
+        recount = DeckIndex(cards)
+        for deck in set(self.decks) | set(recount.decks):
+            if self.count(deck) != recount.count(deck):
+                problems.append(
+                    f"deck '{deck}' has {self.count(deck)} cards in the "
+                    f"index but {recount.count(deck)} in the data"
+                )
+        for cid, card in cards.items():
+            deck = card.get('deck', 'no_deck')
+            if self.deck_of.get(cid) != deck:
+                problems.append(
+                    f"card '{cid}' is indexed in '{self.deck_of.get(cid)}' "
+                    f"but its deck is '{deck}'"
+                )
+        for cid in self.deck_of:
+            if cid not in cards:
+                problems.append(f"card '{cid}' is indexed but does not exist")
+        order = [cid for cid in cards if cid in self.seq]
+        if order != sorted(order, key=self.seq.__getitem__):
+            problems.append("card order in the index differs from the data")
+        elif not problems:
+            expected = sorted(self.ids('review'), key=self.review_key)
+            if self.top_review(len(expected)) != expected:
+                problems.append("review priority order is out of date")
+        return problems
+
+
+def deck_index(data):
+    """Return the deck index of ``data``, building it if necessary."""
+    index = data.get('_deck_index')
+    if index is None:
+        index = data['_deck_index'] = DeckIndex(data['cards'])
+    return index
+
+
+def set_deck(data, cid, deck):
+    """Move card ``cid`` to ``deck``."""
+    data['cards'][cid]['deck'] = deck
+    deck_index(data).move(cid, deck)
+
+
+def add_card(data, card):
+    """Add a new card to ``data['cards']``."""
+    # Build the index before inserting so the card is added exactly once.
+    index = deck_index(data)
+    data['cards'][card['id']] = card
+    index.add(card['id'], card.get('deck', 'no_deck'))
+
+
+def remove_card(data, cid):
+    """Remove card ``cid`` from ``data['cards']`` and the study deck."""
+    index = deck_index(data)
+    data['cards'].pop(cid)
+    data['study_deck'].discard(cid)
+    index.remove(cid)
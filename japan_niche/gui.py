@@ -1,10 +1,15 @@
-import random
-import datetime
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
 from PyQt5.QtWidgets import (
     QWidget,
     QVBoxLayout,
     QHBoxLayout,
     QLabel,
+    QLineEdit,
+    QListWidget,
     QPushButton,
     QMessageBox,
     QStackedWidget,
@@ -12,33 +17,188 @@ from PyQt5.QtWidgets import (
     QStyle,
 )
 from PyQt5.QtGui import QFont
-from PyQt5.QtCore import Qt
-
-# Mapping of hiragana characters to their romanized pronunciations used for
-# displaying per-character readings on the reveal card.
-HIRAGANA_PRONUNCIATIONS = {
-    'あ': 'a', 'い': 'i', 'う': 'u', 'え': 'e', 'お': 'o',
-    'か': 'ka', 'き': 'ki', 'く': 'ku', 'け': 'ke', 'こ': 'ko',
-    'が': 'ga', 'ぎ': 'gi', 'ぐ': 'gu', 'げ': 'ge', 'ご': 'go',
-    'さ': 'sa', 'し': 'shi', 'す': 'su', 'せ': 'se', 'そ': 'so',
-    'ざ': 'za', 'じ': 'ji', 'ず': 'zu', 'ぜ': 'ze', 'ぞ': 'zo',
-    'た': 'ta', 'ち': 'chi', 'つ': 'tsu', 'て': 'te', 'と': 'to',
-    'だ': 'da', 'ぢ': 'ji', 'づ': 'zu', 'で': 'de', 'ど': 'do',
-    'な': 'na', 'に': 'ni', 'ぬ': 'nu', 'ね': 'ne', 'の': 'no',
-    'は': 'ha', 'ひ': 'hi', 'ふ': 'fu', 'へ': 'he', 'ほ': 'ho',
-    'ば': 'ba', 'び': 'bi', 'ぶ': 'bu', 'べ': 'be', 'ぼ': 'bo',
-    'ぱ': 'pa', 'ぴ': 'pi', 'ぷ': 'pu', 'ぺ': 'pe', 'ぽ': 'po',
-    'ま': 'ma', 'み': 'mi', 'む': 'mu', 'め': 'me', 'も': 'mo',
-    'や': 'ya', 'ゆ': 'yu', 'よ': 'yo',
-    'ら': 'ra', 'り': 'ri', 'る': 'ru', 'れ': 're', 'ろ': 'ro',
-    'わ': 'wa', 'を': 'wo', 'ん': 'n',
-    'ゃ': 'ya', 'ゅ': 'yu', 'ょ': 'yo',
-    'っ': 'tsu', 'ゎ': 'wa',
-    'ー': '-',
-}
-
-from .data import load_config, load_data, save_data
-from .cards import scan_files, start_new_day, SCORE_MAP
+from PyQt5.QtCore import (
+    Qt,
+    QObject,
+    QTimer,
+    QFileSystemWatcher,
+    pyqtSignal,
+)
+
+from .data import load_config, check_storage, close_storage
+from .cards import (
+    FLASHCARD_DIR,
+    scan_files,
+    load_parse_cache,
+    read_file_changes,
+    apply_file_changes,
+    flush_parse_cache,
+    start_new_day,
+    deck_counts,
+    resolve_workers,
+    search_index,
+)
+from .decks import use_review_engine
+from .history import close_history
+from .kana import segments, warm
+from .persist import SaveError
+from .profiling import timed
+from .session import StudySession, open_collection
+
+# Number of recent reveals kept for the latency report.
+REVEAL_SAMPLES = 500
+# Search results listed below the search field.
+SEARCH_RESULTS = 50
+
+# Quiet period after the last file system event before changed files are
+# read, so a burst of saves is merged in one go.
+WATCH_DEBOUNCE_MS = 200
+
+
+class MarkdownWatcher(QObject):
+    """Merge edits to the markdown files into the running session.
+
+    Only the files reported by ``QFileSystemWatcher`` are read again.  They
+    are parsed in a worker thread and merged into ``data`` on the GUI thread
+    with :func:`~japan_niche.cards.apply_file_changes`; ``merged`` is emitted
+    with the resulting diff when any card changed.
+    """
+
+    parsed = pyqtSignal(object)
+    merged = pyqtSignal(dict)
+
+    def __init__(self, data, parent=None):
+        super().__init__(parent)
+        self.data = data
+        self.known = set()
+        self.pending = set()
+        self.pending_dirs = set()
+        self.busy = False
+        self.stopped = False
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.watcher = QFileSystemWatcher(self)
+        self.watcher.fileChanged.connect(self._file_changed)
+        self.watcher.directoryChanged.connect(self._dir_changed)
+        self.timer = QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setInterval(WATCH_DEBOUNCE_MS)
+        self.timer.timeout.connect(self._start_read)
+        self.parsed.connect(self._merge)
+        if os.path.isdir(FLASHCARD_DIR):
+            self._watch_tree(FLASHCARD_DIR)
+
+    def _watch_tree(self, root):
+        """Watch ``root`` and everything below it.
+
+        Returns the ``.md`` files that were not watched before.
+        """
+        found = set()
+        dirs = []
+        for dirpath, _, files in os.walk(root):
+            dirs.append(dirpath)
+            found.update(
+                os.path.join(dirpath, f) for f in files if f.endswith('.md')
+            )
+        self.watcher.addPaths(dirs)
+        new = found - self.known
+        if new:
+            self.watcher.addPaths(sorted(new))
+            self.known |= new
+        return new
+
+    def _file_changed(self, path):
+        self.pending.add(path)
+        self.timer.start()
+
+    def _dir_changed(self, path):
+        self.pending_dirs.add(path)
+        self.timer.start()
+
+    def _start_read(self):
+        if self.busy:
+            # Picked up again once the running read was merged.
+            return
+        paths, self.pending = self.pending, set()
+        for d in self.pending_dirs:
+            prefix = d + os.sep
+            gone = {p for p in self.known if p.startswith(prefix)
+                    and not os.path.exists(p)}
+            self.known -= gone
+            paths |= gone
+            if os.path.isdir(d):
+                paths |= self._watch_tree(d)
+        self.pending_dirs = set()
+        if not paths:
+            return
+        # Editors that save by replacing the file drop it from the watch.
+        watched = set(self.watcher.files())
+        for path in paths:
+            if path not in watched and os.path.exists(path):
+                self.watcher.addPath(path)
+        files = load_parse_cache()['files']
+        hashes = {p: files[p]['hash'] for p in paths if p in files}
+        self.busy = True
+        future = self.executor.submit(
+            read_file_changes, sorted(paths), hashes
+        )
+        future.add_done_callback(self._read_done)
+
+    def _read_done(self, future):
+        # Runs in the worker thread; the signal is delivered on the GUI
+        # thread.
+        try:
+            changes = future.result()
+        except Exception as exc:
+            changes = exc
+        self.parsed.emit(changes)
+
+    def _merge(self, changes):
+        self.busy = False
+        if self.stopped:
+            return
+        if isinstance(changes, Exception):
+            print(f"Could not read changed flashcard files: {changes}")
+        else:
+            diff = apply_file_changes(self.data, changes)
+            if diff['added'] or diff['updated'] or diff['removed']:
+                self.merged.emit(diff)
+        if self.pending or self.pending_dirs:
+            self.timer.start()
+
+    def stop(self):
+        self.stopped = True
+        self.timer.stop()
+        self.watcher.blockSignals(True)
+        self.executor.shutdown(wait=True)
+
+
+class HiraCell(QWidget):
+    """One kana of the reveal card with its reading underneath.
+
+    Cells are pooled by :class:`StudyWidget` and only get new text on each
+    reveal.
+    """
+
+    def __init__(self, char_font, roman_font):
+        super().__init__()
+        self.char_lbl = QLabel()
+        self.char_lbl.setAlignment(Qt.AlignHCenter)
+        self.char_lbl.setFont(char_font)
+        self.roman_lbl = QLabel()
+        self.roman_lbl.setAlignment(Qt.AlignHCenter)
+        self.roman_lbl.setFont(roman_font)
+        self.roman_lbl.setStyleSheet('color: gray')
+
+        vbox = QVBoxLayout()
+        vbox.setSpacing(12)
+        vbox.setContentsMargins(0, 0, 0, 0)
+        vbox.addWidget(self.char_lbl)
+        vbox.addWidget(self.roman_lbl)
+        self.setLayout(vbox)
+
+    def set_text(self, char, roman):
+        self.char_lbl.setText(char)
+        self.roman_lbl.setText(roman)
 
 
 class StudyWidget(QWidget):
@@ -48,6 +208,7 @@ class StudyWidget(QWidget):
         self.cid = None
         self.card = None
         self.direction = 'J2E'
+        self.session = None
 
         self.front_label = QLabel()
         self.front_label.setAlignment(Qt.AlignCenter)
@@ -76,6 +237,15 @@ class StudyWidget(QWidget):
         self.hira_layout.setSpacing(8)
         self.hira_container = QWidget()
         self.hira_container.setLayout(self.hira_layout)
+        # Cells are created when a longer word than any before comes up and
+        # hidden rather than destroyed, so reveals reuse them.
+        self.hira_cells = []
+        self.char_font = QFont('Arial', 32)
+        self.roman_font = QFont('Arial', 14)
+        # (kana, reading) pairs of the current card, prepared while the
+        # question is on screen.
+        self.segments = []
+        self.reveal_ms = deque(maxlen=REVEAL_SAMPLES)
 
         self.status_label = QLabel()
         self.status_label.setAlignment(Qt.AlignRight)
@@ -121,14 +291,38 @@ class StudyWidget(QWidget):
         self.btn_easy.clicked.connect(lambda: self.rate('F'))
 
     def _clear_hira_layout(self):
-        """Remove all widgets from the hiragana display layout."""
-        while self.hira_layout.count():
-            item = self.hira_layout.takeAt(0)
-            widget = item.widget()
-            if widget is not None:
-                widget.deleteLater()
-
-    def start_session(self):
+        """Hide the hiragana cells of the previous reveal."""
+        for cell in self.hira_cells:
+            if not cell.isHidden():
+                cell.hide()
+
+    def _prepare_answer(self):
+        """Compute the readings of the current card and size the pool."""
+        self.segments = segments(self.card.get('hira', ''))
+        while len(self.hira_cells) < len(self.segments):
+            cell = HiraCell(self.char_font, self.roman_font)
+            cell.hide()
+            self.hira_layout.addWidget(cell)
+            self.hira_cells.append(cell)
+
+    def reveal_report(self):
+        """Summarize the latency of the recent reveals."""
+        if not self.reveal_ms:
+            return 'No reveals yet.'
+        times = sorted(self.reveal_ms)
+        median = times[len(times) // 2]
+        p95 = times[min(len(times) - 1, int(len(times) * 0.95))]
+        return (
+            f"Reveal latency over {len(times)} reveals: median "
+            f"{median:.2f} ms, 95th percentile {p95:.2f} ms, "
+            f"max {times[-1]:.2f} ms."
+        )
+
+    def start_session(self, only=None):
+        data = self.main_window.data
+        self.session = StudySession(data, only=only)
+        study = data['study_deck'] if only is None else self.session.only
+        warm(data['cards'][cid].get('hira', '') for cid in study)
         self.next_card()
         self.setFocus()
 
@@ -146,37 +340,24 @@ class StudyWidget(QWidget):
         else:
             super().keyPressEvent(event)
 
-    def next_card(self):
-        if not self.main_window.data['study_deck']:
-            QMessageBox.information(self, 'Done', 'Study session complete!')
-            self.main_window.show_menu()
-            return
-        while True:
-            if not self.main_window.data['study_deck']:
-                QMessageBox.information(self, 'Done', 'Study session complete!')
-                self.main_window.show_menu()
-                return
-
-            self.cid = random.choice(self.main_window.data['study_deck'])
-            self.card = self.main_window.data['cards'][self.cid]
+    def _session_done(self):
+        if self.reveal_ms:
+            print(self.reveal_report())
+        QMessageBox.information(self, 'Done', 'Study session complete!')
+        self.main_window.show_menu()
 
-            directions = [
-                d for d in ('J2E', 'E2J') if self.card['skill'].get(d, 0) < 2
-            ]
-
-            if directions:
-                self.direction = random.choice(directions)
-                break
-
-            # If no directions remain, the card is finished. Move to review and
-            # continue selecting another card.
-            self.card['deck'] = 'review'
-            self.card['ratings'] = {'J2E': [], 'E2J': []}
-            self.card['skill'] = {'J2E': 0, 'E2J': 0}
-            self.card['struggle'] = {'J2E': 0, 'E2J': 0}
-            self.main_window.data['study_deck'].remove(self.cid)
-            save_data(self.main_window.data)
+    def next_card(self):
+        session = self.session
+        graduated = session.graduated
+        picked = session.next_card()
+        if session.graduated != graduated:
+            # Finished cards were moved to the review deck on the way.
             self.main_window.update_counts()
+        if picked is None:
+            self._session_done()
+            return
+        self.cid, self.direction = picked
+        self.card = session.card
 
         front = self.card['jp'] if self.direction == 'J2E' else self.card['en']
         self.front_label.setText(front)
@@ -188,6 +369,7 @@ class StudyWidget(QWidget):
         ):
             lbl.setText('')
         self._clear_hira_layout()
+        self._prepare_answer()
         self.show_btn.setEnabled(True)
         for btn in (
             self.btn_wrong,
@@ -197,13 +379,14 @@ class StudyWidget(QWidget):
         ):
             btn.setEnabled(False)
 
+    @timed('show_answer')
     def show_answer(self):
+        start = time.perf_counter()
         c = self.card
         direction = self.direction
         jp = c.get('jp', '')
         en = c.get('en', '')
         pron = c.get('pron', '')
-        hira = c.get('hira', '')
 
         if direction == 'E2J':
             answer = jp
@@ -215,27 +398,9 @@ class StudyWidget(QWidget):
         self.desc_label.setText(answer)
         self.pron_label.setText(f"[{pron}]")
         self.jp_label.setText(extra)
-        self._clear_hira_layout()
-        for char in hira:
-            char_lbl = QLabel(char)
-            char_lbl.setAlignment(Qt.AlignHCenter)
-            char_lbl.setFont(QFont('Arial', 32))
-
-            roman = HIRAGANA_PRONUNCIATIONS.get(char, char)
-            roman_lbl = QLabel(roman)
-            roman_lbl.setAlignment(Qt.AlignHCenter)
-            roman_lbl.setFont(QFont('Arial', 14))
-            roman_lbl.setStyleSheet('color: gray')
-
-            vbox = QVBoxLayout()
-            vbox.setSpacing(12)
-            vbox.setContentsMargins(0, 0, 0, 0)
-            vbox.addWidget(char_lbl)
-            vbox.addWidget(roman_lbl)
-
-            w = QWidget()
-            w.setLayout(vbox)
-            self.hira_layout.addWidget(w)
+        for cell, (char, roman) in zip(self.hira_cells, self.segments):
+            cell.set_text(char, roman)
+            cell.show()
 
         self.status_label.setText(
             f"Score: {c['skill'][direction]}  Struggle: {c['struggle'][direction]}"
@@ -248,27 +413,22 @@ class StudyWidget(QWidget):
             self.btn_easy,
         ):
             btn.setEnabled(True)
+        # Time spent updating the widgets; painting follows in the event loop.
+        self.reveal_ms.append((time.perf_counter() - start) * 1000)
+
+    def cards_changed(self, diff):
+        """Follow markdown edits to the card on screen."""
+        showing = self.main_window.stack.currentWidget() is self
+        if self.cid is None or not showing:
+            return
+        if self.cid in diff['removed']:
+            self.next_card()
+        elif self.cid in diff['updated'] and self.show_btn.isEnabled():
+            self._prepare_answer()
 
     def rate(self, rating):
-        card = self.card
-        dir_ = self.direction
-        card['ratings'][dir_].append(rating)
-        if len(card['ratings'][dir_]) > 3:
-            card['ratings'][dir_].pop(0)
-        card['skill'][dir_] = sum(SCORE_MAP[x] for x in card['ratings'][dir_])
-        if rating == 'A':
-            card['struggle'][dir_] += 3
-        elif rating == 'S':
-            card['struggle'][dir_] += 1
-        card['last_study'][dir_] = datetime.datetime.now().timestamp()
-        if card['skill']['J2E'] >= 2 and card['skill']['E2J'] >= 2:
-            card['deck'] = 'review'
-            card['ratings'] = {'J2E': [], 'E2J': []}
-            card['skill'] = {'J2E': 0, 'E2J': 0}
-            card['struggle'] = {'J2E': 0, 'E2J': 0}
-            self.main_window.data['study_deck'].remove(self.cid)
-        save_data(self.main_window.data)
-        self.main_window.update_counts()
+        if self.session.grade(rating) is not None:
+            self.main_window.update_counts()
         self.next_card()
 
 
@@ -276,9 +436,17 @@ class MainWindow(QWidget):
     def __init__(self):
         super().__init__()
         self.config = load_config()
-        self.data = load_data()
+        self.data = open_collection(self.config)
+        use_review_engine(self.config.get('review_engine', 'auto'))
+        self.ingest_workers = resolve_workers(
+            self.config.get('ingest_workers', 1)
+        )
         if not self.data['cards']:
-            scan_files(self.data)
+            scan_files(self.data, self.ingest_workers)
+        self.watcher = None
+        if self.config.get('watch_files', True):
+            self.watcher = MarkdownWatcher(self.data, self)
+            self.watcher.merged.connect(self.files_merged)
 
         self.setWindowTitle('Japanese Flashcards')
 
@@ -298,22 +466,65 @@ class MainWindow(QWidget):
     def create_menu(self):
         widget = QWidget()
         layout = QVBoxLayout()
-        layout.addStretch()
+        self.search_edit = QLineEdit()
+        self.search_edit.setPlaceholderText(
+            'Search cards, e.g. water, みず or category:verbs'
+        )
+        self.search_edit.textChanged.connect(self.update_search)
+        self.search_count = QLabel()
+        self.search_list = QListWidget()
+        layout.addWidget(self.search_edit)
+        layout.addWidget(self.search_count)
+        layout.addWidget(self.search_list)
         widget.setLayout(layout)
         return widget
 
+    def search_query(self):
+        return self.search_edit.text().strip()
+
+    def update_search(self):
+        """List the cards matching the search field as it is typed."""
+        query = self.search_query()
+        self.search_list.clear()
+        if not query:
+            self.search_count.clear()
+            return
+        index = search_index(self.data)
+        found = index.matches(query)
+        deck = self.data['study_deck']
+        studying = sum(1 for cid in found if cid in deck)
+        self.search_count.setText(
+            f"{len(found)} matches, {studying} in the study deck"
+        )
+        cards = self.data['cards']
+        for cid in index.search(query, SEARCH_RESULTS):
+            card = cards[cid]
+            self.search_list.addItem(
+                f"{card['jp']}  {card['hira']}  {card['en']}"
+            )
+
     def show_menu(self):
         self.stack.setCurrentWidget(self.menu_widget)
+        self.update_search()
 
     def start_study(self):
-        if not self.data['study_deck']:
+        """Study the study deck, or only its cards matching the search."""
+        only = None
+        query = self.search_query()
+        if query:
+            deck = self.data['study_deck']
+            only = [
+                cid for cid in search_index(self.data).matches(query)
+                if cid in deck
+            ]
+        if not self.data['study_deck'] or only == []:
             QMessageBox.information(self, 'Study', 'No cards to study.')
             return
-        self.study_widget.start_session()
+        self.study_widget.start_session(only)
         self.stack.setCurrentWidget(self.study_widget)
 
     def scan_files(self):
-        scan_files(self.data)
+        scan_files(self.data, self.ingest_workers)
         QMessageBox.information(self, 'Scan', 'Files scanned.')
         self.update_counts()
 
@@ -326,6 +537,24 @@ class MainWindow(QWidget):
         )
         self.update_counts()
 
+    def files_merged(self, diff):
+        self.study_widget.cards_changed(diff)
+        self.update_counts()
+
+    def closeEvent(self, event):
+        if self.watcher is not None:
+            self.watcher.stop()
+        flush_parse_cache()
+        close_history()
+        try:
+            close_storage()
+        except SaveError as e:
+            QMessageBox.critical(
+                self, 'Saving failed',
+                f"Your latest progress could not be saved.\n\n{e}",
+            )
+        super().closeEvent(event)
+
     def create_toolbar(self):
         layout = QHBoxLayout()
 
@@ -351,13 +580,22 @@ class MainWindow(QWidget):
             layout.addWidget(lbl)
         return layout
 
+    def check_saved(self):
+        """Tell the user when background writes of their progress failed."""
+        try:
+            check_storage()
+        except SaveError as e:
+            QMessageBox.warning(
+                self, 'Saving failed',
+                f"Your progress could not be saved.\n\n{e}",
+            )
+
     def update_counts(self):
-        counts = {'study': 0, 'review': 0, 'no_deck': 0}
-        for card in self.data['cards'].values():
-            deck = card.get('deck', 'no_deck')
-            if deck in counts:
-                counts[deck] += 1
+        self.check_saved()
+        counts = deck_counts(self.data)
         self.lbl_study.setText(f"Study: {counts['study']}")
         self.lbl_review.setText(f"Review: {counts['review']}")
         self.lbl_no.setText(f"No Deck: {counts['no_deck']}")
+        if self.stack.currentWidget() is self.menu_widget:
+            self.update_search()
 
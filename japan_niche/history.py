@@ -0,0 +1,447 @@
+"""Append-only log of every grade.
+
+Cards only keep their last three ratings, and those are reset by New Day and
+graduation.  :class:`ReviewHistory` keeps every grade instead, as columns of
+fixed-size values in ``flashcard_history/``: one file per column (card
+number, direction, rating, deck and time) plus ``ids.txt`` with the card id
+of each card number.  Grades are only ever appended, so a record costs 15
+bytes on disk and the columns load with a single read each.  With an
+``interval`` the records are written by a background
+:class:`~japan_niche.persist.PersistenceWorker` at most once per interval
+instead of after every grade.  After a crash the columns are cut back to the
+last complete record.
+
+Per-day and per-card rating counts are updated with every grade and saved
+in ``aggregates.json`` when the log is closed, together with the number of
+records they cover, so opening a long history only folds in the records
+written since.  Retention and struggle trends read the per-day counts;
+:meth:`ReviewHistory.hardest_cards` scans only the records of the requested
+days, which are found by bisecting the time column, with NumPy when it is
+installed.  Grades logged with an earlier time than the one before (after
+the clock was set back) leave the column out of order; the records are then
+filtered by time instead.
+"""
+
+import os
+import json
+import time
+import array
+import atexit
+import bisect
+import datetime
+import functools
+from itertools import islice
+
+from .decks import DECKS
+from .persist import PersistenceWorker, atomic_write
+
+HISTORY_DIR = 'flashcard_history'
+IDS_FILE = 'ids.txt'
+AGGREGATES_FILE = 'aggregates.json'
+# Column name and array type code; card is an index into ids.txt.
+COLUMNS = (
+    ('card', 'I'),
+    ('direction', 'B'),
+    ('rating', 'B'),
+    ('deck', 'B'),
+    ('time', 'd'),
+)
+RATINGS = 'ASDF'
+DIRECTIONS = ('J2E', 'E2J')
+# Struggle added by each rating, as in ``cards.apply_rating``.
+STRUGGLE_POINTS = (3, 1, 0, 0)
+UNKNOWN_DECK = 255
+
+_history = None
+
+
+def _day(timestamp):
+    return datetime.date.fromtimestamp(timestamp).toordinal()
+
+
+def _day_start(ordinal):
+    """Timestamp of local midnight at the start of day ``ordinal``."""
+    day = datetime.date.fromordinal(ordinal)
+    return datetime.datetime(day.year, day.month, day.day).timestamp()
+
+
+def _numpy():
+    """NumPy, or None when it is not installed.
+
+    Imported on first use so commands that never rank cards do not pay for
+    loading it.
+    """
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+
+def _is_sorted(col):
+    np = _numpy()
+    if np is not None:
+        times = np.frombuffer(col, dtype=np.float64)
+        return bool(np.all(times[1:] >= times[:-1]))
+    return all(a <= b for a, b in zip(col, islice(col, 1, None)))
+
+
+class ReviewHistory:
+    """The grade log in ``path`` with its aggregates.
+
+    ``days`` maps a date ordinal to the number of A, S, D and F grades that
+    day.  ``cards`` maps a card number to its A, S, D and F counts and the
+    time of its last grade.  With a positive ``interval`` (in seconds) new
+    records are written in the background; :meth:`flush` and :meth:`close`
+    wait for them.
+
+    Nothing is read or created in ``path`` until the first grade is recorded
+    or the history is queried, so opening it costs nothing for commands that
+    never grade.
+    """
+
+    def __init__(self, path=HISTORY_DIR, interval=0):
+        self.path = path
+        self.interval = interval
+        self._loaded = False
+
+    def _load(self):
+        """Read the columns and aggregates on first use."""
+        if self._loaded:
+            return
+        self._loaded = True
+        path = self.path
+        os.makedirs(path, exist_ok=True)
+        ids_path = os.path.join(path, IDS_FILE)
+        self.ids = []
+        if os.path.exists(ids_path):
+            with open(ids_path, 'r', encoding='utf-8') as f:
+                self.ids = [line.rstrip('\n') for line in f]
+        self.number = {cid: i for i, cid in enumerate(self.ids)}
+        self._ids_file = open(ids_path, 'a', encoding='utf-8')
+
+        self.columns = {}
+        for name, code in COLUMNS:
+            col = array.array(code)
+            col_path = self._column_path(name)
+            if os.path.exists(col_path):
+                with open(col_path, 'rb') as f:
+                    col.frombytes(f.read())
+            self.columns[name] = col
+        # A crash between column writes leaves some columns a record ahead.
+        length = min(len(col) for col in self.columns.values())
+        for name, col in self.columns.items():
+            if len(col) > length:
+                del col[length:]
+                with open(self._column_path(name), 'r+b') as f:
+                    f.truncate(length * col.itemsize)
+        self._files = {
+            name: open(self._column_path(name), 'ab')
+            for name, _ in COLUMNS
+        }
+        self._written = length
+        self._ids_written = len(self.ids)
+        # Whether the time column is in order, so it can be bisected.
+        self._sorted = _is_sorted(self.columns['time'])
+        self.worker = None
+        if self.interval > 0:
+            self.worker = PersistenceWorker(self.interval)
+        self._load_aggregates()
+
+    def _column_path(self, name):
+        return os.path.join(self.path, name + '.col')
+
+    def __len__(self):
+        self._load()
+        return len(self.columns['time'])
+
+    def record(self, cid, direction, rating, when, deck=None):
+        """Append one grade and update the aggregates."""
+        self._load()
+        number = self.number.get(cid)
+        if number is None:
+            number = self.number[cid] = len(self.ids)
+            self.ids.append(cid)
+        cols = self.columns
+        cols['card'].append(number)
+        cols['direction'].append(DIRECTIONS.index(direction))
+        cols['rating'].append(RATINGS.index(rating))
+        cols['deck'].append(
+            DECKS.index(deck) if deck in DECKS else UNKNOWN_DECK
+        )
+        if self._sorted and len(self) and when < cols['time'][-1]:
+            self._sorted = False
+        cols['time'].append(when)
+        self._fold(len(self) - 1)
+        if self.worker is None:
+            self.flush()
+        else:
+            self.worker.submit(self._capture(), owner=self)
+
+    def _capture(self):
+        """Take the records not written yet; returns the job writing them."""
+        ids = self.ids[self._ids_written:]
+        chunks = {
+            name: self.columns[name][self._written:].tobytes()
+            for name in self._files
+        }
+        self._ids_written = len(self.ids)
+        self._written = len(self)
+        return functools.partial(self._write, ids, chunks)
+
+    def _write(self, ids, chunks):
+        # The ids go first so every card number on disk has its id.
+        if ids:
+            self._ids_file.write(''.join(cid + '\n' for cid in ids))
+            self._ids_file.flush()
+        for name, f in self._files.items():
+            f.write(chunks[name])
+            f.flush()
+
+    def flush(self):
+        """Append the records not yet written to the column files.
+
+        With a background writer this waits until they are written and
+        raises :class:`~japan_niche.persist.SaveError` if that failed.
+        """
+        if not self._loaded:
+            return
+        if self._written < len(self):
+            job = self._capture()
+            if self.worker is None:
+                job()
+            else:
+                self.worker.submit(job, owner=self)
+        if self.worker is not None:
+            self.worker.flush(self)
+
+    def close(self):
+        if not self._loaded:
+            return
+        try:
+            self.flush()
+        finally:
+            try:
+                if self.worker is not None:
+                    self.worker.close()
+            finally:
+                self.save_aggregates()
+                for f in self._files.values():
+                    f.close()
+                self._ids_file.close()
+
+    def _fold(self, i):
+        cols = self.columns
+        rating = cols['rating'][i]
+        when = cols['time'][i]
+        day = _day(when)
+        counts = self.days.get(day)
+        if counts is None:
+            counts = self.days[day] = [0, 0, 0, 0]
+        counts[rating] += 1
+        number = cols['card'][i]
+        card = self.cards.get(number)
+        if card is None:
+            card = self.cards[number] = [0, 0, 0, 0, when]
+        card[rating] += 1
+        if when > card[4]:
+            card[4] = when
+        self._folded = i + 1
+
+    def _load_aggregates(self):
+        self.days = {}
+        self.cards = {}
+        self._folded = 0
+        agg_path = os.path.join(self.path, AGGREGATES_FILE)
+        if os.path.exists(agg_path):
+            try:
+                with open(agg_path, 'r', encoding='utf-8') as f:
+                    saved = json.load(f)
+            except ValueError:
+                saved = None
+            if saved and saved.get('records', 0) <= len(self):
+                self.days = {int(k): v for k, v in saved['days'].items()}
+                self.cards = {
+                    self.number[cid]: v for cid, v in saved['cards'].items()
+                    if cid in self.number
+                }
+                self._folded = saved['records']
+        for i in range(self._folded, len(self)):
+            self._fold(i)
+
+    def save_aggregates(self):
+        if not self._loaded:
+            return
+        atomic_write(
+            os.path.join(self.path, AGGREGATES_FILE),
+            json.dumps({
+                'records': self._folded,
+                'days': self.days,
+                'cards': {self.ids[n]: v for n, v in self.cards.items()},
+            }, separators=(',', ':')),
+        )
+
+    def _first_day(self, days, now):
+        if now is None:
+            now = time.time()
+        return _day(now) - days + 1
+
+    def retention(self, days=30, now=None):
+        """Share of grades in the last ``days`` days answered D or F.
+
+        Returns None when there were no grades.
+        """
+        self._load()
+        first = self._first_day(days, now)
+        total = remembered = 0
+        for day, counts in self.days.items():
+            if day >= first:
+                total += sum(counts)
+                remembered += counts[2] + counts[3]
+        return remembered / total if total else None
+
+    def struggle_trend(self, days=30, now=None):
+        """Grades, struggle added and retention for each of the last days."""
+        self._load()
+        first = self._first_day(days, now)
+        trend = []
+        for day in range(first, first + days):
+            counts = self.days.get(day, (0, 0, 0, 0))
+            total = sum(counts)
+            trend.append({
+                'date': datetime.date.fromordinal(day).isoformat(),
+                'reviews': total,
+                'struggle': sum(
+                    n * p for n, p in zip(counts, STRUGGLE_POINTS)
+                ),
+                'retention': (
+                    (counts[2] + counts[3]) / total if total else None
+                ),
+            })
+        return trend
+
+    def hardest_cards(self, days=30, limit=10, now=None):
+        """Cards that collected the most struggle in the last ``days`` days.
+
+        With ``days`` None the whole history is ranked from the per-card
+        aggregates.  Returns ``(cid, struggle, reviews)`` tuples, hardest
+        first.
+        """
+        self._load()
+        if days is None:
+            ranked = (
+                (sum(n * p for n, p in zip(c, STRUGGLE_POINTS)), sum(c[:4]), n)
+                for n, c in self.cards.items()
+            )
+        else:
+            since = _day_start(self._first_day(days, now))
+            if self._sorted:
+                start = bisect.bisect_left(self.columns['time'], since)
+                ranked = self._window_struggle(start)
+            else:
+                ranked = self._window_struggle(0, since)
+        top = sorted(
+            (entry for entry in ranked if entry[0] > 0),
+            key=lambda e: (-e[0], -e[1], e[2]),
+        )[:limit]
+        return [
+            (self.ids[n], struggle, reviews) for struggle, reviews, n in top
+        ]
+
+    def _window_struggle(self, start, since=None):
+        """``(struggle, reviews, card number)`` of the records from ``start``.
+
+        With ``since`` only records graded at that time or later count.
+        """
+        cards = self.columns['card'][start:]
+        ratings = self.columns['rating'][start:]
+        np = _numpy()
+        if np is not None:
+            numbers = np.frombuffer(cards, dtype=np.uint32)
+            ratings = np.frombuffer(ratings, dtype=np.uint8)
+            if since is not None:
+                recent = np.frombuffer(
+                    self.columns['time'][start:], dtype=np.float64
+                ) >= since
+                numbers = numbers[recent]
+                ratings = ratings[recent]
+            points = np.array(STRUGGLE_POINTS)[ratings]
+            struggle = np.bincount(numbers, weights=points)
+            reviews = np.bincount(numbers)
+            found = np.flatnonzero(reviews)
+            return zip(
+                struggle[found].astype(int).tolist(),
+                reviews[found].tolist(),
+                found.tolist(),
+            )
+        totals = {}
+        records = zip(cards, ratings)
+        if since is not None:
+            times = self.columns['time'][start:]
+            records = (r for r, when in zip(records, times) if when >= since)
+        for number, rating in records:
+            entry = totals.get(number)
+            if entry is None:
+                entry = totals[number] = [0, 0]
+            entry[0] += STRUGGLE_POINTS[rating]
+            entry[1] += 1
+        return ((s, r, n) for n, (s, r) in totals.items())
+
+    def card_summary(self, cid):
+        """All-time A/S/D/F counts and last grade time of card ``cid``."""
+        self._load()
+        number = self.number.get(cid)
+        card = self.cards.get(number) if number is not None else None
+        if card is None:
+            return None
+        return {
+            'ratings': dict(zip(RATINGS, card[:4])),
+            'reviews': sum(card[:4]),
+            'last_review': card[4],
+        }
+
+
+def open_history(path=HISTORY_DIR, interval=0):
+    """Start logging grades to ``path``; returns the history.
+
+    With a positive ``interval`` grades are written at most once per
+    ``interval`` seconds.  The log is only read, and ``path`` created, when
+    the first grade is recorded or the history is queried (see
+    :class:`ReviewHistory`).
+    """
+    global _history
+    close_history()
+    _history = ReviewHistory(path, interval)
+    return _history
+
+
+def get_history():
+    """The open history, or None when grades are not being logged."""
+    return _history
+
+
+def set_history(history):
+    """Make ``history`` (or None) the open history and return the previous one.
+
+    The replaced history is not closed, so it can be put back with another
+    call.
+    """
+    global _history
+    previous, _history = _history, history
+    return previous
+
+
+def close_history():
+    global _history
+    if _history is not None:
+        _history.close()
+        _history = None
+
+
+def record_review(cid, direction, rating, when, deck=None):
+    """Log a grade in the open history, if there is one."""
+    if _history is not None:
+        _history.record(cid, direction, rating, when, deck)
+
+
+atexit.register(close_history)
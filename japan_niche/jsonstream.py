@@ -0,0 +1,118 @@
+"""Incremental reading of large JSON documents.
+
+:class:`JsonReader` walks a document from a binary file a chunk at a time,
+so a huge top-level object can be processed member by member without ever
+holding the whole document in memory.  Values that are consumed with
+:meth:`JsonReader.value` are decoded with :class:`json.JSONDecoder` as a
+whole, so this is meant for documents made of many small values.
+"""
+
+import json
+import codecs
+
+WHITESPACE = ' \t\n\r'
+
+
+class JsonReader:
+    """Pull parser over a JSON document in the binary file ``f``.
+
+    Example::
+
+        for key in reader.members():
+            if key == 'cards':
+                for cid in reader.members():
+                    card = reader.value()
+            else:
+                reader.value()
+    """
+
+    def __init__(self, f, chunk_size=1 << 20):
+        self.f = f
+        self.chunk_size = chunk_size
+        self.bytes_read = 0
+        self._decoder = json.JSONDecoder()
+        self._text = codecs.getincrementaldecoder('utf-8')()
+        self._buf = ''
+        self._pos = 0
+        self._eof = False
+
+    def _fill(self):
+        """Read the next chunk; returns False at the end of the file."""
+        if self._eof:
+            return False
+        chunk = self.f.read(self.chunk_size)
+        self.bytes_read += len(chunk)
+        if not chunk:
+            self._eof = True
+        self._buf = self._buf[self._pos:] + self._text.decode(chunk, not chunk)
+        self._pos = 0
+        return True
+
+    @property
+    def position(self):
+        """Approximate byte offset of the parser in the file.
+
+        Exact for ASCII text; characters that are buffered but not yet
+        parsed are counted as one byte each.
+        """
+        return self.bytes_read - (len(self._buf) - self._pos)
+
+    def peek(self):
+        """Return the next non-whitespace character, '' at the end."""
+        while True:
+            buf = self._buf
+            pos = self._pos
+            while pos < len(buf) and buf[pos] in WHITESPACE:
+                pos += 1
+            self._pos = pos
+            if pos < len(buf):
+                return buf[pos]
+            if not self._fill():
+                return ''
+
+    def expect(self, char):
+        found = self.peek()
+        if found != char:
+            raise ValueError(
+                f"expected {char!r} but found {found or 'end of file'!r} "
+                f"near byte {self.bytes_read}"
+            )
+        self._pos += 1
+
+    def value(self):
+        """Decode and return the next complete value."""
+        self.peek()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buf, self._pos)
+            except json.JSONDecodeError:
+                if self._fill():
+                    continue
+                raise
+            # A number that ends exactly at the end of the buffer may
+            # continue in the next chunk.
+            if end == len(self._buf) and not self._eof:
+                self._fill()
+                continue
+            self._pos = end
+            return value
+
+    def members(self):
+        """Iterate over the keys of the object that starts here.
+
+        The value of every key has to be consumed (with :meth:`value` or
+        another :meth:`members`) before the next key is requested.
+        """
+        self.expect('{')
+        if self.peek() == '}':
+            self._pos += 1
+            return
+        while True:
+            key = self.value()
+            self.expect(':')
+            yield key
+            if self.peek() == ',':
+                self._pos += 1
+                continue
+            self.expect('}')
+            return
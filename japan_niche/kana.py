@@ -0,0 +1,193 @@
+"""Romanization of kana readings.
+
+:func:`segments` splits a reading into the units that are read as one
+syllable, each paired with its Hepburn romanization::
+
+    >>> segments('ラーメンだ')
+    (('ラー', 'raa'), ('メ', 'me'), ('ン', 'n'), ('だ', 'da'))
+    >>> romaji('きょうはラーメンだ')
+    'kyouharaamenda'
+
+Kana are matched longest first with one precompiled pattern, so yoon such as
+きゃ and the extended katakana digraphs (ファ, ティ, ...) come out as one
+syllable.  Katakana are matched through their hiragana equivalents.  A small
+っ doubles the consonant of the following syllable, ー repeats the vowel of
+the previous one and ん before a vowel or y is written ``n'``.  Characters
+that are not kana are passed through as their own segment.
+
+Results are memoized in a bounded LRU cache so a card's segments are only
+computed once while it is being studied.
+
+Run ``python -m japan_niche.kana`` to time the transliteration of every card
+in ``flashcards/``.
+"""
+
+import re
+import sys
+import time
+from functools import lru_cache
+
+# Segmented readings kept by :func:`segments`.
+CACHE_SIZE = 1 << 16
+
+VOWELS = 'aeiou'
+
+BASE = {
+    'あ': 'a', 'い': 'i', 'う': 'u', 'え': 'e', 'お': 'o',
+    'か': 'ka', 'き': 'ki', 'く': 'ku', 'け': 'ke', 'こ': 'ko',
+    'が': 'ga', 'ぎ': 'gi', 'ぐ': 'gu', 'げ': 'ge', 'ご': 'go',
+    'さ': 'sa', 'し': 'shi', 'す': 'su', 'せ': 'se', 'そ': 'so',
+    'ざ': 'za', 'じ': 'ji', 'ず': 'zu', 'ぜ': 'ze', 'ぞ': 'zo',
+    'た': 'ta', 'ち': 'chi', 'つ': 'tsu', 'て': 'te', 'と': 'to',
+    'だ': 'da', 'ぢ': 'ji', 'づ': 'zu', 'で': 'de', 'ど': 'do',
+    'な': 'na', 'に': 'ni', 'ぬ': 'nu', 'ね': 'ne', 'の': 'no',
+    'は': 'ha', 'ひ': 'hi', 'ふ': 'fu', 'へ': 'he', 'ほ': 'ho',
+    'ば': 'ba', 'び': 'bi', 'ぶ': 'bu', 'べ': 'be', 'ぼ': 'bo',
+    'ぱ': 'pa', 'ぴ': 'pi', 'ぷ': 'pu', 'ぺ': 'pe', 'ぽ': 'po',
+    'ま': 'ma', 'み': 'mi', 'む': 'mu', 'め': 'me', 'も': 'mo',
+    'や': 'ya', 'ゆ': 'yu', 'よ': 'yo',
+    'ら': 'ra', 'り': 'ri', 'る': 'ru', 'れ': 're', 'ろ': 'ro',
+    'わ': 'wa', 'ゐ': 'i', 'ゑ': 'e', 'を': 'o', 'ん': 'n',
+    'ゔ': 'vu',
+    'ぁ': 'a', 'ぃ': 'i', 'ぅ': 'u', 'ぇ': 'e', 'ぉ': 'o',
+    'ゃ': 'ya', 'ゅ': 'yu', 'ょ': 'yo', 'ゎ': 'wa', 'ゕ': 'ka', 'ゖ': 'ke',
+    # Katakana without a hiragana counterpart.
+    'ヷ': 'va', 'ヸ': 'vi', 'ヹ': 've', 'ヺ': 'vo',
+}
+
+# Digraphs that are not regular yoon, mostly found in loanwords.
+EXTENDED = {
+    'しぇ': 'she', 'じぇ': 'je', 'ちぇ': 'che',
+    'つぁ': 'tsa', 'つぃ': 'tsi', 'つぇ': 'tse', 'つぉ': 'tso',
+    'てぃ': 'ti', 'でぃ': 'di', 'とぅ': 'tu', 'どぅ': 'du',
+    'てゅ': 'tyu', 'でゅ': 'dyu',
+    'ふぁ': 'fa', 'ふぃ': 'fi', 'ふぇ': 'fe', 'ふぉ': 'fo', 'ふゅ': 'fyu',
+    'うぃ': 'wi', 'うぇ': 'we', 'うぉ': 'wo',
+    'ゔぁ': 'va', 'ゔぃ': 'vi', 'ゔぇ': 've', 'ゔぉ': 'vo', 'ゔゅ': 'vyu',
+    'いぇ': 'ye', 'くぁ': 'kwa', 'ぐぁ': 'gwa',
+}
+
+
+def _build_table():
+    table = dict(BASE)
+    # Yoon: an i-column kana followed by a small ya, yu or yo.
+    for kana, roman in BASE.items():
+        if len(roman) < 2 or not roman.endswith('i'):
+            continue
+        stem = roman[:-1]
+        if roman not in ('shi', 'chi', 'ji'):
+            stem += 'y'
+        for small, vowel in (('ゃ', 'a'), ('ゅ', 'u'), ('ょ', 'o')):
+            table[kana + small] = stem + vowel
+    table.update(EXTENDED)
+    return table
+
+
+TABLE = _build_table()
+# Longest keys first so digraphs win over their first kana.
+_PATTERN = re.compile(
+    '|'.join(re.escape(k) for k in sorted(TABLE, key=len, reverse=True))
+    + '|.',
+    re.S,
+)
+# Katakana ァ..ヶ map onto hiragana ぁ..ゖ at a fixed offset.
+_TO_HIRAGANA = {c: c - 0x60 for c in range(0x30A1, 0x30F7)}
+
+
+def _segment(text):
+    tokens = []
+    norm = text.translate(_TO_HIRAGANA)
+    for m in _PATTERN.finditer(norm):
+        key = m.group()
+        tokens.append((text[m.start():m.end()], key, TABLE.get(key)))
+
+    result = []
+    i = 0
+    n = len(tokens)
+    while i < n:
+        kana, key, roman = tokens[i]
+        following = tokens[i + 1] if i + 1 < n else None
+        if key == 'っ':
+            if (
+                following is not None
+                and following[2] is not None
+                and following[2][0] not in VOWELS + 'n'
+            ):
+                # Sokuon doubles the next consonant (ch becomes tch).
+                nxt = following[2]
+                kana += following[0]
+                roman = ('t' if nxt.startswith('ch') else nxt[0]) + nxt
+                i += 1
+            else:
+                roman = "'"
+        elif key == 'ー':
+            if result and result[-1][1][-1] in VOWELS:
+                prev_kana, prev_roman = result[-1]
+                result[-1] = (prev_kana + kana, prev_roman + prev_roman[-1])
+                i += 1
+                continue
+            roman = '-'
+        elif key == 'ん':
+            if (
+                following is not None
+                and following[2] is not None
+                and following[2][0] in VOWELS + 'y'
+            ):
+                roman = "n'"
+        elif roman is None:
+            roman = kana
+        result.append((kana, roman))
+        i += 1
+    return tuple(result)
+
+
+@lru_cache(maxsize=CACHE_SIZE)
+def segments(text):
+    """Return ``(kana, romaji)`` pairs for the reading ``text``."""
+    return _segment(text)
+
+
+def romaji(text):
+    """Return the romanization of ``text`` as one string."""
+    return ''.join(roman for _, roman in segments(text))
+
+
+def warm(texts):
+    """Segment ``texts`` ahead of time so later lookups hit the cache."""
+    for text in texts:
+        segments(text)
+
+
+def benchmark(readings, repeat=3):
+    """Time segmenting every reading in ``readings`` without the cache.
+
+    Returns the best time in seconds of ``repeat`` runs.
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for text in readings:
+            _segment(text)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def main(argv=None):
+    from .cards import parse_markdown_files
+
+    argv = sys.argv[1:] if argv is None else argv
+    repeat = int(argv[0]) if argv else 3
+    readings = [c['hira'] for c in parse_markdown_files().values()]
+    chars = sum(len(r) for r in readings)
+    seconds = benchmark(readings, repeat)
+    rate = len(readings) / seconds if seconds > 0 else 0.0
+    print(
+        f"Transliterated {len(readings)} readings ({chars} characters) in "
+        f"{seconds:.3f}s: {rate:.0f} readings/s, "
+        f"{chars / seconds if seconds > 0 else 0.0:.0f} characters/s."
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,225 @@
+"""Versioned upgrades of the ``flashcard_data.json`` format.
+
+The data file records the format it was written in as ``schema_version``
+(files from before versioning count as version 0).  :data:`MIGRATIONS` lists
+one step per version, in order; :func:`migrate` runs the steps a file is
+missing in a single pass and stamps it with :data:`SCHEMA_VERSION`.  Files
+that are already current are not looked at at all, and files written by a
+newer version of the program are refused rather than guessed at.
+
+To change the format, add a step with the next version number using the
+:func:`migration` decorator.  Steps work on the plain dicts and lists read
+from JSON and return True if they changed anything.
+"""
+
+import re
+
+from .profiling import timed
+
+BACK_RE = re.compile(r"(.+?)\s*\[(.+?)\]\s*\[(.+?)\]")
+
+MIGRATIONS = []
+
+
+def migration(version):
+    """Register the decorated function as the step up to ``version``."""
+    def register(fn):
+        if MIGRATIONS and MIGRATIONS[-1][0] >= version:
+            raise ValueError(f"migration {version} registered out of order")
+        MIGRATIONS.append((version, fn))
+        return fn
+    return register
+
+
+def upgrade_front_back(card):
+    """Derive jp/en/pron/hira of a card in the original front/back format.
+
+    These cards kept everything in an ``id`` of the form
+    ``...|...|jp|en|direction`` and a ``back`` of ``answer [pron] [hira]``.
+    Returns True if the card was changed.
+    """
+    if 'jp' in card and 'en' in card:
+        return False
+    parts = card.get('id', '').split('|')
+    if len(parts) < 5:
+        return False
+    jp, en, direction = parts[2], parts[3], parts[4]
+    m = BACK_RE.match(card.get('back', ''))
+    if not m:
+        return False
+    val1, pron, hira = m.groups()
+    if direction == 'J2E':
+        en = val1
+    else:
+        jp = val1
+    card.update({
+        'jp': jp,
+        'en': en,
+        'pron': pron,
+        'hira': hira,
+        'direction': direction,
+        'front': jp if direction == 'J2E' else en,
+    })
+    return True
+
+
+def split_progress(card):
+    """Turn single-direction progress into per-direction dicts.
+
+    Older versions kept ``ratings`` as a list and ``skill``, ``struggle`` and
+    ``last_study`` as scalars belonging to ``card['direction']``.  Returns
+    True if the card was changed.
+    """
+    if isinstance(card.get('ratings'), dict):
+        return False
+    direction = card.get('direction', 'J2E')
+    ratings = card.get('ratings', [])
+    skill = card.get('skill', 0)
+    struggle = card.get('struggle', 0)
+    last = card.get('last_study')
+
+    card['ratings'] = {'J2E': [], 'E2J': []}
+    card['ratings'][direction] = ratings
+    card['skill'] = {'J2E': 0, 'E2J': 0}
+    card['skill'][direction] = skill
+    card['struggle'] = {'J2E': 0, 'E2J': 0}
+    card['struggle'][direction] = struggle
+    card['last_study'] = {'J2E': None, 'E2J': None}
+    card['last_study'][direction] = last
+    return True
+
+
+def is_split_card(cid, card):
+    """True for a card holding one direction of a word (legacy ``a|b`` ids)."""
+    return '|' in cid or '|' in card.get('id', '')
+
+
+def merge_into(cards, card):
+    """Merge one direction card into its word card in ``cards``.
+
+    The word card is keyed by the Japanese text.  Returns the id it was merged
+    into, or None if the card has no Japanese text and was dropped.
+    """
+    jp = card.get('jp')
+    if not jp:
+        return None
+    direction = card.get('direction', 'J2E')
+    target = cards.get(jp)
+    if target is None:
+        target = cards[jp] = {
+            'id': jp,
+            'jp': jp,
+            'en': card.get('en'),
+            'pron': card.get('pron'),
+            'hira': card.get('hira'),
+            'deck': card.get('deck', 'no_deck'),
+            'ratings': {'J2E': [], 'E2J': []},
+            'skill': {'J2E': 0, 'E2J': 0},
+            'struggle': {'J2E': 0, 'E2J': 0},
+            'last_study': {'J2E': None, 'E2J': None},
+        }
+    else:
+        for k in ('en', 'pron', 'hira'):
+            if card.get(k):
+                target[k] = card[k]
+        if card.get('deck', 'no_deck') != 'no_deck':
+            target['deck'] = card['deck']
+    for key, default in (('skill', 0), ('struggle', 0), ('last_study', None)):
+        value = (card.get(key) or {}).get(direction)
+        target[key][direction] = default if value is None else value
+    target['ratings'][direction] = list(
+        (card.get('ratings') or {}).get(direction) or []
+    )
+    return jp
+
+
+@migration(1)
+def _front_back_fields(data):
+    changed = False
+    for card in data.get('cards', {}).values():
+        if upgrade_front_back(card):
+            changed = True
+    return changed
+
+
+@migration(2)
+def _per_direction_progress(data):
+    changed = False
+    for card in data.get('cards', {}).values():
+        if split_progress(card):
+            changed = True
+    return changed
+
+
+@migration(3)
+def merge_directions(data):
+    """One card per word instead of one per word and direction.
+
+    ``convert_flashcard_data.py`` streams the same step for files too large
+    to load.
+    """
+    old_cards = data.get('cards', {})
+    if not any(is_split_card(cid, c) for cid, c in old_cards.items()):
+        return False
+    # Cards already in the current format come first so split cards of the
+    # same word are merged into them.
+    cards = {}
+    id_map = {}
+    for cid, card in old_cards.items():
+        if not is_split_card(cid, card):
+            cards[cid] = card
+            id_map[cid] = cid
+    for cid, card in old_cards.items():
+        if is_split_card(cid, card):
+            new_id = merge_into(cards, card)
+            if new_id is not None:
+                id_map[cid] = new_id
+    study_deck = []
+    seen = set()
+    for cid in data.get('study_deck', []):
+        nid = id_map.get(cid)
+        if nid and nid not in seen:
+            seen.add(nid)
+            study_deck.append(nid)
+    data['cards'] = cards
+    data['study_deck'] = study_deck
+    return True
+
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def schema_version(data):
+    """Return the format version of ``data``.
+
+    Raises ValueError if it is not a known version, including versions newer
+    than :data:`SCHEMA_VERSION`.
+    """
+    version = data.get('schema_version', 0)
+    if type(version) is not int or version < 0:
+        raise ValueError(f"unknown schema_version {version!r}")
+    if version > SCHEMA_VERSION:
+        raise ValueError(
+            f"schema_version {version} is newer than {SCHEMA_VERSION}, "
+            f"the latest this version of the program can read"
+        )
+    return version
+
+
+@timed('migrate')
+def migrate(data):
+    """Bring ``data`` up to :data:`SCHEMA_VERSION` in place.
+
+    Returns True if any step changed the cards, False if the data only
+    needed a new version stamp or was already current.  Raises ValueError
+    like :func:`schema_version` for unknown versions.
+    """
+    version = schema_version(data)
+    if version == SCHEMA_VERSION:
+        return False
+    changed = False
+    for step_version, step in MIGRATIONS:
+        if step_version > version and step(data):
+            changed = True
+    data['schema_version'] = SCHEMA_VERSION
+    return changed
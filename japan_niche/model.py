@@ -0,0 +1,207 @@
+"""Compact in-memory representation of a card.
+
+Cards used to be plain dicts holding four further ``{'J2E': .., 'E2J': ..}``
+dicts, which dominates memory on large collections.  :class:`Card` and
+:class:`DirectionPair` use ``__slots__`` instead but keep the dict-style access
+(``card['skill']['J2E']``, ``card.get('deck')``) the rest of the program uses,
+and convert to and from the JSON schema of ``flashcard_data.json`` with
+:meth:`Card.to_dict` and :meth:`Card.from_dict`.
+"""
+
+DIRECTIONS = ('J2E', 'E2J')
+TEXT_FIELDS = ('id', 'jp', 'en', 'pron', 'hira')
+PAIR_FIELDS = ('ratings', 'skill', 'struggle', 'last_study')
+FIELDS = TEXT_FIELDS + ('deck',) + PAIR_FIELDS
+_FIELD_SET = frozenset(FIELDS)
+
+
+class DirectionPair:
+    """A value per study direction, indexable like ``{'J2E':.., 'E2J':..}``."""
+
+    __slots__ = DIRECTIONS
+
+    def __init__(self, j2e, e2j):
+        self.J2E = j2e
+        self.E2J = e2j
+
+    @classmethod
+    def from_dict(cls, d, default=None):
+        return cls(d.get('J2E', default), d.get('E2J', default))
+
+    def __getitem__(self, direction):
+        if direction == 'J2E':
+            return self.J2E
+        if direction == 'E2J':
+            return self.E2J
+        raise KeyError(direction)
+
+    def __setitem__(self, direction, value):
+        if direction == 'J2E':
+            self.J2E = value
+        elif direction == 'E2J':
+            self.E2J = value
+        else:
+            raise KeyError(direction)
+
+    def get(self, direction, default=None):
+        if direction == 'J2E':
+            return self.J2E
+        if direction == 'E2J':
+            return self.E2J
+        return default
+
+    def __iter__(self):
+        return iter(DIRECTIONS)
+
+    def __contains__(self, direction):
+        return direction in DIRECTIONS
+
+    def keys(self):
+        return DIRECTIONS
+
+    def values(self):
+        return (self.J2E, self.E2J)
+
+    def items(self):
+        return (('J2E', self.J2E), ('E2J', self.E2J))
+
+    def to_dict(self):
+        return {'J2E': self.J2E, 'E2J': self.E2J}
+
+    def __eq__(self, other):
+        if isinstance(other, DirectionPair):
+            return self.J2E == other.J2E and self.E2J == other.E2J
+        if isinstance(other, dict):
+            return self.to_dict() == other
+        return NotImplemented
+
+    def __repr__(self):
+        return f"DirectionPair(J2E={self.J2E!r}, E2J={self.E2J!r})"
+
+
+def _pair(value, default):
+    if isinstance(value, DirectionPair):
+        return value
+    return DirectionPair.from_dict(value or {}, default)
+
+
+class Card:
+    """One flashcard.
+
+    Supports the subset of the dict interface used on cards: item access
+    and assignment, ``get``, ``in``, ``keys`` and ``items``.  Keys outside
+    the current schema (left over from old data formats) are kept in
+    ``extra`` so a load/save round trip is lossless.
+    """
+
+    __slots__ = FIELDS + ('extra',)
+
+    def __init__(self, cid, jp, en, pron, hira, deck='no_deck', ratings=None,
+                 skill=None, struggle=None, last_study=None, extra=None):
+        self.id = cid
+        self.jp = jp
+        self.en = en
+        self.pron = pron
+        self.hira = hira
+        self.deck = deck
+        self.ratings = ratings or DirectionPair([], [])
+        self.skill = skill or DirectionPair(0, 0)
+        self.struggle = struggle or DirectionPair(0, 0)
+        self.last_study = last_study or DirectionPair(None, None)
+        self.extra = extra
+
+    @classmethod
+    def from_dict(cls, d):
+        extra = {k: v for k, v in d.items() if k not in _FIELD_SET}
+        ratings = d.get('ratings')
+        if not isinstance(ratings, DirectionPair):
+            ratings = ratings or {}
+            ratings = DirectionPair(
+                list(ratings.get('J2E', [])), list(ratings.get('E2J', []))
+            )
+        return cls(
+            d.get('id'), d.get('jp'), d.get('en'), d.get('pron'), d.get('hira'),
+            d.get('deck', 'no_deck'),
+            ratings,
+            _pair(d.get('skill'), 0),
+            _pair(d.get('struggle'), 0),
+            _pair(d.get('last_study'), None),
+            extra or None,
+        )
+
+    def to_dict(self):
+        d = {}
+        for key in TEXT_FIELDS:
+            value = getattr(self, key)
+            if value is not None:
+                d[key] = value
+        d['deck'] = self.deck
+        d['ratings'] = {'J2E': list(self.ratings.J2E),
+                        'E2J': list(self.ratings.E2J)}
+        d['skill'] = self.skill.to_dict()
+        d['struggle'] = self.struggle.to_dict()
+        d['last_study'] = self.last_study.to_dict()
+        if self.extra:
+            d.update(self.extra)
+        return d
+
+    def reset_progress(self):
+        """Clear ratings, skill and struggle in place."""
+        self.ratings.J2E.clear()
+        self.ratings.E2J.clear()
+        self.skill.J2E = self.skill.E2J = 0
+        self.struggle.J2E = self.struggle.E2J = 0
+
+    def __getitem__(self, key):
+        if key in _FIELD_SET:
+            return getattr(self, key)
+        if self.extra is not None and key in self.extra:
+            return self.extra[key]
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key in _FIELD_SET:
+            if key in PAIR_FIELDS and isinstance(value, dict):
+                value = DirectionPair.from_dict(value)
+            setattr(self, key, value)
+        else:
+            if self.extra is None:
+                self.extra = {}
+            self.extra[key] = value
+
+    def get(self, key, default=None):
+        try:
+            value = self[key]
+        except KeyError:
+            return default
+        if value is None and key in TEXT_FIELDS:
+            return default
+        return value
+
+    def __contains__(self, key):
+        if key in _FIELD_SET:
+            return key not in TEXT_FIELDS or getattr(self, key) is not None
+        return self.extra is not None and key in self.extra
+
+    def keys(self):
+        return self.to_dict().keys()
+
+    def items(self):
+        return self.to_dict().items()
+
+    def __eq__(self, other):
+        if isinstance(other, Card):
+            return self.to_dict() == other.to_dict()
+        if isinstance(other, dict):
+            return self.to_dict() == other
+        return NotImplemented
+
+    def __repr__(self):
+        return f"Card({self.to_dict()!r})"
+
+
+def cards_from_dicts(cards):
+    """Convert the card dicts of a loaded data file to :class:`Card` in place."""
+    for cid, card in cards.items():
+        if not isinstance(card, Card):
+            cards[cid] = Card.from_dict(card)
@@ -0,0 +1,184 @@
+"""Crash-safe file writes and a background writer thread."""
+
+import os
+import time
+import tempfile
+import threading
+import traceback
+
+from .profiling import count, enabled
+
+
+def atomic_write(path, text):
+    """Replace ``path`` with ``text`` without ever leaving a partial file.
+
+    ``text`` may also be ``bytes``, which are written as they are.  The text
+    is written to a temporary file in the same directory, flushed
+    to disk and then renamed over ``path``, so a crash leaves either the old
+    or the new file behind.
+    """
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp = tempfile.mkstemp(
+        prefix=os.path.basename(path) + '.', suffix='.tmp', dir=directory
+    )
+    try:
+        if isinstance(text, bytes):
+            f = os.fdopen(fd, 'wb')
+        else:
+            f = os.fdopen(fd, 'w', encoding='utf-8')
+        with f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+            if enabled():
+                count('bytes_written', os.fstat(f.fileno()).st_size)
+        os.replace(tmp, path)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        raise
+    if hasattr(os, 'O_DIRECTORY'):
+        # Make the rename itself durable.
+        dir_fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            os.fsync(dir_fd)
+        finally:
+            os.close(dir_fd)
+
+
+class SaveError(Exception):
+    """Writes run by a :class:`PersistenceWorker` failed.
+
+    ``failures`` lists the exceptions that were raised, oldest first.
+    """
+
+    def __init__(self, failures):
+        self.failures = failures
+        super().__init__(
+            f"{len(failures)} background write(s) failed, the last with: "
+            f"{failures[-1]!r}"
+        )
+
+
+class PersistenceWorker:
+    """Runs write jobs on a background thread.
+
+    Jobs are plain callables that must not touch state owned by the caller's
+    thread.  A burst of submissions is coalesced: the worker waits
+    ``interval`` seconds after the first pending job and then runs everything
+    queued so far in one go.  Submitting the same job again while it is still
+    pending is a no-op, and a job submitted with ``supersede`` replaces every
+    pending job (used for full saves, which include all earlier changes).
+    When several backends share one worker they pass themselves as ``owner``
+    so a full save only replaces their own jobs.
+
+    A job that raises is reported and kept: :meth:`check`, :meth:`flush` and
+    :meth:`close` raise :class:`SaveError` for it, so the caller learns that
+    its data was not written.
+    """
+
+    def __init__(self, interval=1.0):
+        self.interval = interval
+        self._jobs = []
+        self._busy = False
+        self._hurry = False
+        self._closed = False
+        self._failures = []
+        self._cond = threading.Condition()
+        self._thread = threading.Thread(
+            target=self._run, name='persistence', daemon=True
+        )
+        self._thread.start()
+
+    def submit(self, job, supersede=False, owner=None):
+        with self._cond:
+            if self._closed:
+                raise RuntimeError('persistence worker is closed')
+            if supersede:
+                self._jobs = [j for j in self._jobs if j[0] is not owner]
+            if not self._jobs or self._jobs[-1] != (owner, job):
+                self._jobs.append((owner, job))
+            self._cond.notify_all()
+
+    def pending(self, owner=None):
+        """True while jobs of ``owner`` (or of anyone without one) are queued.
+
+        A batch that is being written counts as pending for every owner.
+        """
+        with self._cond:
+            return self._busy or any(
+                owner is None or o is owner for o, _ in self._jobs
+            )
+
+    def check(self, owner=None):
+        """Raise :class:`SaveError` if jobs of ``owner`` failed.
+
+        Without an ``owner`` the failures of every owner are raised.  Raised
+        failures are forgotten.
+        """
+        with self._cond:
+            failed = [
+                e for o, e in self._failures if owner is None or o is owner
+            ]
+            self._failures = [
+                (o, e) for o, e in self._failures
+                if not (owner is None or o is owner)
+            ]
+        if failed:
+            raise SaveError(failed)
+
+    def flush(self, owner=None):
+        """Run all pending jobs now and wait until they have finished.
+
+        Then raises like :meth:`check`.
+        """
+        with self._cond:
+            self._hurry = True
+            self._cond.notify_all()
+            while self._jobs or self._busy:
+                self._cond.wait()
+            self._hurry = False
+        self.check(owner)
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            with self._cond:
+                self._closed = True
+                self._cond.notify_all()
+            self._thread.join()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._jobs and not self._closed:
+                    self._cond.wait()
+                if not self._jobs:
+                    return
+                deadline = time.monotonic() + self.interval
+                while not self._hurry and not self._closed:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                jobs, self._jobs = self._jobs, []
+                self._busy = True
+                self._hurry = False
+            try:
+                for owner, job in jobs:
+                    # Every job runs on its own, so a failing backend does
+                    # not cost the other owners of a shared worker their
+                    # writes.
+                    try:
+                        job()
+                    except Exception as e:
+                        where = '' if owner is None else f' for {owner!r}'
+                        print(f'Saving flashcard data{where} failed:')
+                        traceback.print_exc()
+                        with self._cond:
+                            self._failures.append((owner, e))
+            finally:
+                with self._cond:
+                    self._busy = False
+                    self._cond.notify_all()
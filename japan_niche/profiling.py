@@ -0,0 +1,196 @@
+"""Opt-in timing of the hot paths.
+
+Functions decorated with :func:`timed` record how long every call took and
+:func:`count` adds to named counters (bytes written, cards parsed, ...).
+Both do nothing but check a flag until profiling is switched on, either with
+``"profile": true`` in ``config.json`` or by setting the environment
+variable ``JAPAN_NICHE_PROFILE=1`` (see :func:`configure`).
+
+While profiling, durations are kept in a fixed-size histogram per span, a
+quarter octave per bucket, so memory does not grow with the number of calls.
+A JSON summary with the call count, total, percentiles and histogram of
+every span plus the counters is written to ``"profile_file"``
+(``flashcard_profile.json``) when the program exits.  With ``"profile":
+"cprofile"`` the whole run is also captured with :mod:`cProfile` and dumped
+next to it as ``flashcard_profile.prof``, for ``python -m pstats`` or
+snakeviz.
+"""
+
+import os
+import json
+import math
+import time
+import atexit
+import functools
+import contextlib
+
+ENV_VAR = 'JAPAN_NICHE_PROFILE'
+PROFILE_FILE = 'flashcard_profile.json'
+BUCKETS_PER_OCTAVE = 4
+PERCENTILES = (50, 90, 99)
+
+_enabled = False
+_output = PROFILE_FILE
+_profiler = None
+_spans = {}
+_counters = {}
+
+
+def enabled():
+    """True while profiling; check it before computing costly counts."""
+    return _enabled
+
+
+class SpanStats:
+    """Call count, total and a log-scale histogram of one span."""
+
+    __slots__ = ('count', 'total', 'max', 'buckets')
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.buckets = {}
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+        micros = seconds * 1e6
+        bucket = (
+            int(math.log2(micros) * BUCKETS_PER_OCTAVE) if micros > 1 else 0
+        )
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+
+    @staticmethod
+    def bucket_limit(bucket):
+        """Upper end of ``bucket`` in seconds."""
+        return 2 ** ((bucket + 1) / BUCKETS_PER_OCTAVE) / 1e6
+
+    def percentile(self, p):
+        """Upper end of the bucket holding the ``p``-th percentile."""
+        rank = self.count * p / 100
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= rank:
+                return min(self.bucket_limit(bucket), self.max)
+        return self.max
+
+    def summary(self):
+        result = {
+            'count': self.count,
+            'total_ms': self.total * 1000,
+            'mean_ms': self.total * 1000 / self.count if self.count else 0.0,
+            'max_ms': self.max * 1000,
+        }
+        for p in PERCENTILES:
+            result[f'p{p}_ms'] = self.percentile(p) * 1000
+        result['histogram'] = [
+            {'le_ms': self.bucket_limit(b) * 1000, 'count': self.buckets[b]}
+            for b in sorted(self.buckets)
+        ]
+        return result
+
+
+def record(name, seconds):
+    stats = _spans.get(name)
+    if stats is None:
+        stats = _spans[name] = SpanStats()
+    stats.add(seconds)
+
+
+def count(name, n=1):
+    """Add ``n`` to the counter ``name`` while profiling."""
+    if _enabled:
+        _counters[name] = _counters.get(name, 0) + n
+
+
+def timed(name):
+    """Decorator recording the duration of every call as span ``name``."""
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return fn(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                record(name, time.perf_counter() - start)
+        return wrapper
+    return decorate
+
+
+@contextlib.contextmanager
+def span(name):
+    """Context manager version of :func:`timed` for a block of code."""
+    if not _enabled:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, time.perf_counter() - start)
+
+
+def enable(path=PROFILE_FILE, cprofile=False):
+    """Start profiling; the summary is written to ``path`` on exit."""
+    global _enabled, _output, _profiler
+    _enabled = True
+    _output = path
+    if cprofile and _profiler is None:
+        import cProfile
+        _profiler = cProfile.Profile()
+        _profiler.enable()
+
+
+def configure(config):
+    """Switch profiling on as asked by the environment or ``config``.
+
+    ``JAPAN_NICHE_PROFILE`` takes precedence over ``config['profile']``.
+    Either may be true (or ``1``) for timings and counters, or
+    ``"cprofile"`` to capture a cProfile of the run as well.
+    """
+    setting = os.environ.get(ENV_VAR)
+    if setting is None:
+        setting = config.get('profile', False)
+    if isinstance(setting, str):
+        setting = setting.strip().lower()
+        if setting in ('', '0', 'false', 'no', 'off'):
+            setting = False
+    if setting:
+        enable(
+            config.get('profile_file', PROFILE_FILE),
+            cprofile=setting == 'cprofile',
+        )
+
+
+def summary():
+    """Return the spans and counters recorded so far."""
+    return {
+        'spans': {name: s.summary() for name, s in sorted(_spans.items())},
+        'counters': dict(sorted(_counters.items())),
+    }
+
+
+def write_summary(path=None):
+    """Write :func:`summary` (and the cProfile capture, if any) to disk."""
+    path = path or _output
+    if _profiler is not None:
+        _profiler.disable()
+        _profiler.dump_stats(os.path.splitext(path)[0] + '.prof')
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(summary(), f, indent=4)
+
+
+def _write_at_exit():
+    if _enabled:
+        write_summary()
+
+
+# Registered on import, before the storage's exit handler, so that the
+# summary is written after the last pending data has been flushed.
+atexit.register(_write_at_exit)
@@ -0,0 +1,98 @@
+"""Adaptive choice of the next card to study.
+
+Cards are drawn from the study deck with probability proportional to a weight
+derived from their struggle and skill, so cards that were answered wrongly
+come back more often than cards that are nearly learned.  The weights live in
+the :class:`~japan_niche.study_queue.StudyQueue`, which makes both a draw and
+the weight update after a grade O(log n).
+"""
+
+import random
+from collections import deque
+
+DIRECTIONS = ('J2E', 'E2J')
+
+# Weight added per point of struggle and per point of skill below zero.
+STRUGGLE_WEIGHT = 0.25
+SKILL_WEIGHT = 0.25
+MIN_WEIGHT = 0.25
+# Cards graded in the last ``COOLDOWN`` grades have their weight multiplied
+# by ``RECENT_FACTOR`` so the same card is not shown again straight away.
+COOLDOWN = 3
+RECENT_FACTOR = 0.1
+
+
+def direction_weight(card, direction):
+    """Weight of one direction; a freshly reset direction weighs 1.0."""
+    w = (
+        1.0
+        + STRUGGLE_WEIGHT * card['struggle'][direction]
+        - SKILL_WEIGHT * card['skill'][direction]
+    )
+    return max(MIN_WEIGHT, w)
+
+
+def remaining_directions(card):
+    """Directions of ``card`` that have not yet reached a skill of 2."""
+    return [d for d in DIRECTIONS if card['skill'].get(d, 0) < 2]
+
+
+def card_weight(card):
+    """Sampling weight of a card, the mean of its unfinished directions.
+
+    Finished cards weigh 1.0 so they are still drawn and graduated.
+    """
+    directions = remaining_directions(card)
+    if not directions:
+        return 1.0
+    return sum(direction_weight(card, d) for d in directions) / len(directions)
+
+
+class AdaptivePicker:
+    """Weighted card and direction choice over ``data['study_deck']``.
+
+    Parameters
+    ----------
+    data : dict
+        The loaded collection.  The weights of its study deck are initialised
+        from the cards when the picker is created.
+    seed : int, optional
+        Seed for the picker's own random generator.
+    only : set, optional
+        Restrict the choice to these card ids; the other cards of the study
+        deck get a weight of zero.
+    """
+
+    def __init__(self, data, seed=None, only=None):
+        self.data = data
+        self.rng = random.Random(seed)
+        self.recent = deque()
+        queue = data['study_deck']
+        for cid in queue:
+            if only is None or cid in only:
+                queue.set_weight(cid, card_weight(data['cards'][cid]))
+            else:
+                queue.set_weight(cid, 0.0)
+
+    def pick(self):
+        return self.data['study_deck'].weighted_choice(self.rng)
+
+    def pick_direction(self, card, directions):
+        weights = [direction_weight(card, d) for d in directions]
+        return self.rng.choices(directions, weights)[0]
+
+    def rated(self, cid):
+        """Update the weight of ``cid`` after it was graded.
+
+        The card's weight is damped for the next ``COOLDOWN`` grades and the
+        card that leaves the cooldown window gets its full weight back.
+        """
+        queue = self.data['study_deck']
+        if cid in queue:
+            weight = card_weight(self.data['cards'][cid])
+            queue.set_weight(cid, weight * RECENT_FACTOR)
+            self.recent.append(cid)
+        while len(self.recent) > COOLDOWN:
+            old = self.recent.popleft()
+            if old in queue and old not in self.recent:
+                queue.set_weight(old, card_weight(self.data['cards'][old]))
@@ -0,0 +1,361 @@
+"""Inverted index for finding cards.
+
+:class:`SearchIndex` maps words of the English text, the source file name
+and the category header to card ids, with prefix lookup over the sorted
+words, and indexes the romaji ``jp`` and kana ``hira`` of every card by
+their one- and two-character n-grams so any substring can be found without
+comparing strings card by card.  Longer substrings are only compared on the
+cards that match the rest of the query, and :meth:`SearchIndex.search` stops
+after the first ``limit`` results, so search-as-you-type stays fast even
+when a term matches most of the collection.  The index is built from the
+cards by :func:`japan_niche.cards.search_index` and kept up to date by the
+scans.
+
+A query is a list of whitespace separated terms that must all match.  A
+plain term matches a prefix of a word in any field or a substring of
+``jp``/``hira``; ``field:term`` restricts it to one of :data:`FIELDS`::
+
+    index.search('water')         # 'water', 'waterfall', mizu, ...
+    index.search('みず')
+    index.search('category:verbs go')
+"""
+
+import os
+import re
+import bisect
+import heapq
+
+from .kana import _TO_HIRAGANA
+
+WORD_RE = re.compile(r'\w+')
+# Word fields are matched by prefix, text fields by substring.
+WORD_FIELDS = ('en', 'category', 'file')
+TEXT_FIELDS = ('jp', 'hira')
+FIELDS = WORD_FIELDS + TEXT_FIELDS
+# Matches of recent query terms kept while the index does not change, so
+# typing the next term of a query does not look up the earlier ones again.
+TERM_CACHE_SIZE = 256
+
+
+def normalize(text):
+    """Lower case with katakana folded onto hiragana."""
+    return text.lower().translate(_TO_HIRAGANA)
+
+
+def _words(text):
+    return set(WORD_RE.findall(text))
+
+
+def _source_words(path, category):
+    file = os.path.splitext(os.path.basename(path))[0] if path else ''
+    return (
+        ('category', _words(normalize(category or ''))),
+        ('file', _words(normalize(file))),
+    )
+
+
+def _grams(text):
+    grams = set(text)
+    grams.update(text[i:i + 2] for i in range(len(text) - 1))
+    return grams
+
+
+class TermIndex:
+    """Keys to sets of ids, with prefix lookup over the sorted keys.
+
+    The sorted key list is rebuilt by the first prefix lookup after keys
+    were added or removed.
+    """
+
+    __slots__ = ('postings', '_keys')
+
+    def __init__(self):
+        self.postings = {}
+        self._keys = None
+
+    def add(self, key, cid):
+        ids = self.postings.get(key)
+        if ids is None:
+            ids = self.postings[key] = set()
+            self._keys = None
+        ids.add(cid)
+
+    def discard(self, key, cid):
+        ids = self.postings.get(key)
+        if ids is None:
+            return
+        ids.discard(cid)
+        if not ids:
+            del self.postings[key]
+            self._keys = None
+
+    def get(self, key):
+        return self.postings.get(key, frozenset())
+
+    def prefix(self, prefix):
+        """Ids of every key starting with ``prefix``."""
+        keys = self._keys
+        if keys is None:
+            keys = self._keys = sorted(self.postings)
+        i = bisect.bisect_left(keys, prefix)
+        end = bisect.bisect_left(keys, prefix + '\U0010ffff', i)
+        if end - i == 1:
+            return self.postings[keys[i]]
+        found = set()
+        for key in keys[i:end]:
+            found |= self.postings[key]
+        return found
+
+
+class SearchIndex:
+    """Search over the cards' text, source file and category."""
+
+    def __init__(self):
+        self.words = {field: TermIndex() for field in WORD_FIELDS}
+        self.grams = {field: TermIndex() for field in TEXT_FIELDS}
+        # Words of each ``(path, category)`` source and its number of cards,
+        # so they are split and normalized once per source, not per card.
+        self._source_words = {}
+        self._source_cards = {}
+        # Normalized text of every card by field, used to confirm n-gram
+        # candidates and to find the keys to drop when a card is removed.
+        self.text = {field: {} for field in TEXT_FIELDS + ('en',)}
+        self.sources = {}
+        # (len(jp), jp, cid) of every card in sorted order, for ranking
+        # results that cover a large part of the index.
+        self._order = []
+        self._terms = {}
+
+    def __len__(self):
+        return len(self.sources)
+
+    def __contains__(self, cid):
+        return cid in self.sources
+
+    def cache_clear(self):
+        """Forget the matches cached for recent query terms.
+
+        The cache is cleared whenever cards are added or removed, so this is
+        only needed to time lookups that start without it.
+        """
+        self._terms.clear()
+
+    def add(self, cid, card, path=None, category=None):
+        """Index ``card``, replacing what was indexed for ``cid`` before.
+
+        ``path`` and ``category`` are the markdown file the card comes from
+        and the ``#`` header it is listed under.
+        """
+        if cid in self.sources:
+            self.remove(cid)
+        jp = self._insert(cid, card, path, category)
+        bisect.insort(self._order, (len(jp), jp, cid))
+
+    def add_many(self, items):
+        """Index ``(cid, card, path, category)`` tuples in one go.
+
+        Same as calling :meth:`add` for each, but the ranking is sorted once
+        at the end instead of kept sorted on every insert.
+        """
+        order = self._order
+        for cid, card, path, category in items:
+            if cid in self.sources:
+                order.sort()
+                self.remove(cid)
+            jp = self._insert(cid, card, path, category)
+            order.append((len(jp), jp, cid))
+        order.sort()
+
+    def _insert(self, cid, card, path, category):
+        """Index ``cid`` without ranking it; returns its normalized ``jp``."""
+        self._terms.clear()
+        text = self.text
+        en = text['en'][cid] = normalize(card.get('en') or '')
+        index = self.words['en']
+        for word in _words(en):
+            index.add(word, cid)
+        for field in TEXT_FIELDS:
+            value = text[field][cid] = normalize(card.get(field) or '')
+            # Grams are only looked up whole, so the postings are filled
+            # directly without going through TermIndex.add.
+            postings = self.grams[field].postings
+            for gram in _grams(value):
+                ids = postings.get(gram)
+                if ids is None:
+                    ids = postings[gram] = set()
+                ids.add(cid)
+        source = (path, category)
+        words = self._source_words.get(source)
+        if words is None:
+            words = self._source_words[source] = _source_words(*source)
+            self._source_cards[source] = 0
+        self._source_cards[source] += 1
+        for field, field_words in words:
+            index = self.words[field]
+            for word in field_words:
+                index.add(word, cid)
+        self.sources[cid] = source
+        return text['jp'][cid]
+
+    def remove(self, cid):
+        source = self.sources.pop(cid, None)
+        if source is None:
+            return
+        self._terms.clear()
+        text = self.text
+        index = self.words['en']
+        for word in _words(text['en'].pop(cid)):
+            index.discard(word, cid)
+        jp = text['jp'][cid]
+        for field in TEXT_FIELDS:
+            index = self.grams[field]
+            for gram in _grams(text[field].pop(cid)):
+                index.discard(gram, cid)
+        for field, field_words in self._source_words[source]:
+            index = self.words[field]
+            for word in field_words:
+                index.discard(word, cid)
+        self._source_cards[source] -= 1
+        if not self._source_cards[source]:
+            del self._source_cards[source]
+            del self._source_words[source]
+        order = self._order
+        del order[bisect.bisect_left(order, (len(jp), jp, cid))]
+
+    def _substring(self, field, term):
+        """Candidate ids for ``term`` in ``field`` and whether they are exact.
+
+        Terms of up to two characters are looked up directly.  Longer terms
+        get cards having their rarest bigram, which still have to be checked
+        to contain the term (see :meth:`_term`).
+        """
+        grams = self.grams[field]
+        if len(term) == 1:
+            return grams.get(term), True
+        sets = sorted(
+            (grams.get(term[i:i + 2]) for i in range(len(term) - 1)),
+            key=len,
+        )
+        if not sets[0]:
+            return frozenset(), True
+        if len(term) == 2:
+            return sets[0], True
+        if len(sets[0]) * 8 > len(self.sources):
+            # Intersecting large sets costs more than checking the few
+            # cards that search() walks before it has enough results.
+            return sets[0], False
+        return sets[0].intersection(*sets[1:]), False
+
+    def _match_term(self, field, term):
+        if field in TEXT_FIELDS:
+            return self._substring(field, term)
+        words = WORD_RE.findall(term)
+        if not words:
+            return frozenset(), True
+        index = self.words[field]
+        # Earlier words must match exactly, the last one is still being typed.
+        found = index.prefix(words[-1])
+        for word in words[:-1]:
+            found = found & index.get(word)
+        return found, True
+
+    def _term(self, raw):
+        """Ids that may match one query term, and a check for them.
+
+        The ids may be a set owned by the index.  The check is None when
+        they all match, otherwise it tells whether a card really matches;
+        it is only run on the cards that survive the other terms, so the
+        substring comparison is skipped for most cards of a broad term.
+        """
+        cached = self._terms.get(raw)
+        if cached is not None:
+            return cached
+        field, sep, term = raw.partition(':')
+        if sep and field in FIELDS:
+            fields = (field,)
+        else:
+            fields, term = FIELDS, raw
+        term = normalize(term)
+        if not term:
+            return None
+        hits = []
+        for field in fields:
+            ids, exact = self._match_term(field, term)
+            if ids:
+                hits.append((field, ids, exact))
+        hits.sort(key=lambda hit: len(hit[1]), reverse=True)
+        if not hits:
+            found = frozenset()
+        elif len(hits) == 1 or len(hits[0][1]) == len(self.sources):
+            found = hits[0][1]
+        else:
+            found = hits[0][1].union(*(ids for _, ids, _ in hits[1:]))
+        check = None
+        if not all(exact for _, _, exact in hits):
+            text = self.text
+            exact_ids = [ids for _, ids, exact in hits if exact]
+            loose = [
+                (ids, text[field]) for field, ids, exact in hits if not exact
+            ]
+            if len(hits) == 1:
+                values = loose[0][1]
+
+                def check(cid):
+                    return term in values[cid]
+            else:
+                def check(cid):
+                    for ids in exact_ids:
+                        if cid in ids:
+                            return True
+                    for ids, values in loose:
+                        if cid in ids and term in values[cid]:
+                            return True
+                    return False
+
+        if len(self._terms) >= TERM_CACHE_SIZE:
+            self._terms.clear()
+        cached = self._terms[raw] = (found, check)
+        return cached
+
+    def _matches(self, query):
+        """Candidate ids for ``query`` and the checks they must pass."""
+        result = None
+        checks = []
+        for raw in query.split():
+            term = self._term(raw)
+            if term is None:
+                continue
+            found, check = term
+            result = found if result is None else result & found
+            if not result:
+                return frozenset(), []
+            if check is not None:
+                checks.append(check)
+        return (result if result is not None else frozenset()), checks
+
+    def matches(self, query):
+        """Set of ids of the cards matching every term of ``query``."""
+        found, checks = self._matches(query)
+        for check in checks:
+            found = filter(check, found)
+        return set(found)
+
+    def search(self, query, limit=20):
+        """Up to ``limit`` matching ids, shortest Japanese text first."""
+        found, checks = self._matches(query)
+        # Walking the ranking takes about limit * len(self) / len(found)
+        # steps to collect ``limit`` matches, sorting them len(found).
+        if len(found) ** 2 < limit * len(self.sources):
+            for check in checks:
+                found = filter(check, found)
+            jp = self.text['jp']
+            return heapq.nsmallest(
+                limit, found, key=lambda cid: (len(jp[cid]), jp[cid], cid)
+            )
+        result = []
+        for _, _, cid in self._order:
+            if cid in found and all(check(cid) for check in checks):
+                result.append(cid)
+                if len(result) >= limit:
+                    break
+        return result
@@ -0,0 +1,373 @@
+"""Study server for several learners sharing one ``flashcards/`` corpus.
+
+The markdown files are parsed once into a read-only corpus.  Every learner
+only keeps the cards they have started studying, in their own JSON store
+under ``flashcard_learners/<name>/``, and those cards share their text with
+the corpus.  Memory therefore grows with what the learners have studied,
+not with the number of learners times the size of the corpus.  Cards a
+learner has never seen count as ``no_deck`` and are added to their store in
+corpus order when New Day needs them.
+
+The server speaks HTTP/1.1 with JSON bodies on asyncio streams, without
+dependencies beyond the standard library::
+
+    GET  /                         corpus size and the open learners
+    GET  /learners/<name>/next     next card and direction, {"card": null} when done
+    POST /learners/<name>/grade    {"rating": "D", "id": "<card id>"}
+    GET  /learners/<name>/counts   study, review and no_deck counts
+    POST /learners/<name>/new-day  start a new study session
+
+Requests for one learner are handled one at a time; requests for different
+learners interleave.  All card logic runs on the event loop thread through
+the same :class:`~japan_niche.session.StudySession` and
+:func:`~japan_niche.cards.start_new_day` as the GUI, with the learner's
+store made the active storage backend for the duration of the request.
+Writes go to a single :class:`~japan_niche.persist.PersistenceWorker`
+shared by all learners, which batches them at most once per
+``save_interval`` seconds.  Start it with ``python main.py serve``; with
+port 0 a free port is picked, which is handy for tests on localhost.
+"""
+
+import io
+import os
+import re
+import json
+import asyncio
+import contextlib
+from urllib.parse import urlsplit
+
+from .data import LEARNER_DIR, set_storage
+from .cards import (
+    SCORE_MAP,
+    deck_counts,
+    load_parse_cache,
+    parse_markdown_files,
+    save_parse_cache,
+    start_new_day,
+)
+from .decks import add_card, remove_card, use_review_engine
+from .model import Card
+from .persist import PersistenceWorker
+from .session import StudySession
+from .storage import BackgroundStorage, JsonStorage
+
+LEARNER_RE = re.compile(r'[A-Za-z0-9_-]{1,64}')
+MAX_BODY = 64 * 1024
+MAX_HEADERS = 100
+CARD_FIELDS = ('jp', 'en', 'pron', 'hira')
+
+REASONS = {
+    200: 'OK', 400: 'Bad Request', 404: 'Not Found',
+    405: 'Method Not Allowed', 409: 'Conflict', 413: 'Payload Too Large',
+    500: 'Internal Server Error',
+}
+
+
+class HttpError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+def load_corpus(workers=1):
+    """Parse ``flashcards/`` into ``{cid: Card}`` using the parse cache."""
+    cache = load_parse_cache()
+    corpus = parse_markdown_files(cache=cache['files'], workers=workers)
+    save_parse_cache(cache)
+    return corpus
+
+
+class Learner:
+    """Progress of one learner and their current study session."""
+
+    def __init__(self, name, storage, data):
+        self.name = name
+        self.storage = storage
+        self.data = data
+        self.session = None
+        self.lock = asyncio.Lock()
+        # Position in the corpus up to which every card is in ``data``.
+        self.cursor = 0
+
+    @contextlib.contextmanager
+    def active(self):
+        """Make the learner's store the storage backend of the card code."""
+        previous = set_storage(self.storage)
+        try:
+            yield
+        finally:
+            set_storage(previous)
+
+
+class StudyServer:
+    """HTTP/JSON front end over a shared corpus and per-learner stores.
+
+    Parameters
+    ----------
+    corpus : dict
+        ``{cid: Card}`` from :func:`load_corpus`; never modified.
+    config : dict
+        ``new_cards`` and ``review_cards`` for New Day, and
+        ``save_interval`` for the batched writes.
+    root : str
+        Directory holding one subdirectory per learner.
+    """
+
+    def __init__(self, corpus, config, root=LEARNER_DIR):
+        self.corpus = corpus
+        self.order = list(corpus)
+        self.config = config
+        self.root = root
+        self.learners = {}
+        self._opening = {}
+        self.worker = PersistenceWorker(config.get('save_interval', 1.0))
+        self.server = None
+
+    async def start(self, host='127.0.0.1', port=0):
+        """Listen on ``host``/``port``; returns the bound address."""
+        self.server = await asyncio.start_server(self._client, host, port)
+        return self.server.sockets[0].getsockname()[:2]
+
+    async def close(self):
+        """Stop listening and write every learner's pending changes."""
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        loop = asyncio.get_running_loop()
+        for learner in self.learners.values():
+            await loop.run_in_executor(None, learner.storage.close)
+        await loop.run_in_executor(None, self.worker.close)
+
+    async def learner(self, name):
+        """The learner called ``name``, loading their store on first use."""
+        learner = self.learners.get(name)
+        if learner is not None:
+            return learner
+        # Concurrent first requests for a learner wait for one load.
+        opening = self._opening.get(name)
+        if opening is None:
+            opening = self._opening[name] = asyncio.ensure_future(
+                self._open(name)
+            )
+        try:
+            return await opening
+        finally:
+            self._opening.pop(name, None)
+
+    async def _open(self, name):
+        path = os.path.join(self.root, name)
+        os.makedirs(path, exist_ok=True)
+        storage = BackgroundStorage(
+            JsonStorage(
+                os.path.join(path, 'flashcard_data.json'),
+                os.path.join(path, 'flashcard_data.journal'),
+            ),
+            worker=self.worker,
+        )
+        loop = asyncio.get_running_loop()
+        data = await loop.run_in_executor(None, storage.load)
+        corpus = self.corpus
+        for cid in list(data['cards']):
+            shared = corpus.get(cid)
+            if shared is None:
+                remove_card(data, cid)
+                continue
+            card = data['cards'][cid]
+            for field in CARD_FIELDS:
+                setattr(card, field, getattr(shared, field))
+        learner = self.learners[name] = Learner(name, storage, data)
+        return learner
+
+    def counts(self, learner):
+        counts = deck_counts(learner.data)
+        counts['no_deck'] += len(self.corpus) - len(learner.data['cards'])
+        return counts
+
+    def next_card(self, learner):
+        if learner.session is None:
+            learner.session = StudySession(learner.data)
+        picked = learner.session.next_card()
+        if picked is None:
+            return {'card': None, 'counts': self.counts(learner)}
+        cid, direction = picked
+        card = learner.data['cards'][cid]
+        shown = {'id': cid}
+        shown.update((field, card[field]) for field in CARD_FIELDS)
+        return {'card': shown, 'direction': direction}
+
+    def grade(self, learner, body):
+        rating = body.get('rating')
+        if rating not in SCORE_MAP:
+            raise HttpError(
+                400, f"rating must be one of {', '.join(SCORE_MAP)}"
+            )
+        session = learner.session
+        if session is None or session.cid is None:
+            raise HttpError(409, 'no card was asked')
+        if body.get('id', session.cid) != session.cid:
+            raise HttpError(409, f"the card asked is '{session.cid}'")
+        done = session.grade(rating)
+        if done is None:
+            raise HttpError(409, 'the card no longer exists')
+        return {'graduated': done, 'counts': self.counts(learner)}
+
+    def new_day(self, learner):
+        data = learner.data
+        config = self.config
+        # start_new_day picks new cards among the ones in ``data``, so the
+        # next unseen cards of the corpus are added first.
+        missing = config['new_cards'] - deck_counts(data)['no_deck']
+        order = self.order
+        while missing > 0 and learner.cursor < len(order):
+            cid = order[learner.cursor]
+            learner.cursor += 1
+            if cid in data['cards']:
+                continue
+            shared = self.corpus[cid]
+            add_card(data, Card(
+                cid, shared.jp, shared.en, shared.pron, shared.hira
+            ))
+            missing -= 1
+        with contextlib.redirect_stdout(io.StringIO()):
+            start_new_day(data, config)
+        learner.session = None
+        return {'study': len(data['study_deck']), 'counts': self.counts(learner)}
+
+    ROUTES = {
+        ('GET', 'next'): next_card,
+        ('POST', 'grade'): grade,
+        ('GET', 'counts'): counts,
+        ('POST', 'new-day'): new_day,
+    }
+
+    async def dispatch(self, method, target, body):
+        """Handle one request; returns the status and the JSON payload."""
+        parts = urlsplit(target).path.strip('/').split('/')
+        if parts == ['']:
+            if method != 'GET':
+                raise HttpError(405, 'use GET')
+            return 200, {
+                'cards': len(self.corpus), 'learners': sorted(self.learners)
+            }
+        if len(parts) != 3 or parts[0] != 'learners':
+            raise HttpError(404, f'no such resource: {target}')
+        _, name, action = parts
+        if not LEARNER_RE.fullmatch(name):
+            raise HttpError(404, f'invalid learner name: {name}')
+        handler = self.ROUTES.get((method, action))
+        if handler is None:
+            if any(a == action for _, a in self.ROUTES):
+                raise HttpError(405, f'{method} not allowed on {action}')
+            raise HttpError(404, f'no such action: {action}')
+        learner = await self.learner(name)
+        async with learner.lock:
+            # No awaits below: the request runs to completion before another
+            # one can switch the active storage backend.
+            with learner.active():
+                if action == 'grade':
+                    return 200, handler(self, learner, body)
+                return 200, handler(self, learner)
+
+    async def _client(self, reader, writer):
+        try:
+            while True:
+                # Malformed requests close the connection.
+                keep_alive = False
+                try:
+                    request = await _read_request(reader)
+                    if request is None:
+                        break
+                    method, target, keep_alive, body = request
+                    status, payload = await self.dispatch(method, target, body)
+                except HttpError as e:
+                    status, payload = e.status, {'error': str(e)}
+                except Exception as e:
+                    status, payload = 500, {'error': repr(e)}
+                    keep_alive = False
+                writer.write(_response(status, payload, keep_alive))
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+
+async def _read_request(reader):
+    """Read one request; returns None when the client closed the connection.
+
+    Returns ``(method, target, keep_alive, body)`` with the body parsed as
+    JSON (an empty dict when there is none).
+    """
+    line = await reader.readline()
+    if not line:
+        return None
+    try:
+        method, target, version = line.decode('latin-1').split()
+    except ValueError:
+        raise HttpError(400, 'malformed request line') from None
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        if len(headers) >= MAX_HEADERS:
+            raise HttpError(413, 'too many headers')
+        key, _, value = line.decode('latin-1').partition(':')
+        headers[key.strip().lower()] = value.strip()
+    connection = headers.get('connection', '').lower()
+    if version == 'HTTP/1.0':
+        keep_alive = connection == 'keep-alive'
+    else:
+        keep_alive = connection != 'close'
+    try:
+        length = int(headers.get('content-length', 0))
+    except ValueError:
+        raise HttpError(400, 'invalid Content-Length') from None
+    if length > MAX_BODY:
+        raise HttpError(413, 'request body too large')
+    body = {}
+    if length:
+        raw = await reader.readexactly(length)
+        try:
+            body = json.loads(raw)
+        except ValueError:
+            raise HttpError(400, 'body is not valid JSON') from None
+        if not isinstance(body, dict):
+            raise HttpError(400, 'body must be a JSON object')
+    return method, target, keep_alive, body
+
+
+def _response(status, payload, keep_alive):
+    body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+    head = (
+        f'HTTP/1.1 {status} {REASONS.get(status, "Error")}\r\n'
+        'Content-Type: application/json; charset=utf-8\r\n'
+        f'Content-Length: {len(body)}\r\n'
+        f'Connection: {"keep-alive" if keep_alive else "close"}\r\n'
+        '\r\n'
+    )
+    return head.encode('latin-1') + body
+
+
+def serve(config, host='127.0.0.1', port=8765, workers=1):
+    """Parse the corpus and serve until interrupted."""
+    use_review_engine(config.get('review_engine', 'auto'))
+    corpus = load_corpus(workers)
+
+    async def run():
+        server = StudyServer(corpus, config)
+        address = await server.start(host, port)
+        print(
+            f"Serving {len(corpus)} cards on http://{address[0]}:{address[1]}/"
+        )
+        try:
+            await asyncio.Event().wait()
+        finally:
+            await server.close()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
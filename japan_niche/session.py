@@ -0,0 +1,124 @@
+"""Study sessions without a user interface.
+
+:class:`StudySession` holds the scheduling part of a study session: which
+card and direction to ask next, grading, graduating finished cards and the
+deck counters.  The Qt window and the command line both drive it, and it
+can be used directly from scripts::
+
+    data = open_collection(load_config())
+    session = StudySession(data)
+    while session.next_card() is not None:
+        session.grade('D')
+"""
+
+from .data import load_data, record_card, use_storage
+from . import profiling
+from .history import open_history
+from .cards import apply_rating, assign_card_sources, deck_counts, graduate
+from .profiling import timed
+from .sampler import AdaptivePicker, remaining_directions
+
+
+def open_collection(config):
+    """Open the storage backend named in ``config`` and load the cards.
+
+    Profiling is switched on first if ``config`` or the environment ask for
+    it (see :func:`~japan_niche.profiling.configure`).  Grades are logged to
+    the review history unless ``config['review_history']`` is false.
+    Backends that store cards by markdown file learn where the cards come
+    from (see :func:`~japan_niche.cards.assign_card_sources`).
+    """
+    profiling.configure(config)
+    use_storage(config)
+    if config.get('review_history', True):
+        open_history(interval=config.get('save_interval', 0))
+    data = load_data()
+    assign_card_sources(data)
+    return data
+
+
+class StudySession:
+    """Weighted study of ``data['study_deck']`` until every card graduated.
+
+    Parameters
+    ----------
+    data : dict
+        The loaded collection.
+    seed : int, optional
+        Seed for the card and direction choice.
+    only : iterable, optional
+        Study only these card ids, e.g. the matches of a search (see
+        :meth:`~japan_niche.search.SearchIndex.matches`).  The session ends
+        when none of them is left in the study deck.
+    """
+
+    def __init__(self, data, seed=None, only=None):
+        self.data = data
+        if only is not None:
+            deck = data['study_deck']
+            only = {cid for cid in only if cid in deck}
+        self.only = only
+        self.picker = AdaptivePicker(data, seed, only)
+        self.cid = None
+        self.card = None
+        self.direction = None
+        self.graduated = 0
+
+    @timed('next_card')
+    def next_card(self):
+        """Pick the next card and direction to ask.
+
+        Cards whose directions are both learned are graduated on the way.
+        Returns ``(cid, direction)``, or None when the study deck (or the part
+        of it in ``only``) is empty.
+        """
+        data = self.data
+        deck = data['study_deck']
+        only = self.only
+        while deck and (only is None or only):
+            cid = self.picker.pick()
+            if only is not None and cid not in only:
+                # Only drawn when it was added to the deck after the session
+                # started, or when every card left in ``only`` is gone.
+                deck.set_weight(cid, 0.0)
+                only.intersection_update([c for c in only if c in deck])
+                continue
+            card = data['cards'][cid]
+            directions = remaining_directions(card)
+            if directions:
+                self.cid = cid
+                self.card = card
+                self.direction = self.picker.pick_direction(card, directions)
+                return cid, self.direction
+            graduate(data, cid)
+            record_card(data, cid)
+            self._graduated(cid)
+        self.cid = self.card = self.direction = None
+        return None
+
+    @timed('rate')
+    def grade(self, rating, now=None):
+        """Grade the current card with ``rating`` (``'A'`` to ``'F'``).
+
+        Returns True if the card graduated.  Returns None without grading if
+        the card no longer exists, e.g. because its markdown entry was
+        removed while it was shown.
+        """
+        cid = self.cid
+        if cid is None or cid not in self.data['cards']:
+            return None
+        done = apply_rating(self.data, cid, self.direction, rating, now)
+        self.picker.rated(cid)
+        record_card(self.data, cid)
+        if done:
+            self._graduated(cid)
+        return done
+
+    def _graduated(self, cid):
+        self.graduated += 1
+        if self.only is not None:
+            self.only.discard(cid)
+
+    def counts(self):
+        """Number of cards in the study, review and no_deck decks."""
+        return deck_counts(self.data)
@@ -0,0 +1,135 @@
+"""Progress split into one file per source markdown file.
+
+Every shard is a JSON file in ``flashcard_shards/`` holding the cards of one
+markdown file; cards whose file is not known yet are spread over
+``UNSORTED_SHARDS`` buckets by a hash of their id.  A shard file has two
+lines: the first maps every card id to its deck, the second holds the full
+cards.  ``manifest.json`` lists the shards in collection order together with
+the study deck, the last session and the schema version.
+
+:func:`open_shard` reads only the first line of a shard and returns
+:class:`ShardCard` objects that know their id and deck.  The first time any
+other field of one of them is used the rest of the shard is read, so
+counting the decks at startup reads a few bytes per card and cards are only
+decoded for the markdown files that are studied.
+"""
+
+import os
+import re
+import json
+import zlib
+
+from .model import Card
+
+MANIFEST_FILE = 'manifest.json'
+UNSORTED_SHARDS = 64
+
+_SLOTS = {name: Card.__dict__[name] for name in Card.__slots__}
+
+
+def shard_name(path):
+    """Name of the shard holding the cards of the markdown file ``path``.
+
+    The file name is kept for readability and a hash of the whole path
+    tells files of the same name in different directories apart.
+    """
+    path = path.replace(os.sep, '/')
+    stem = re.sub(r'[^\w-]+', '_', os.path.splitext(os.path.basename(path))[0])
+    return f"{stem}-{zlib.crc32(path.encode('utf-8')):08x}"
+
+
+def unsorted_shard(cid):
+    """Shard of a card whose markdown file is not known."""
+    bucket = zlib.crc32(cid.encode('utf-8')) % UNSORTED_SHARDS
+    return f"unsorted-{bucket:02d}"
+
+
+def encode_shard(cards):
+    """Text of a shard file holding the card dicts ``cards``."""
+    decks = {cid: card.get('deck', 'no_deck') for cid, card in cards.items()}
+    return (
+        json.dumps(decks, ensure_ascii=False, separators=(',', ':')) + '\n'
+        + json.dumps(cards, ensure_ascii=False, separators=(',', ':')) + '\n'
+    )
+
+
+def read_shard(path):
+    """Return the card dicts stored in the shard file ``path``."""
+    with open(path, 'r', encoding='utf-8') as f:
+        f.readline()
+        return json.loads(f.readline())
+
+
+class Shard:
+    """One shard file and the :class:`ShardCard` objects read from it.
+
+    ``loaded`` is set once the cards were read in full and ``touched`` when a
+    field of one of them was assigned; a full save rewrites such shards.
+    """
+
+    __slots__ = ('path', 'cards', 'loaded', 'touched')
+
+    def __init__(self, path):
+        self.path = path
+        self.cards = []
+        self.loaded = False
+        self.touched = False
+
+    def load(self):
+        """Read the cards of the shard; fields already set are kept."""
+        if self.loaded:
+            return
+        self.loaded = True
+        stored = read_shard(self.path)
+        for card in self.cards:
+            full = Card.from_dict(stored[_SLOTS['id'].__get__(card)])
+            for slot in _SLOTS.values():
+                try:
+                    slot.__get__(card)
+                except AttributeError:
+                    slot.__set__(card, slot.__get__(full))
+
+
+class ShardCard(Card):
+    """A :class:`Card` whose fields are read from its shard on first use.
+
+    Only ``id`` and ``deck`` are set when the card is created.  Reading any
+    other field loads the whole shard (see :meth:`Shard.load`); assigning a
+    field marks the shard as touched.
+    """
+
+    __slots__ = ('_shard',)
+
+    def __getattr__(self, name):
+        slot = _SLOTS.get(name)
+        if slot is None:
+            raise AttributeError(name)
+        _get_shard(self).load()
+        return slot.__get__(self)
+
+    def __setattr__(self, name, value):
+        object.__setattr__(self, name, value)
+        _get_shard(self).touched = True
+
+
+_get_shard = ShardCard.__dict__['_shard'].__get__
+_set_shard = ShardCard.__dict__['_shard'].__set__
+
+
+def open_shard(path):
+    """Read the ids and decks of the shard file ``path``.
+
+    Returns a :class:`Shard` whose ``cards`` are not loaded yet.
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        decks = json.loads(f.readline())
+    shard = Shard(path)
+    set_id = _SLOTS['id'].__set__
+    set_deck = _SLOTS['deck'].__set__
+    for cid, deck in decks.items():
+        card = object.__new__(ShardCard)
+        _set_shard(card, shard)
+        set_id(card, cid)
+        set_deck(card, deck)
+        shard.cards.append(card)
+    return shard
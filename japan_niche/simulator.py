@@ -0,0 +1,467 @@
+"""Simulated study days for tuning ``new_cards`` and ``review_cards``.
+
+:func:`simulate` runs a synthetic collection through many days of New Day and
+study with a :class:`Learner` answering the cards, and reports the daily
+workload and backlog.  Cards are chosen by the real
+:func:`~japan_niche.cards.start_new_day` (so by the same
+:func:`~japan_niche.cards.select_new_cards` and
+:func:`~japan_niche.cards.select_review_cards` as the program) and every
+grade goes through :func:`~japan_niche.cards.apply_rating`, so struggle,
+skill and graduation follow the production rules.  Nothing is written to
+disk: the storage backend and the review history are swapped out for the
+run.
+
+A learner remembers each card with an exponentially decaying recall
+probability whose stability grows when the card is answered right the first
+time in a session and shrinks when it is not.  Within a session every
+further attempt at a direction makes a right answer more likely.  The memory
+of all cards is kept in NumPy arrays and updated for a whole day at once.
+
+Two modes decide which grades are given:
+
+``'batched'`` (the default)
+    Every direction is asked until its skill reaches 2, in rounds over all
+    unfinished directions of the study deck, with the grades of a round
+    drawn as one array.  The grades are then applied card by card.  The
+    order cards are asked in does not change how likely the learner's
+    answers are, so this follows the same model as a real session, only
+    faster.  The random draws come in a different order, so the numbers for
+    one seed differ; averaged over seeds the two modes agree closely.
+``'session'``
+    A :class:`~japan_niche.session.StudySession` asks the cards in the order
+    the GUI would, one grade at a time.  Slower; useful to check the batched
+    mode and to study the effect of ``max_grades``, where the order decides
+    which cards are left over.
+
+:func:`sweep` runs many configurations in a process pool.  From the command
+line::
+
+    python -m japan_niche.simulator --cards 10000 --days 180 \\
+        --new-cards 10,20,35 --review-cards 50,100,200 --seeds 3 --workers 0
+
+prints a summary per configuration and the daily curves as JSON.  NumPy is
+required.
+"""
+
+import io
+import sys
+import json
+import argparse
+import contextlib
+
+from . import cards
+from .data import set_storage
+from .decks import REVIEW_ENGINES, review_engine, use_review_engine
+from .history import set_history
+from .sampler import DIRECTIONS
+from .session import StudySession
+from .storage import Storage, empty_data
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Grades by code; codes of right answers are >= RIGHT.
+GRADES = 'ASDF'
+RIGHT = 2
+DAY = 86400.0
+# Simulated collections start on this timestamp.
+EPOCH = 1.7e9
+
+LEARNERS = {
+    'weak': {'prior': 0.02, 'learn_rate': 0.25, 'growth': 1.8},
+    'average': {},
+    'strong': {'prior': 0.1, 'learn_rate': 0.5, 'growth': 3.0},
+}
+
+# Daily curves reported by simulate().
+CURVES = (
+    'grades', 'new', 'reviewed', 'graduated', 'carried_over',
+    'unseen', 'review_deck', 'due', 'retention',
+)
+
+
+class Learner:
+    """Seeded probabilistic model of one learner's answers.
+
+    Parameters
+    ----------
+    n_cards : int
+        Number of cards, addressed by their position in the collection.
+    seed : int, optional
+        Seed of the learner's random generator.
+    prior : float
+        Chance of knowing a card that was never studied.
+    learn_rate : float
+        Share of the remaining chance of a wrong answer that every attempt
+        in the same session removes.
+    easy, unsure : float
+        Share of right answers graded ``F`` rather than ``D``, and of wrong
+        answers graded ``S`` rather than ``A``.
+    e2j : float
+        Factor on the recall probability for English to Japanese.
+    stability : float
+        Days until the recall of a freshly learned card drops to 1/e.
+    growth, lapse : float
+        Factors on the stability after a session that started with right
+        answers in both directions, and after one that did not.
+    """
+
+    def __init__(self, n_cards, seed=None, prior=0.05, learn_rate=0.35,
+                 easy=0.3, unsure=0.4, e2j=0.85, stability=4.0,
+                 growth=2.5, lapse=0.5):
+        if np is None:
+            raise RuntimeError('the simulator needs NumPy')
+        self.rng = np.random.default_rng(seed)
+        self.prior = prior
+        self.learn_rate = learn_rate
+        self.easy = easy
+        self.unsure = unsure
+        self.e2j = e2j
+        self.initial_stability = stability
+        self.growth = growth
+        self.lapse = lapse
+        self.stability = np.full(n_cards, stability)
+        self.last_day = np.full(n_cards, -1, dtype=np.int64)
+
+    def recall(self, idx, day):
+        """Probability of recalling the cards ``idx`` on ``day`` (J2E)."""
+        last = self.last_day[idx]
+        p = np.exp(-(day - last) / self.stability[idx])
+        return np.where(last < 0, self.prior, p)
+
+    def grade(self, p0, attempts):
+        """Draw grade codes for directions with first-attempt recall ``p0``.
+
+        ``attempts`` is the number of earlier attempts at each direction in
+        the current session.
+        """
+        p = 1 - (1 - p0) * (1 - self.learn_rate) ** attempts
+        u = self.rng.random(len(p))
+        return np.select(
+            [u < p * self.easy, u < p, u < p + (1 - p) * self.unsure],
+            [3, 2, 1],
+            0,
+        )
+
+    def studied(self, idx, day, first_right):
+        """Update the memory of the cards ``idx`` studied on ``day``."""
+        seen = self.last_day[idx] >= 0
+        stability = self.stability[idx]
+        self.stability[idx] = np.where(
+            seen,
+            np.where(
+                first_right,
+                stability * self.growth,
+                np.maximum(self.initial_stability, stability * self.lapse),
+            ),
+            self.initial_stability,
+        )
+        self.last_day[idx] = day
+
+
+class NullStorage(Storage):
+    """Backend that writes nothing, so simulated days never touch the disk."""
+
+    def load(self):
+        return empty_data()
+
+    def prepare_save(self, data):
+        return _no_write
+
+
+def _no_write():
+    pass
+
+
+def synthetic_collection(n_cards):
+    """A collection of ``n_cards`` new cards, all in ``no_deck``."""
+    data = empty_data()
+    for i in range(n_cards):
+        cid = f'card{i}'
+        data['cards'][cid] = cards.new_card(cid, f'Meaning {i}', cid, 'あ')
+    return data
+
+
+def _study_batched(data, learner, ids, idx, day, max_grades):
+    """Study ``ids`` in rounds of vectorized grades; see the module doc.
+
+    Returns the number of grades, which cards were asked and whether each
+    card's first attempts were right in both directions.
+    """
+    n = len(ids)
+    p0 = learner.recall(idx, day)
+    # Pair i is the J2E direction of card i, pair n + i its E2J direction.
+    p0 = np.concatenate([p0, p0 * learner.e2j])
+    scores = np.zeros((2 * n, 3), dtype=np.int64)
+    attempts = np.zeros(2 * n, dtype=np.int64)
+    first_right = np.zeros(2 * n, dtype=bool)
+    score_of = np.array([cards.SCORE_MAP[g] for g in GRADES])
+    active = np.arange(2 * n)
+    budget = max_grades if max_grades > 0 else None
+    pairs = []
+    codes = []
+    while active.size and (budget is None or budget > 0):
+        if budget is not None and active.size > budget:
+            active = np.sort(learner.rng.choice(active, budget, replace=False))
+        round_codes = learner.grade(p0[active], attempts[active])
+        fresh = attempts[active] == 0
+        first_right[active[fresh]] = round_codes[fresh] >= RIGHT
+        # The skill is the sum of the scores of the last three ratings.
+        s = scores[active]
+        s[:, 1:] = s[:, :-1]
+        s[:, 0] = score_of[round_codes]
+        scores[active] = s
+        attempts[active] += 1
+        pairs.append(active)
+        codes.append(round_codes)
+        if budget is not None:
+            budget -= active.size
+        active = active[s.sum(axis=1) < 2]
+    if not pairs:
+        return 0, np.zeros(n, dtype=bool), np.zeros(n, dtype=bool)
+    pairs = np.concatenate(pairs)
+    codes = np.concatenate(codes)
+    order = np.argsort(pairs, kind='stable')
+    now = EPOCH + day * DAY
+    for k, (pair, code) in enumerate(zip(pairs[order].tolist(),
+                                         codes[order].tolist())):
+        cards.apply_rating(
+            data, ids[pair % n], DIRECTIONS[pair // n], GRADES[code], now + k
+        )
+    asked = (attempts[:n] + attempts[n:]) > 0
+    return len(pairs), asked, first_right[:n] & first_right[n:]
+
+
+def _study_session(data, learner, ids, idx, day, max_grades, seed):
+    """Study with a real :class:`StudySession`, one grade at a time."""
+    pos = {cid: i for i, cid in enumerate(ids)}
+    p0 = learner.recall(idx, day)
+    attempts = {}
+    first = {}
+    session = StudySession(data, seed=seed)
+    now = EPOCH + day * DAY
+    grades = 0
+    while (max_grades <= 0 or grades < max_grades) and session.next_card():
+        i = pos[session.cid]
+        direction = session.direction
+        k = attempts.get((i, direction), 0)
+        p = p0[i] if direction == 'J2E' else p0[i] * learner.e2j
+        code = int(learner.grade(np.array([p]), np.array([k]))[0])
+        if k == 0:
+            first[(i, direction)] = code >= RIGHT
+        attempts[(i, direction)] = k + 1
+        session.grade(GRADES[code], now + grades)
+        grades += 1
+    asked = np.zeros(len(ids), dtype=bool)
+    asked[[i for i, _ in attempts]] = True
+    first_right = np.array([
+        first.get((i, 'J2E'), False) and first.get((i, 'E2J'), False)
+        for i in range(len(ids))
+    ], dtype=bool)
+    return grades, asked, first_right
+
+
+def simulate(params):
+    """Simulate one configuration and return its curves and summary.
+
+    ``params`` is a dict with ``new_cards`` and ``review_cards`` (as in
+    ``config.json``) and optionally ``cards`` (collection size, 5000),
+    ``days`` (180), ``learner`` (a name in :data:`LEARNERS`, ``'average'``),
+    ``seed`` (0), ``mode`` (``'batched'`` or ``'session'``), ``max_grades``
+    (grades per day, 0 for no limit), ``retention`` (review cards whose
+    recall dropped below it count as ``due``, 0.9) and ``engine`` (the
+    review engine, see :func:`~japan_niche.decks.use_review_engine`,
+    ``'auto'``).  It is returned as the ``params`` of the result, so results
+    can be matched to their inputs after a :func:`sweep`.
+    """
+    n_cards = params.get('cards', 5000)
+    days = params.get('days', 180)
+    seed = params.get('seed', 0)
+    mode = params.get('mode', 'batched')
+    max_grades = params.get('max_grades', 0)
+    retention = params.get('retention', 0.9)
+    if mode not in ('batched', 'session'):
+        raise ValueError(f"unknown simulation mode {mode!r}")
+    config = {
+        'new_cards': params['new_cards'],
+        'review_cards': params['review_cards'],
+    }
+    learner = Learner(
+        n_cards, seed, **LEARNERS[params.get('learner', 'average')]
+    )
+    data = synthetic_collection(n_cards)
+    position = {cid: i for i, cid in enumerate(data['cards'])}
+    in_review = np.zeros(n_cards, dtype=bool)
+    curves = {name: [] for name in CURVES}
+
+    # Set here rather than by the caller so it also holds in the worker
+    # processes of sweep().
+    engine = review_engine()
+    use_review_engine(params.get('engine', 'auto'))
+    # Synthetic grades are neither saved nor logged to the review history.
+    previous = set_storage(NullStorage())
+    history = set_history(None)
+    try:
+        for day in range(days):
+            with contextlib.redirect_stdout(io.StringIO()):
+                cards.start_new_day(data, config)
+            ids = list(data['study_deck'])
+            idx = np.array([position[cid] for cid in ids], dtype=np.int64)
+            in_review[idx] = False
+            seen = learner.last_day[idx] >= 0
+            if mode == 'batched':
+                grades, asked, first_right = _study_batched(
+                    data, learner, ids, idx, day, max_grades
+                )
+            else:
+                grades, asked, first_right = _study_session(
+                    data, learner, ids, idx, day, max_grades,
+                    seed * 100003 + day,
+                )
+            learner.studied(idx[asked], day, first_right[asked])
+            deck = data['study_deck']
+            graduated = np.array(
+                [cid not in deck for cid in ids], dtype=bool
+            )
+            in_review[idx[graduated]] = True
+            counts = cards.deck_counts(data)
+            review = np.flatnonzero(in_review)
+            due = int(np.count_nonzero(learner.recall(review, day) < retention))
+            reviewed = int(np.count_nonzero(seen))
+            curves['grades'].append(grades)
+            curves['new'].append(len(ids) - reviewed)
+            curves['reviewed'].append(reviewed)
+            curves['graduated'].append(int(np.count_nonzero(graduated)))
+            curves['carried_over'].append(len(deck))
+            curves['unseen'].append(counts['no_deck'])
+            curves['review_deck'].append(counts['review'])
+            curves['due'].append(due)
+            curves['retention'].append(
+                round(float(first_right[seen].mean()), 4) if reviewed
+                else None
+            )
+    finally:
+        set_storage(previous)
+        set_history(history)
+        use_review_engine(engine)
+    return {'params': dict(params), 'summary': summarize(curves),
+            'curves': curves}
+
+
+def summarize(curves):
+    """Workload and backlog figures of the daily ``curves``."""
+    grades = curves['grades']
+    rates = [r for r in curves['retention'] if r is not None]
+    exhausted = next(
+        (day for day, n in enumerate(curves['unseen']) if n == 0), None
+    )
+    return {
+        'mean_grades': round(sum(grades) / len(grades), 1) if grades else 0,
+        'peak_grades': max(grades, default=0),
+        'days_to_exhaust_new': exhausted,
+        'final_due': curves['due'][-1] if grades else 0,
+        'mean_due': (
+            round(sum(curves['due']) / len(grades), 1) if grades else 0
+        ),
+        'final_review_deck': curves['review_deck'][-1] if grades else 0,
+        'retention': round(sum(rates) / len(rates), 4) if rates else None,
+    }
+
+
+def sweep(configs, workers=1):
+    """Run :func:`simulate` for every dict in ``configs``.
+
+    With ``workers`` above one the configurations run in a process pool.
+    Results are returned in the order of ``configs``.
+    """
+    configs = list(configs)
+    if workers > 1 and len(configs) > 1:
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            return list(pool.map(simulate, configs))
+    return [simulate(params) for params in configs]
+
+
+def _ints(text):
+    return [int(x) for x in text.split(',')]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m japan_niche.simulator',
+        description=__doc__.splitlines()[0],
+    )
+    parser.add_argument('--cards', type=int, default=5000,
+                        help='size of the simulated collection')
+    parser.add_argument('--days', type=int, default=180)
+    parser.add_argument('--new-cards', type=_ints, default=[35],
+                        help='comma separated new_cards values to try')
+    parser.add_argument('--review-cards', type=_ints, default=[100],
+                        help='comma separated review_cards values to try')
+    parser.add_argument('--learners', default='average',
+                        help=f"comma separated learner models "
+                             f"({', '.join(LEARNERS)})")
+    parser.add_argument('--seeds', type=int, default=1,
+                        help='seeded learners per configuration')
+    parser.add_argument('--mode', default='batched',
+                        choices=('batched', 'session'))
+    parser.add_argument('--max-grades', type=int, default=0,
+                        help='grades per day before stopping, 0 for no limit')
+    parser.add_argument('--retention', type=float, default=0.9,
+                        help='recall below which a review card is due')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='simulations run in parallel, 0 for all CPUs')
+    parser.add_argument('--engine', default='auto',
+                        choices=REVIEW_ENGINES,
+                        help='review engine used for New Day (default: auto)')
+    parser.add_argument('--output', help='write the JSON results to a file')
+    args = parser.parse_args(argv)
+    learners = args.learners.split(',')
+    for name in learners:
+        if name not in LEARNERS:
+            parser.error(f"unknown learner model '{name}'")
+
+    configs = [
+        {
+            'cards': args.cards, 'days': args.days, 'new_cards': new,
+            'review_cards': review, 'learner': learner, 'seed': seed,
+            'mode': args.mode, 'max_grades': args.max_grades,
+            'retention': args.retention, 'engine': args.engine,
+        }
+        for new in args.new_cards
+        for review in args.review_cards
+        for learner in learners
+        for seed in range(args.seeds)
+    ]
+    results = sweep(configs, cards.resolve_workers(args.workers))
+
+    print(
+        f"{'new':>5} {'review':>6} {'learner':<8} {'grades/day':>10} "
+        f"{'peak':>6} {'exhausted':>9} {'due':>7} {'retention':>9}",
+        file=sys.stderr,
+    )
+    for r in results:
+        p, s = r['params'], r['summary']
+        exhausted = s['days_to_exhaust_new']
+        rate = s['retention']
+        print(
+            f"{p['new_cards']:>5} {p['review_cards']:>6} {p['learner']:<8} "
+            f"{s['mean_grades']:>10} {s['peak_grades']:>6} "
+            f"{'-' if exhausted is None else exhausted:>9} "
+            f"{s['final_due']:>7} "
+            f"{'-' if rate is None else f'{rate:.1%}':>9}",
+            file=sys.stderr,
+        )
+    text = json.dumps({'results': results}, indent=4)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text)
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
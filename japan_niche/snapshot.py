@@ -0,0 +1,570 @@
+"""Compact binary snapshots of the flashcard collection.
+
+Layout (little endian, every section aligned to 8 bytes)::
+
+    header      magic, format version, card/string/study counts and the
+                offset and length of each section below
+    ids         card ids in collection order, UTF-8, NUL separated
+    str_offsets u64[n_strings + 1] byte offsets into ``str_blob``
+    str_blob    the string table: jp/en/pron/hira texts, deck names and
+                ratings (one string of rating letters per direction)
+    columns     one fixed-width array per scheduling field, indexed by card
+                row: u32 string indexes for the texts, deck and ratings,
+                i32 skill and struggle, f64 last study times (NaN for None)
+    study       u32 card rows of the study deck, in order
+    meta        JSON: the remaining top-level keys, legacy ``extra`` fields
+                and cards whose values do not fit the columns
+
+:func:`read_snapshot` memory-maps the file and returns cards as
+:class:`SnapshotCard` objects that only decode a field from the mapping the
+first time it is read, so loading costs one pass over the ids and card text
+is decoded only for cards that are shown.  The mapping stays open until
+:meth:`Snapshot.close` is called on the result of :func:`open_snapshot`.
+:func:`encode_snapshot` and :func:`read_snapshot` round-trip everything
+:class:`~japan_niche.model.Card` can hold; :func:`json_to_snapshot` and
+:func:`snapshot_to_json` convert between this format and
+``flashcard_data.json``.
+"""
+
+import gc
+import os
+import sys
+import json
+import math
+import mmap
+import struct
+from array import array
+from bisect import bisect_left
+from collections import deque
+from itertools import repeat
+
+from .model import Card, DirectionPair
+from .study_queue import StudyQueue
+
+MAGIC = b'JNSNAP\r\n'
+FORMAT_VERSION = 1
+NONE = 0xFFFFFFFF
+
+SECTIONS = ('ids', 'str_offsets', 'str_blob', 'columns', 'study', 'meta')
+_HEADER = struct.Struct('<8sIIII' + 'QQ' * len(SECTIONS))
+
+# Name and array typecode of every column, in file order.
+COLUMNS = (
+    ('jp', 'I'), ('en', 'I'), ('pron', 'I'), ('hira', 'I'), ('deck', 'I'),
+    ('ratings_j2e', 'I'), ('ratings_e2j', 'I'),
+    ('skill_j2e', 'i'), ('skill_e2j', 'i'),
+    ('struggle_j2e', 'i'), ('struggle_e2j', 'i'),
+    ('last_j2e', 'd'), ('last_e2j', 'd'),
+)
+_INT32 = (-2 ** 31, 2 ** 31 - 1)
+_SLOTS = {name: Card.__dict__[name] for name in Card.__slots__}
+TEXT_FIELDS = ('jp', 'en', 'pron', 'hira', 'deck')
+# Bit per lazily loaded field in ``SnapshotCard._loaded``.
+FIELD_BITS = {
+    name: 1 << i for i, name in enumerate(
+        TEXT_FIELDS + ('ratings', 'skill', 'struggle', 'last_study', 'extra')
+    )
+}
+ALL_FIELDS = (1 << len(FIELD_BITS)) - 1
+# Columns each field is stored in.
+FIELD_COLUMNS = {name: (name,) for name in TEXT_FIELDS}
+FIELD_COLUMNS.update({
+    'ratings': ('ratings_j2e', 'ratings_e2j'),
+    'skill': ('skill_j2e', 'skill_e2j'),
+    'struggle': ('struggle_j2e', 'struggle_e2j'),
+    'last_study': ('last_j2e', 'last_e2j'),
+    'extra': (),
+})
+# A string table holding more than this many strings per card is rebuilt
+# instead of being carried over to the next snapshot.
+MAX_STRINGS_PER_CARD = 8
+
+
+class SnapshotCard(Card):
+    """A :class:`Card` whose fields are read from a snapshot on first use.
+
+    Only ``id`` is set when the card is created.  Reading any other field
+    decodes just that field and stores it on the card, after which access
+    is as fast as for a plain :class:`Card`.  Assigned fields simply shadow
+    the snapshot.  ``_loaded`` has a bit set for every field that may differ
+    from the snapshot: fields that were assigned and the mutable per
+    direction fields once they were decoded.  All other fields are copied
+    from the old snapshot without decoding when the collection is saved.
+    """
+
+    __slots__ = ('_snapshot', '_row', '_loaded')
+
+    def __init__(self, snapshot, row, cid):
+        _set_snapshot(self, snapshot)
+        _set_row(self, row)
+        _set_loaded(self, 0)
+        _set_id(self, cid)
+
+    def __getattr__(self, name):
+        bit = FIELD_BITS.get(name)
+        if bit is None:
+            raise AttributeError(name)
+        value = self._snapshot.field(self._row, name)
+        _SLOTS[name].__set__(self, value)
+        if name not in TEXT_FIELDS:
+            _set_loaded(self, self._loaded | bit)
+        return value
+
+    def __setattr__(self, name, value):
+        object.__setattr__(self, name, value)
+        bit = FIELD_BITS.get(name)
+        if bit is not None:
+            _set_loaded(self, self._loaded | bit)
+
+    def peek(self, name):
+        """Return field ``name`` without caching it on the card."""
+        if self._loaded & FIELD_BITS[name]:
+            return _SLOTS[name].__get__(self)
+        return self._snapshot.field(self._row, name)
+
+
+_set_snapshot = SnapshotCard.__dict__['_snapshot'].__set__
+_set_row = SnapshotCard.__dict__['_row'].__set__
+_set_loaded = SnapshotCard.__dict__['_loaded'].__set__
+_set_id = _SLOTS['id'].__set__
+
+
+def _column(buf, offset, count, code):
+    size = array(code).itemsize
+    view = memoryview(buf)[offset:offset + count * size].cast(code)
+    if sys.byteorder == 'little':
+        return view
+    swapped = array(code, view)
+    swapped.byteswap()
+    return swapped
+
+
+class Snapshot:
+    """Read access to the sections of a snapshot held in ``buf``."""
+
+    def __init__(self, buf):
+        fields = _HEADER.unpack_from(buf, 0)
+        magic, version, n_cards, n_strings, n_study = fields[:5]
+        if magic != MAGIC:
+            raise ValueError('not a flashcard snapshot')
+        if version != FORMAT_VERSION:
+            raise ValueError(f'unsupported snapshot version {version}')
+        sections = dict(zip(SECTIONS, zip(fields[5::2], fields[6::2])))
+        self.buf = buf
+        self.n_cards = n_cards
+        self.n_strings = n_strings
+        self.sections = sections
+        self.str_offsets = _column(
+            buf, sections['str_offsets'][0], n_strings + 1, 'Q'
+        )
+        self._blob = sections['str_blob'][0]
+        self._strings = {}
+        offset = sections['columns'][0]
+        self.columns = {}
+        for name, code in COLUMNS:
+            self.columns[name] = _column(buf, offset, n_cards, code)
+            offset = _align(offset + n_cards * array(code).itemsize)
+        self.study_rows = _column(buf, sections['study'][0], n_study, 'I')
+        start, length = sections['meta']
+        self.meta = json.loads(bytes(buf[start:start + length]).decode())
+        self.extra = {int(k): v for k, v in self.meta['extra'].items()}
+        self._extra_rows = sorted(self.extra)
+
+    def close(self):
+        """Release the mapping.
+
+        Fields of cards that were not decoded yet can no longer be read.
+        """
+        views = [self.str_offsets, self.study_rows, *self.columns.values()]
+        for view in views:
+            if isinstance(view, memoryview):
+                view.release()
+        if isinstance(self.buf, mmap.mmap):
+            self.buf.close()
+
+    def ids(self):
+        start, length = self.sections['ids']
+        if not self.n_cards:
+            return []
+        return bytes(self.buf[start:start + length]).decode().split('\0')
+
+    def string(self, index):
+        if index == NONE:
+            return None
+        value = self._strings.get(index)
+        if value is None:
+            start = self._blob + self.str_offsets[index]
+            end = self._blob + self.str_offsets[index + 1]
+            value = self._strings[index] = bytes(self.buf[start:end]).decode()
+        return value
+
+    def str_blob(self):
+        start, length = self.sections['str_blob']
+        return bytes(self.buf[start:start + length])
+
+    def extra_rows(self, start, stop):
+        """Rows in ``start:stop`` that have legacy ``extra`` fields."""
+        rows = self._extra_rows
+        return rows[bisect_left(rows, start):bisect_left(rows, stop)]
+
+    def field(self, row, name):
+        columns = self.columns
+        if name in ('jp', 'en', 'pron', 'hira', 'deck'):
+            return self.string(columns[name][row])
+        if name == 'ratings':
+            return DirectionPair(
+                list(self.string(columns['ratings_j2e'][row])),
+                list(self.string(columns['ratings_e2j'][row])),
+            )
+        if name == 'skill' or name == 'struggle':
+            return DirectionPair(
+                columns[name + '_j2e'][row], columns[name + '_e2j'][row]
+            )
+        if name == 'last_study':
+            j2e = columns['last_j2e'][row]
+            e2j = columns['last_e2j'][row]
+            return DirectionPair(
+                None if math.isnan(j2e) else j2e,
+                None if math.isnan(e2j) else e2j,
+            )
+        if name == 'extra':
+            return self.extra.get(row)
+        raise AttributeError(name)
+
+
+def _align(offset):
+    return (offset + 7) & ~7
+
+
+def _fits_column(name, value):
+    """True if ``value`` of field ``name`` can be stored in its columns."""
+    if name in TEXT_FIELDS:
+        return type(value) is str or (value is None and name != 'deck')
+    if name == 'ratings':
+        for ratings in (value.J2E, value.E2J):
+            if not isinstance(ratings, list):
+                return False
+            for r in ratings:
+                if type(r) is not str or len(r) != 1:
+                    return False
+        return True
+    if name == 'skill' or name == 'struggle':
+        return all(
+            type(v) is int and _INT32[0] <= v <= _INT32[1]
+            for v in (value.J2E, value.E2J)
+        )
+    if name == 'last_study':
+        return all(
+            v is None or (type(v) is float and not math.isnan(v))
+            for v in (value.J2E, value.E2J)
+        )
+    return True
+
+
+class _Encoder:
+    """Builds the sections of a new snapshot card by card.
+
+    With a ``base`` snapshot, the new string table starts as a copy of the
+    base table so fields of :class:`SnapshotCard` objects from ``base`` that
+    were never loaded can be copied over as raw column values.
+    """
+
+    def __init__(self, base=None):
+        self.base = base
+        self.columns = {name: array(code) for name, code in COLUMNS}
+        self.ids = []
+        self.extra = {}
+        self.overflow = {}
+        self.strings = {}
+        self.encoded = []
+        self.n_strings = base.n_strings if base is not None else 0
+        self._nan = float('nan')
+
+    def intern(self, value):
+        if value is None:
+            return NONE
+        index = self.strings.get(value)
+        if index is None:
+            index = self.strings[value] = self.n_strings
+            self.n_strings += 1
+            self.encoded.append(value.encode())
+        return index
+
+    def add(self, cid, card):
+        """Append ``card`` as the next row."""
+        if '\0' in cid:
+            raise ValueError(f'card id {cid!r} contains a NUL character')
+        row = len(self.ids)
+        self.ids.append(cid)
+        columns = self.columns
+        loaded = ALL_FIELDS
+        if isinstance(card, SnapshotCard):
+            if card._snapshot is self.base:
+                loaded = card._loaded
+            get = card.peek
+        else:
+            get = card.__getattribute__
+        fields = [
+            (name, get(name)) for name, bit in FIELD_BITS.items()
+            if loaded & bit
+        ]
+        if card.id != cid or not all(
+            _fits_column(name, value) for name, value in fields
+        ):
+            self.overflow[row] = card.to_dict()
+            for name, code in COLUMNS:
+                columns[name].append(NONE if code == 'I' else 0)
+            return
+        if loaded != ALL_FIELDS:
+            # Fields that still match the base snapshot.
+            base = self.base
+            old = card._row
+            for name, bit in FIELD_BITS.items():
+                if loaded & bit:
+                    continue
+                for column in FIELD_COLUMNS[name]:
+                    columns[column].append(base.columns[column][old])
+                if name == 'extra' and old in base.extra:
+                    self.extra[row] = base.extra[old]
+        for name, value in fields:
+            if name in TEXT_FIELDS:
+                columns[name].append(self.intern(value))
+            elif name == 'ratings':
+                columns['ratings_j2e'].append(self.intern(''.join(value.J2E)))
+                columns['ratings_e2j'].append(self.intern(''.join(value.E2J)))
+            elif name == 'last_study':
+                nan = self._nan
+                columns['last_j2e'].append(
+                    nan if value.J2E is None else value.J2E
+                )
+                columns['last_e2j'].append(
+                    nan if value.E2J is None else value.E2J
+                )
+            elif name == 'extra':
+                if value:
+                    self.extra[row] = value
+            else:
+                j2e, e2j = FIELD_COLUMNS[name]
+                columns[j2e].append(value.J2E)
+                columns[e2j].append(value.E2J)
+
+    def copy(self, ids, start, stop):
+        """Append the unloaded base rows ``start:stop`` with ids ``ids``."""
+        base = self.base
+        row = len(self.ids)
+        self.ids.extend(ids)
+        for name, _ in COLUMNS:
+            self.columns[name].frombytes(base.columns[name][start:stop].tobytes())
+        for old in base.extra_rows(start, stop):
+            self.extra[row + old - start] = base.extra[old]
+
+    def finish(self, data):
+        rows = {cid: row for row, cid in enumerate(self.ids)}
+        study = array('I', (rows[cid] for cid in data['study_deck']))
+        base = self.base
+        if base is not None:
+            str_offsets = array('Q', base.str_offsets)
+            blob = [base.str_blob()]
+        else:
+            str_offsets = array('Q', [0])
+            blob = []
+        total = str_offsets[-1]
+        for s in self.encoded:
+            total += len(s)
+            str_offsets.append(total)
+        blob.extend(self.encoded)
+        meta = {
+            'data': {
+                k: v for k, v in data.items()
+                if k not in ('cards', 'study_deck') and not k.startswith('_')
+            },
+            'extra': self.extra,
+            'overflow': self.overflow,
+        }
+        column_bytes = bytearray()
+        for name, _ in COLUMNS:
+            column_bytes += _little_endian(self.columns[name])
+            column_bytes += bytes(_align(len(column_bytes)) - len(column_bytes))
+        payloads = {
+            'ids': '\0'.join(self.ids).encode(),
+            'str_offsets': _little_endian(str_offsets),
+            'str_blob': b''.join(blob),
+            'columns': bytes(column_bytes),
+            'study': _little_endian(study),
+            'meta': json.dumps(meta, separators=(',', ':')).encode(),
+        }
+        out = bytearray(_align(_HEADER.size))
+        locations = []
+        for name in SECTIONS:
+            payload = payloads[name]
+            locations += [len(out), len(payload)]
+            out += payload
+            out += bytes(_align(len(out)) - len(out))
+        _HEADER.pack_into(
+            out, 0, MAGIC, FORMAT_VERSION, len(self.ids), self.n_strings,
+            len(study), *locations,
+        )
+        return bytes(out)
+
+
+def encode_snapshot(data):
+    """Return ``data`` encoded as snapshot bytes.
+
+    Runs of cards loaded from a snapshot whose fields were never read or
+    assigned are copied from that snapshot without decoding them.
+    """
+    cards = data['cards']
+    base = None
+    for card in cards.values():
+        if isinstance(card, SnapshotCard):
+            base = card._snapshot
+            if base.n_strings > MAX_STRINGS_PER_CARD * len(cards) + 1024:
+                base = None
+            break
+    encoder = _Encoder(base)
+    run_ids = []
+    run_start = run_stop = 0
+    for cid, card in cards.items():
+        if (
+            base is not None
+            and type(card) is SnapshotCard
+            and card._snapshot is base
+            and not card._loaded
+            and card.id == cid
+        ):
+            if run_ids and card._row == run_stop:
+                run_stop += 1
+                run_ids.append(cid)
+                continue
+            if run_ids:
+                encoder.copy(run_ids, run_start, run_stop)
+            run_ids = [cid]
+            run_start = card._row
+            run_stop = run_start + 1
+            continue
+        if run_ids:
+            encoder.copy(run_ids, run_start, run_stop)
+            run_ids = []
+        encoder.add(cid, card)
+    if run_ids:
+        encoder.copy(run_ids, run_start, run_stop)
+    return encoder.finish(data)
+
+
+def _little_endian(values):
+    if sys.byteorder != 'little':
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def _make_cards(snapshot, ids):
+    """Create a :class:`SnapshotCard` per id, in bulk.
+
+    Equivalent to ``SnapshotCard(snapshot, row, cid)`` for every row, but
+    the slots are filled by C-level ``map`` calls and the cyclic garbage
+    collector, which would otherwise scan the new objects over and over,
+    is paused meanwhile.  This is most of the cost of loading a snapshot.
+    """
+    n = len(ids)
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        cards = list(map(object.__new__, repeat(SnapshotCard, n)))
+        for setter, values in (
+            (_set_snapshot, repeat(snapshot, n)),
+            (_set_row, range(n)),
+            (_set_loaded, repeat(0, n)),
+            (_set_id, ids),
+        ):
+            deque(map(setter, cards, values), 0)
+    finally:
+        if enabled:
+            gc.enable()
+    return cards
+
+
+def open_snapshot(path):
+    """Map the snapshot file ``path``; returns a :class:`Snapshot`.
+
+    On Windows, where a mapped file cannot be replaced by the next save, the
+    file is read into memory instead.
+    """
+    with open(path, 'rb') as f:
+        if os.name == 'nt':
+            buf = f.read()
+        else:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    return Snapshot(buf)
+
+
+def read_snapshot(path):
+    """Load the collection stored at ``path``.
+
+    The file is memory-mapped (see :func:`open_snapshot`) and cards decode
+    their fields lazily, so the mapping is never closed; use
+    :func:`snapshot_data` to control its lifetime.
+    """
+    return snapshot_data(open_snapshot(path))
+
+
+def snapshot_data(snapshot):
+    """Return the collection held by ``snapshot`` as a ``data`` dict."""
+    ids = snapshot.ids()
+    cards = dict(zip(ids, _make_cards(snapshot, ids)))
+    for row, card in snapshot.meta['overflow'].items():
+        cards[ids[int(row)]] = Card.from_dict(card)
+    data = dict(snapshot.meta['data'])
+    data['cards'] = cards
+    data['study_deck'] = StudyQueue(ids[row] for row in snapshot.study_rows)
+    return data
+
+
+def json_to_snapshot(json_path, snapshot_path):
+    """Convert a ``flashcard_data.json`` file to a snapshot.
+
+    Files written by older versions are upgraded first.
+    """
+    from .migrations import migrate
+    from .model import cards_from_dicts
+    from .persist import atomic_write
+    with open(json_path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    migrate(data)
+    cards_from_dicts(data['cards'])
+    atomic_write(snapshot_path, encode_snapshot(data))
+    return len(data['cards'])
+
+
+def snapshot_to_json(snapshot_path, json_path):
+    """Convert a snapshot back to a ``flashcard_data.json`` file."""
+    from .persist import atomic_write
+    from .storage import _json_default
+    snapshot = open_snapshot(snapshot_path)
+    try:
+        data = snapshot_data(snapshot)
+        text = json.dumps(data, indent=4, default=_json_default)
+    finally:
+        snapshot.close()
+    atomic_write(json_path, text)
+    return len(data['cards'])
+
+
+def main(argv=None):
+    import argparse
+    parser = argparse.ArgumentParser(
+        description='Convert between flashcard_data.json and a binary snapshot.'
+    )
+    parser.add_argument('direction', choices=('to-binary', 'to-json'))
+    parser.add_argument('source')
+    parser.add_argument('target')
+    args = parser.parse_args(argv)
+    if args.direction == 'to-binary':
+        count = json_to_snapshot(args.source, args.target)
+    else:
+        count = snapshot_to_json(args.source, args.target)
+    print(f'Converted {count} cards from {args.source} to {args.target}.')
+
+
+if __name__ == '__main__':
+    main()
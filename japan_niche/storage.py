@@ -0,0 +1,965 @@
+"""Persistence backends for the flashcard collection.
+
+Every backend loads the collection into the ``data`` dict used by the rest of
+the program (``cards``, ``study_deck`` and ``last_session``) and writes it back
+either in full with :meth:`Storage.save`, a few named cards at a time with
+:meth:`Storage.save_cards` or one card at a time with
+:meth:`Storage.record_card`.  Backends that keep the cards in an indexed store
+set ``indexed`` and answer the deck queries in :mod:`japan_niche.cards`
+directly instead of having them scan ``data['cards']``.
+
+Writes are split in two steps so they can be moved off the GUI thread by
+:class:`BackgroundStorage`: ``prepare_save``/``prepare_record`` capture what
+needs to be written from ``data`` on the caller's thread and return a job that
+performs the actual I/O wherever it is run.
+"""
+
+import os
+import abc
+import json
+import shutil
+import threading
+
+from .data import (
+    DATA_FILE,
+    JOURNAL_FILE,
+    SQLITE_FILE,
+    BINARY_FILE,
+    BINARY_JOURNAL_FILE,
+    SHARD_DIR,
+)
+from .migrations import SCHEMA_VERSION, migrate, schema_version
+from .model import Card, DirectionPair, cards_from_dicts
+from .persist import atomic_write, PersistenceWorker
+from .profiling import count, enabled
+from .shards import (
+    MANIFEST_FILE,
+    ShardCard,
+    encode_shard,
+    open_shard,
+    read_shard,
+    shard_name,
+    unsorted_shard,
+)
+from .snapshot import encode_snapshot, open_snapshot, snapshot_data
+from .study_queue import StudyQueue
+
+# Number of journal records after which the journal is folded back into the
+# snapshot in ``DATA_FILE``.
+JOURNAL_COMPACT_EVERY = 500
+
+
+def empty_data():
+    return {
+        "schema_version": SCHEMA_VERSION,
+        "cards": {},
+        "study_deck": StudyQueue(),
+        "last_session": None,
+    }
+
+
+def _json_default(obj):
+    """Serialize cards and the study queue in their original dict/list form."""
+    if isinstance(obj, (Card, DirectionPair)):
+        return obj.to_dict()
+    if isinstance(obj, StudyQueue):
+        return obj.to_list()
+    raise TypeError(f"{type(obj).__name__} is not JSON serializable")
+
+
+class Storage(abc.ABC):
+    """Base class for storage backends.
+
+    Backends implement :meth:`load` and :meth:`prepare_save`; the other
+    writes default to a full save.  Backends that set ``indexed`` also
+    answer ``deck_counts()``, ``select_new_cards(count)`` and
+    ``select_review_cards(count)`` for :mod:`japan_niche.cards`.
+    """
+
+    indexed = False
+    # True when :meth:`prepare_cards` writes only the named cards, so its
+    # jobs must not supersede the writes queued before them.
+    partial_saves = False
+
+    @abc.abstractmethod
+    def load(self):
+        """Read the collection and return the ``data`` dict."""
+
+    @abc.abstractmethod
+    def prepare_save(self, data):
+        """Capture all of ``data`` and return a job that writes it.
+
+        The job may run on another thread, so everything it needs from
+        ``data`` has to be copied or serialized before returning.
+        """
+
+    def prepare_record(self, data, cid):
+        """Like :meth:`prepare_save` for a change to the single card ``cid``.
+
+        Defaults to a full save.
+        """
+        return self.prepare_save(data)
+
+    def prepare_cards(self, data, cids):
+        """Like :meth:`prepare_save` for changes to the cards ``cids``.
+
+        ``cids`` may include removed cards.  Defaults to a full save.
+        """
+        return self.prepare_save(data)
+
+    def save(self, data):
+        self.prepare_save(data)()
+
+    def record_card(self, data, cid):
+        self.prepare_record(data, cid)()
+
+    def save_cards(self, data, cids):
+        self.prepare_cards(data, cids)()
+
+    def assign_sources(self, sources):
+        """Note the markdown file of each card, ``{cid: path}``.
+
+        Returns the ids of the cards whose stored location changed and that
+        have to be saved again; backends that do not partition the cards by
+        file ignore it.
+        """
+        return []
+
+    def needs_sources(self):
+        """True while cards are stored without knowing their markdown file.
+
+        Only backends that partition the cards by file ever return True;
+        see :func:`~japan_niche.cards.assign_card_sources`.
+        """
+        return False
+
+    def pending_writes(self):
+        """True while changes handed to a background thread are unwritten."""
+        return False
+
+    def flush(self):
+        """Wait for writes that have been handed to a background thread.
+
+        Raises :class:`~japan_niche.persist.SaveError` if any of them failed.
+        """
+
+    def check(self):
+        """Raise :class:`~japan_niche.persist.SaveError` for failed writes.
+
+        Does not wait for pending writes; synchronous backends raise from
+        the write itself instead.
+        """
+
+    def close(self):
+        pass
+
+
+class JsonStorage(Storage):
+    """Pretty-printed JSON snapshot plus an append-only review journal.
+
+    Grading only touches one card, so instead of rewriting the snapshot the
+    card and its study deck membership are appended as one JSON line to the
+    journal.  The journal is replayed by :meth:`load` and discarded by every
+    :meth:`save`.  After ``JOURNAL_COMPACT_EVERY`` records it is folded into
+    the snapshot on disk without consulting the in-memory data, so compaction
+    can run on the background writer as well.  Journal lines are buffered
+    and written with a single fsync per batch; snapshots are replaced
+    atomically.  Snapshots written by older versions are upgraded with
+    :func:`~japan_niche.migrations.migrate` and saved once, keeping the old
+    file as ``.bak``.
+    """
+
+    def __init__(self, path=DATA_FILE, journal_path=JOURNAL_FILE):
+        self.path = path
+        self.journal_path = journal_path
+        self._journal_records = 0
+        self._pending = []
+        self._lock = threading.Lock()
+
+    def load(self):
+        if not os.path.exists(self.path):
+            data = empty_data()
+            changed = False
+        else:
+            data, changed = self._load_snapshot()
+        if self._replay_journal(data):
+            changed = True
+        if changed:
+            self.save(data)
+        return data
+
+    def _load_snapshot(self):
+        """Read the snapshot; the flag is True if it needs to be saved."""
+        with open(self.path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        changed = schema_version(data) < SCHEMA_VERSION
+        if changed and migrate(data):
+            backup = self.path + '.bak'
+            shutil.copy2(self.path, backup)
+            print(
+                f"Upgraded {self.path} to format version "
+                f"{SCHEMA_VERSION}, backup created at {backup}"
+            )
+        cards_from_dicts(data['cards'])
+        data['study_deck'] = StudyQueue(data.get('study_deck', []))
+        return data, changed
+
+    def prepare_save(self, data):
+        # Keys starting with an underscore hold derived in-memory indexes.
+        snapshot = {k: v for k, v in data.items() if not k.startswith('_')}
+        text = json.dumps(snapshot, indent=4, default=_json_default)
+        with self._lock:
+            # Buffered journal lines are part of this snapshot.
+            self._pending = []
+        return lambda: self._write_snapshot(text)
+
+    def prepare_record(self, data, cid):
+        record = {
+            'id': cid,
+            'card': data['cards'][cid],
+            'study': cid in data['study_deck'],
+        }
+        line = json.dumps(
+            record, separators=(',', ':'), default=_json_default
+        ) + '\n'
+        with self._lock:
+            self._pending.append(line)
+        return self._flush_journal
+
+    def _write_snapshot(self, payload):
+        atomic_write(self.path, payload)
+        if os.path.exists(self.journal_path):
+            os.remove(self.journal_path)
+        self._journal_records = 0
+
+    def _flush_journal(self):
+        with self._lock:
+            lines, self._pending = self._pending, []
+        if not lines:
+            return
+        text = ''.join(lines)
+        with open(self.journal_path, 'a', encoding='utf-8') as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        self._journal_records += len(lines)
+        count('journal_records', len(lines))
+        if enabled():
+            count('bytes_written', len(text.encode('utf-8')))
+        if self._journal_records >= JOURNAL_COMPACT_EVERY:
+            self._compact()
+
+    def _compact(self):
+        """Fold the journal into the snapshot file."""
+        if os.path.exists(self.path):
+            with open(self.path, 'r', encoding='utf-8') as f:
+                snapshot = json.load(f)
+        else:
+            snapshot = empty_data()
+        snapshot['study_deck'] = StudyQueue(snapshot.get('study_deck', []))
+        self._replay_journal(snapshot)
+        self._write_snapshot(
+            json.dumps(snapshot, indent=4, default=_json_default)
+        )
+
+    def _replay_journal(self, data):
+        """Apply journal records written since the last snapshot to ``data``."""
+        if not os.path.exists(self.journal_path):
+            return False
+        replayed = False
+        with open(self.journal_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # A crash in the middle of an append leaves a partial last
+                    # line behind; everything before it is still valid.
+                    break
+                cid = record['id']
+                data['cards'][cid] = Card.from_dict(record['card'])
+                if record['study']:
+                    data['study_deck'].append(cid)
+                else:
+                    data['study_deck'].discard(cid)
+                replayed = True
+        return replayed
+
+
+class BinaryStorage(JsonStorage):
+    """Binary snapshot (see :mod:`japan_niche.snapshot`) plus a journal.
+
+    Works like :class:`JsonStorage`, but the snapshot is memory-mapped on
+    load and card fields are decoded as they are used, which makes startup
+    on large collections much faster.  When no snapshot exists yet but a
+    JSON data file does, the JSON data is migrated on the first
+    :meth:`load`.
+    """
+
+    def __init__(self, path=BINARY_FILE, journal_path=BINARY_JOURNAL_FILE,
+                 json_path=DATA_FILE, json_journal_path=JOURNAL_FILE):
+        super().__init__(path, journal_path)
+        self.json_path = json_path
+        self.json_journal_path = json_journal_path
+        # Mapped snapshots whose cards are in use; closed by :meth:`close`.
+        self._snapshots = []
+
+    def load(self):
+        if not os.path.exists(self.path) and os.path.exists(self.json_path):
+            return self.migrate_from_json()
+        return super().load()
+
+    def migrate_from_json(self):
+        """Convert the JSON data file (and its journal) to a snapshot."""
+        data = JsonStorage(self.json_path, self.json_journal_path).load()
+        self.save(data)
+        print(
+            f"Migrated {len(data['cards'])} cards from {self.json_path} "
+            f"to {self.path}."
+        )
+        return data
+
+    def _load_snapshot(self):
+        snapshot = open_snapshot(self.path)
+        data = snapshot_data(snapshot)
+        if schema_version(data) >= SCHEMA_VERSION:
+            self._snapshots.append(snapshot)
+            return data, False
+        data['cards'] = {
+            cid: card.to_dict() for cid, card in data['cards'].items()
+        }
+        data['study_deck'] = data['study_deck'].to_list()
+        snapshot.close()
+        migrate(data)
+        cards_from_dicts(data['cards'])
+        data['study_deck'] = StudyQueue(data['study_deck'])
+        return data, True
+
+    def prepare_save(self, data):
+        payload = encode_snapshot(data)
+        with self._lock:
+            self._pending = []
+        return lambda: self._write_snapshot(payload)
+
+    def _compact(self):
+        if not os.path.exists(self.path):
+            data = empty_data()
+            self._replay_journal(data)
+            self._write_snapshot(encode_snapshot(data))
+            return
+        snapshot = open_snapshot(self.path)
+        try:
+            data = snapshot_data(snapshot)
+            self._replay_journal(data)
+            payload = encode_snapshot(data)
+        finally:
+            snapshot.close()
+        self._write_snapshot(payload)
+
+    def close(self):
+        """Unmap the snapshots read by :meth:`load`.
+
+        Fields of loaded cards that were not decoded yet can no longer be
+        read afterwards.
+        """
+        super().close()
+        snapshots, self._snapshots = self._snapshots, []
+        for snapshot in snapshots:
+            snapshot.close()
+
+
+# Keys stored in their own columns; everything else on a card (ratings, skill
+# and any legacy fields) is kept as JSON in ``extra``.
+_COLUMN_KEYS = {'id', 'jp', 'en', 'pron', 'hira', 'deck', 'struggle',
+                'last_study'}
+
+# Same ordering as ``cards.select_review_cards``: highest combined struggle
+# first, then the oldest study time, then the original card order.  The
+# expressions must match the index definition for SQLite to use it.
+_TOTAL_STRUGGLE = '(struggle_j2e + struggle_e2j)'
+_LAST_STUDY = (
+    'COALESCE(MIN(last_study_j2e, last_study_e2j), '
+    'last_study_j2e, last_study_e2j, 0)'
+)
+
+_SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS cards (
+    id TEXT PRIMARY KEY,
+    seq INTEGER NOT NULL,
+    jp TEXT,
+    en TEXT,
+    pron TEXT,
+    hira TEXT,
+    deck TEXT NOT NULL DEFAULT 'no_deck',
+    struggle_j2e INTEGER NOT NULL DEFAULT 0,
+    struggle_e2j INTEGER NOT NULL DEFAULT 0,
+    last_study_j2e REAL,
+    last_study_e2j REAL,
+    study_pos INTEGER,
+    extra TEXT NOT NULL DEFAULT '{{}}'
+);
+CREATE INDEX IF NOT EXISTS cards_deck ON cards (deck, seq);
+CREATE INDEX IF NOT EXISTS cards_review
+    ON cards (deck, {_TOTAL_STRUGGLE} DESC, {_LAST_STUDY}, seq);
+CREATE INDEX IF NOT EXISTS cards_study
+    ON cards (study_pos) WHERE study_pos IS NOT NULL;
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+class SqliteStorage(Storage):
+    """Cards stored as rows of a SQLite database.
+
+    Deck membership, per-direction struggle and last study times and the
+    study deck position have their own indexed columns so deck counts and
+    card selection run as queries, and grading a card updates a single row.
+    :meth:`save_cards` only writes the named rows and the study deck
+    positions.  When the database is empty but a JSON data file exists, the
+    JSON data is migrated on the first :meth:`load`.
+    """
+
+    indexed = True
+    partial_saves = True
+
+    def __init__(self, path=SQLITE_FILE, json_path=DATA_FILE,
+                 journal_path=JOURNAL_FILE):
+        self.path = path
+        self.json_path = json_path
+        self.journal_path = journal_path
+        # Imported here so the other backends start without loading it.
+        import sqlite3
+        # Writes may run on the background writer, so the connection is
+        # shared between threads and every use is serialized by ``_lock``.
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.executescript(_SCHEMA)
+        self._lock = threading.RLock()
+
+    def load(self):
+        with self._lock:
+            if self._is_empty() and os.path.exists(self.json_path):
+                return self.migrate_from_json()
+            return self._load()
+
+    def _load(self):
+        data = empty_data()
+        cur = self.conn.execute(
+            'SELECT id, jp, en, pron, hira, deck, struggle_j2e, struggle_e2j,'
+            ' last_study_j2e, last_study_e2j, extra FROM cards ORDER BY seq'
+        )
+        for row in cur:
+            card = self._row_to_card(row)
+            data['cards'][card['id']] = card
+        data['study_deck'] = StudyQueue(
+            cid for (cid,) in self.conn.execute(
+                'SELECT id FROM cards WHERE study_pos IS NOT NULL'
+                ' ORDER BY study_pos'
+            )
+        )
+        row = self.conn.execute(
+            "SELECT value FROM meta WHERE key = 'last_session'"
+        ).fetchone()
+        if row is not None:
+            data['last_session'] = json.loads(row[0])
+        return data
+
+    def migrate_from_json(self):
+        """Import the JSON data file (and its journal) into the database."""
+        data = JsonStorage(self.json_path, self.journal_path).load()
+        self.save(data)
+        print(
+            f"Migrated {len(data['cards'])} cards from {self.json_path} "
+            f"to {self.path}."
+        )
+        return data
+
+    def prepare_save(self, data):
+        study_pos = {cid: i for i, cid in enumerate(data['study_deck'])}
+        rows = [
+            self._card_to_row(card, seq, study_pos.get(cid))
+            for seq, (cid, card) in enumerate(data['cards'].items())
+        ]
+        last_session = json.dumps(data.get('last_session'))
+        return lambda: self._write_all(rows, last_session)
+
+    def prepare_record(self, data, cid):
+        # seq and study_pos are resolved when the row is written.
+        row = self._card_to_row(data['cards'][cid], None, None)
+        in_study = cid in data['study_deck']
+        return lambda: self._write_card(row, in_study)
+
+    def prepare_cards(self, data, cids):
+        cards = data['cards']
+        rows = []
+        removed = []
+        for cid in dict.fromkeys(cids):
+            card = cards.get(cid)
+            if card is None:
+                removed.append((cid,))
+            else:
+                rows.append(self._card_to_row(card, None, None))
+        study = [(pos, cid) for pos, cid in enumerate(data['study_deck'])]
+        last_session = json.dumps(data.get('last_session'))
+        return lambda: self._write_cards(rows, removed, study, last_session)
+
+    def _write_cards(self, rows, removed, study, last_session):
+        with self._lock, self.conn:
+            self.conn.executemany('DELETE FROM cards WHERE id = ?', removed)
+            next_seq = None
+            for row in rows:
+                found = self.conn.execute(
+                    'SELECT seq FROM cards WHERE id = ?', (row[0],)
+                ).fetchone()
+                if found is not None:
+                    seq = found[0]
+                else:
+                    if next_seq is None:
+                        next_seq = self._next('seq')
+                    seq = next_seq
+                    next_seq += 1
+                self.conn.execute(
+                    self._UPSERT, (row[0], seq) + row[2:11] + (None, row[12])
+                )
+            # The study deck is small, so its positions are rewritten whole.
+            self.conn.execute(
+                'UPDATE cards SET study_pos = NULL WHERE study_pos IS NOT NULL'
+            )
+            self.conn.executemany(
+                'UPDATE cards SET study_pos = ? WHERE id = ?', study
+            )
+            self.conn.execute(
+                "INSERT OR REPLACE INTO meta (key, value)"
+                " VALUES ('last_session', ?)",
+                (last_session,),
+            )
+
+    def _write_all(self, rows, last_session):
+        with self._lock, self.conn:
+            self.conn.execute('CREATE TEMP TABLE IF NOT EXISTS keep (id TEXT)')
+            self.conn.execute('DELETE FROM keep')
+            self.conn.executemany(
+                'INSERT INTO keep (id) VALUES (?)', ((r[0],) for r in rows)
+            )
+            self.conn.execute(
+                'DELETE FROM cards WHERE id NOT IN (SELECT id FROM keep)'
+            )
+            self.conn.executemany(self._UPSERT, rows)
+            self.conn.execute(
+                "INSERT OR REPLACE INTO meta (key, value)"
+                " VALUES ('last_session', ?)",
+                (last_session,),
+            )
+
+    def _write_card(self, row, in_study):
+        cid = row[0]
+        with self._lock, self.conn:
+            found = self.conn.execute(
+                'SELECT seq, study_pos FROM cards WHERE id = ?', (cid,)
+            ).fetchone()
+            if found is None:
+                seq = self._next('seq')
+                pos = None
+            else:
+                seq, pos = found
+            if not in_study:
+                pos = None
+            elif pos is None:
+                pos = self._next('study_pos')
+            self.conn.execute(
+                self._UPSERT, (cid, seq) + row[2:11] + (pos, row[12])
+            )
+
+    def close(self):
+        with self._lock:
+            self.conn.close()
+
+    def deck_counts(self):
+        counts = {'study': 0, 'review': 0, 'no_deck': 0}
+        with self._lock:
+            rows = self.conn.execute(
+                'SELECT deck, COUNT(*) FROM cards GROUP BY deck'
+            ).fetchall()
+        for deck, n in rows:
+            if deck in counts:
+                counts[deck] = n
+        return counts
+
+    def select_new_cards(self, count):
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT id FROM cards WHERE deck = 'no_deck'"
+                " ORDER BY seq LIMIT ?",
+                (count,),
+            ).fetchall()
+        return [cid for (cid,) in rows]
+
+    def select_review_cards(self, count):
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT id FROM cards WHERE deck = 'review' "
+                f"ORDER BY {_TOTAL_STRUGGLE} DESC, {_LAST_STUDY}, seq"
+                " LIMIT ?",
+                (count,),
+            ).fetchall()
+        return [cid for (cid,) in rows]
+
+    _UPSERT = (
+        'INSERT INTO cards (id, seq, jp, en, pron, hira, deck, struggle_j2e,'
+        ' struggle_e2j, last_study_j2e, last_study_e2j, study_pos, extra)'
+        ' VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)'
+        ' ON CONFLICT (id) DO UPDATE SET seq = excluded.seq, jp = excluded.jp,'
+        ' en = excluded.en, pron = excluded.pron, hira = excluded.hira,'
+        ' deck = excluded.deck, struggle_j2e = excluded.struggle_j2e,'
+        ' struggle_e2j = excluded.struggle_e2j,'
+        ' last_study_j2e = excluded.last_study_j2e,'
+        ' last_study_e2j = excluded.last_study_e2j,'
+        ' study_pos = excluded.study_pos, extra = excluded.extra'
+    )
+
+    def _is_empty(self):
+        return self.conn.execute('SELECT 1 FROM cards LIMIT 1').fetchone() is None
+
+    def _next(self, column):
+        (value,) = self.conn.execute(
+            f'SELECT COALESCE(MAX({column}), -1) + 1 FROM cards'
+        ).fetchone()
+        return value
+
+    @staticmethod
+    def _card_to_row(card, seq, study_pos):
+        struggle = card.get('struggle', {})
+        last = card.get('last_study', {})
+        extra = {k: v for k, v in card.items() if k not in _COLUMN_KEYS}
+        return (
+            card['id'], seq, card.get('jp'), card.get('en'), card.get('pron'),
+            card.get('hira'), card.get('deck', 'no_deck'),
+            struggle.get('J2E', 0), struggle.get('E2J', 0),
+            last.get('J2E'), last.get('E2J'), study_pos,
+            json.dumps(extra, separators=(',', ':')),
+        )
+
+    @staticmethod
+    def _row_to_card(row):
+        (cid, jp, en, pron, hira, deck, s_j2e, s_e2j, l_j2e, l_e2j,
+         extra) = row
+        extra = json.loads(extra)
+        ratings = extra.pop('ratings', {})
+        skill = extra.pop('skill', {})
+        return Card(
+            cid, jp, en, pron, hira, deck,
+            DirectionPair(ratings.get('J2E', []), ratings.get('E2J', [])),
+            DirectionPair.from_dict(skill, 0),
+            DirectionPair(s_j2e, s_e2j),
+            DirectionPair(l_j2e, l_e2j),
+            extra or None,
+        )
+
+
+class ShardedStorage(Storage):
+    """Cards split into one shard file per markdown file.
+
+    See :mod:`japan_niche.shards` for the file layout.  Loading reads the
+    manifest and the ids and decks of every shard; the rest of a shard is
+    only read when one of its cards is used.  Writes merge the captured
+    cards into the shard files they belong to, so the cost of a save scales
+    with the number of changed cards and the shards holding them:
+    :meth:`record_card` and :meth:`save_cards` capture only the named cards,
+    and a full :meth:`save` captures the cards of shards that were read or
+    modified since loading plus the cards added or removed.  The manifest is
+    written after the shards.
+
+    Cards are kept in the shard of the markdown file reported by
+    :meth:`assign_sources`, and in hashed ``unsorted`` shards until their
+    file is known.  Cards are loaded shard by shard, so a card added to a
+    file later keeps its place among the cards of that file (which is the
+    order New Day takes new cards in).  When a card is found in two shards
+    (after a crash while it was moved) the first one in the manifest wins.
+    When no manifest exists yet but a JSON data file does, the JSON data is
+    migrated on the first :meth:`load`.
+    """
+
+    partial_saves = True
+
+    def __init__(self, path=SHARD_DIR, json_path=DATA_FILE,
+                 journal_path=JOURNAL_FILE):
+        self.path = path
+        self.json_path = json_path
+        self.journal_path = journal_path
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        # Shards read by the last load, by name.
+        self._shards = {}
+        # Shard name of every stored card, and the number of cards of each
+        # shard in manifest order.
+        self._shard_of = {}
+        self._sizes = {}
+        # Shard of the markdown file of each card, and the cards stored
+        # elsewhere.
+        self._wanted = {}
+        self._moved = set()
+        # Captured changes not written yet: shard name -> {cid: card dict,
+        # or None to remove it}, and the manifest text.
+        self._pending = {}
+        self._manifest = None
+
+    def _shard_path(self, name):
+        return os.path.join(self.path, name + '.json')
+
+    def load(self):
+        manifest_path = os.path.join(self.path, MANIFEST_FILE)
+        if not os.path.exists(manifest_path):
+            if os.path.exists(self.json_path):
+                return self.migrate_from_json()
+            self._reset()
+            return empty_data()
+        with open(manifest_path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        self._reset()
+        cards = {}
+        for name in data.pop('shards'):
+            shard = open_shard(self._shard_path(name))
+            self._shards[name] = shard
+            kept = []
+            for card in shard.cards:
+                cid = card.id
+                if cid in cards:
+                    self._pending.setdefault(name, {})[cid] = None
+                    continue
+                cards[cid] = card
+                self._shard_of[cid] = name
+                kept.append(card)
+            shard.cards = kept
+            self._sizes[name] = len(kept)
+        data['cards'] = cards
+        data['study_deck'] = StudyQueue(
+            cid for cid in data.get('study_deck', []) if cid in cards
+        )
+        if schema_version(data) < SCHEMA_VERSION:
+            data['cards'] = {
+                cid: card.to_dict() for cid, card in cards.items()
+            }
+            data['study_deck'] = data['study_deck'].to_list()
+            migrate(data)
+            cards_from_dicts(data['cards'])
+            data['study_deck'] = StudyQueue(data['study_deck'])
+            self.save(data)
+        return data
+
+    def migrate_from_json(self):
+        """Split the JSON data file (and its journal) into shards."""
+        data = JsonStorage(self.json_path, self.journal_path).load()
+        self._reset()
+        self.save(data)
+        print(
+            f"Migrated {len(data['cards'])} cards from {self.json_path} "
+            f"to {self.path}."
+        )
+        return data
+
+    def assign_sources(self, sources):
+        moved = []
+        names = {}
+        for cid, path in sources.items():
+            name = names.get(path)
+            if name is None:
+                name = names[path] = shard_name(path)
+            self._wanted[cid] = name
+            if self._shard_of.get(cid, name) != name:
+                self._moved.add(cid)
+                moved.append(cid)
+        return moved
+
+    def needs_sources(self):
+        return len(self._wanted) < len(self._shard_of)
+
+    def prepare_save(self, data):
+        cards = data['cards']
+        cids = [cid for cid in self._shard_of if cid not in cards]
+        for shard in self._shards.values():
+            if shard.loaded or shard.touched:
+                cids.extend(card.id for card in shard.cards)
+                shard.touched = False
+        # Cards created since loading, or replaced by new objects.
+        cids.extend(
+            cid for cid, card in cards.items() if type(card) is not ShardCard
+        )
+        return self._capture(data, dict.fromkeys(cids))
+
+    def prepare_record(self, data, cid):
+        return self._capture(data, (cid,))
+
+    def prepare_cards(self, data, cids):
+        return self._capture(data, cids)
+
+    def _capture(self, data, cids):
+        """Queue the current state of the cards ``cids`` for writing."""
+        cards = data['cards']
+        changes = []
+        for cid in list(cids) + list(self._moved):
+            old = self._shard_of.get(cid)
+            card = cards.get(cid)
+            if card is None:
+                self._wanted.pop(cid, None)
+                if old is not None:
+                    del self._shard_of[cid]
+                    self._sizes[old] -= 1
+                    changes.append((old, cid, None))
+                continue
+            name = self._wanted.get(cid) or old or unsorted_shard(cid)
+            if name != old:
+                if old is not None:
+                    self._sizes[old] -= 1
+                    changes.append((old, cid, None))
+                self._shard_of[cid] = name
+                self._sizes[name] = self._sizes.get(name, 0) + 1
+            changes.append((name, cid, card.to_dict()))
+        self._moved.clear()
+        self._sizes = {name: n for name, n in self._sizes.items() if n}
+        meta = {
+            k: v for k, v in data.items()
+            if k != 'cards' and not k.startswith('_')
+        }
+        meta['shards'] = list(self._sizes)
+        manifest = json.dumps(meta, indent=4, default=_json_default)
+        with self._lock:
+            for name, cid, card in changes:
+                self._pending.setdefault(name, {})[cid] = card
+            self._manifest = manifest
+        return self._flush
+
+    def _flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            manifest, self._manifest = self._manifest, None
+        if manifest is None:
+            return
+        os.makedirs(self.path, exist_ok=True)
+        for name, changes in pending.items():
+            path = self._shard_path(name)
+            stored = read_shard(path) if os.path.exists(path) else {}
+            for cid, card in changes.items():
+                if card is None:
+                    stored.pop(cid, None)
+                else:
+                    stored[cid] = card
+            if stored:
+                atomic_write(path, encode_shard(stored))
+            elif os.path.exists(path):
+                os.remove(path)
+        count('shards_written', len(pending))
+        atomic_write(os.path.join(self.path, MANIFEST_FILE), manifest)
+
+
+class BackgroundStorage(Storage):
+    """Wrap another backend so its writes run on a background thread.
+
+    Changes are captured on the caller's thread and written by a
+    :class:`~japan_niche.persist.PersistenceWorker` at most once per
+    ``interval`` seconds, so grading never waits for the disk.  A full save
+    supersedes all changes queued before it.  Reads flush pending writes
+    first.  Several backends can share one ``worker``; it is then flushed
+    but not stopped by :meth:`close`.  Writes that failed are raised as
+    :class:`~japan_niche.persist.SaveError` by :meth:`check`, :meth:`flush`
+    and :meth:`close`.
+    """
+
+    def __init__(self, storage, interval=1.0, worker=None):
+        self.storage = storage
+        self.indexed = storage.indexed
+        self._own_worker = worker is None
+        self.worker = worker or PersistenceWorker(interval)
+
+    def __repr__(self):
+        path = getattr(self.storage, 'path', None)
+        return f"{type(self.storage).__name__}({path!r})"
+
+    def load(self):
+        self.worker.flush(self)
+        return self.storage.load()
+
+    def prepare_save(self, data):
+        return self.storage.prepare_save(data)
+
+    def prepare_record(self, data, cid):
+        return self.storage.prepare_record(data, cid)
+
+    def prepare_cards(self, data, cids):
+        return self.storage.prepare_cards(data, cids)
+
+    def save(self, data):
+        self.worker.submit(
+            self.storage.prepare_save(data), supersede=True, owner=self
+        )
+
+    def record_card(self, data, cid):
+        self.worker.submit(self.storage.prepare_record(data, cid), owner=self)
+
+    def save_cards(self, data, cids):
+        self.worker.submit(
+            self.storage.prepare_cards(data, cids),
+            supersede=not self.storage.partial_saves,
+            owner=self,
+        )
+
+    def assign_sources(self, sources):
+        return self.storage.assign_sources(sources)
+
+    def needs_sources(self):
+        return self.storage.needs_sources()
+
+    def pending_writes(self):
+        return self.worker.pending(self)
+
+    def flush(self):
+        self.worker.flush(self)
+
+    def check(self):
+        self.worker.check(self)
+
+    def close(self):
+        try:
+            if self._own_worker:
+                self.worker.close()
+            else:
+                self.worker.flush(self)
+        finally:
+            self.storage.close()
+
+    def deck_counts(self):
+        self.worker.flush(self)
+        return self.storage.deck_counts()
+
+    def select_new_cards(self, count):
+        self.worker.flush(self)
+        return self.storage.select_new_cards(count)
+
+    def select_review_cards(self, count):
+        self.worker.flush(self)
+        return self.storage.select_review_cards(count)
+
+
+STORAGE_BACKENDS = {
+    'json': JsonStorage,
+    'sqlite': SqliteStorage,
+    'binary': BinaryStorage,
+    'sharded': ShardedStorage,
+}
+
+
+def open_storage(name, save_interval=0):
+    """Instantiate the storage backend registered under ``name``.
+
+    With a positive ``save_interval`` the backend is wrapped in a
+    :class:`BackgroundStorage` that writes at most once per interval.
+    """
+    try:
+        backend = STORAGE_BACKENDS[name]
+    except KeyError:
+        raise ValueError(f"Unknown storage backend '{name}'") from None
+    storage = backend()
+    if save_interval > 0:
+        storage = BackgroundStorage(storage, save_interval)
+    return storage
@@ -0,0 +1,164 @@
+import random
+
+
+class SumTree:
+    """Fenwick tree of non-negative weights with prefix-sum search.
+
+    ``set`` and ``find`` are O(log n); the capacity doubles as needed.
+    """
+
+    __slots__ = ('weights', '_tree', 'total')
+
+    def __init__(self, capacity=16, weights=()):
+        while capacity < len(weights):
+            capacity *= 2
+        self.weights = list(weights)
+        self.weights.extend([0.0] * (capacity - len(self.weights)))
+        self.rebuild()
+
+    def __len__(self):
+        return len(self.weights)
+
+    def get(self, i):
+        return self.weights[i]
+
+    def set(self, i, weight):
+        if i >= len(self.weights):
+            self._grow(i + 1)
+        delta = weight - self.weights[i]
+        self.weights[i] = weight
+        self.total += delta
+        tree = self._tree
+        n = len(self.weights)
+        i += 1
+        while i <= n:
+            tree[i] += delta
+            i += i & -i
+
+    def find(self, u):
+        """Return the first index whose cumulative weight exceeds ``u``."""
+        tree = self._tree
+        n = len(self.weights)
+        pos = 0
+        bit = 1 << (n.bit_length() - 1)
+        while bit:
+            nxt = pos + bit
+            if nxt <= n and tree[nxt] <= u:
+                pos = nxt
+                u -= tree[nxt]
+            bit >>= 1
+        return pos
+
+    def _grow(self, size):
+        capacity = len(self.weights)
+        while capacity < size:
+            capacity *= 2
+        self.weights.extend([0.0] * (capacity - len(self.weights)))
+        self.rebuild()
+
+    def rebuild(self):
+        """Rebuild the tree from ``weights`` in O(n), resetting float drift."""
+        n = len(self.weights)
+        tree = [0.0] * (n + 1)
+        for i, w in enumerate(self.weights, 1):
+            tree[i] += w
+            parent = i + (i & -i)
+            if parent <= n:
+                tree[parent] += tree[i]
+        self._tree = tree
+        self.total = sum(self.weights)
+
+
+class StudyQueue:
+    """The cards of the current study session.
+
+    Behaves like the list previously stored in ``data['study_deck']``
+    (iteration, ``len``, indexing, ``append``, ``remove``, ``in``) but keeps
+    an id -> position map next to the list so membership tests, removal and
+    picking a random card are all O(1).  Removal swaps the last card into the
+    freed slot, so the order of the remaining cards is not preserved.
+    Duplicate ids are ignored by :meth:`append`.
+
+    Every card also carries a sampling weight (1.0 unless changed with
+    :meth:`set_weight`) kept in a :class:`SumTree` by position, so
+    :meth:`weighted_choice` and weight updates are O(log n).
+    """
+
+    __slots__ = ('_items', '_index', '_weights')
+
+    def __init__(self, ids=()):
+        self._items = []
+        self._index = {}
+        for cid in ids:
+            if cid not in self._index:
+                self._index[cid] = len(self._items)
+                self._items.append(cid)
+        self._weights = SumTree(weights=[1.0] * len(self._items))
+
+    def __len__(self):
+        return len(self._items)
+
+    def __iter__(self):
+        return iter(self._items)
+
+    def __contains__(self, cid):
+        return cid in self._index
+
+    def __getitem__(self, i):
+        return self._items[i]
+
+    def __eq__(self, other):
+        if isinstance(other, StudyQueue):
+            return self._index.keys() == other._index.keys()
+        return NotImplemented
+
+    def __repr__(self):
+        return f"StudyQueue({self._items!r})"
+
+    def append(self, cid, weight=1.0):
+        if cid in self._index:
+            return
+        self._index[cid] = len(self._items)
+        self._weights.set(len(self._items), weight)
+        self._items.append(cid)
+
+    def remove(self, cid):
+        """Remove ``cid``; raises ``ValueError`` if absent, like ``list``."""
+        try:
+            i = self._index.pop(cid)
+        except KeyError:
+            raise ValueError(f"{cid!r} is not in the study queue") from None
+        last = self._items.pop()
+        n = len(self._items)
+        last_weight = self._weights.get(n)
+        self._weights.set(n, 0.0)
+        if i < n:
+            self._items[i] = last
+            self._index[last] = i
+            self._weights.set(i, last_weight)
+
+    def discard(self, cid):
+        if cid in self._index:
+            self.remove(cid)
+
+    def choice(self, rng=random):
+        """Return a uniformly random card id."""
+        return self._items[rng.randrange(len(self._items))]
+
+    def weight(self, cid):
+        return self._weights.get(self._index[cid])
+
+    def set_weight(self, cid, weight):
+        self._weights.set(self._index[cid], weight)
+
+    def weighted_choice(self, rng=random):
+        """Return a card id with probability proportional to its weight."""
+        total = self._weights.total
+        if total <= 0:
+            return self.choice(rng)
+        i = self._weights.find(rng.random() * total)
+        # Guard against float drift pointing past the last occupied slot.
+        return self._items[min(i, len(self._items) - 1)]
+
+    def to_list(self):
+        return list(self._items)
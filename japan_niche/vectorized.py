@@ -0,0 +1,105 @@
+"""Review priorities as NumPy columns.
+
+:class:`ReviewColumns` is the ``'numpy'`` review engine of
+:class:`~japan_niche.decks.DeckIndex`.  Instead of a heap of key tuples it
+keeps three arrays indexed by the card's ``seq`` position: total struggle,
+earliest study time and a review membership mask.  Picking the most urgent
+review cards is then a masked ``argpartition`` on struggle followed by a
+``lexsort`` of the few candidates that can make the cut, with the same key
+and tie breaking as :meth:`~japan_niche.decks.DeckIndex.review_key`.
+
+NumPy is optional; ``HAVE_NUMPY`` is False when it is not installed and the
+deck index falls back to the pure-Python heap.
+"""
+
+from .decks import _total_struggle, _last_study
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+HAVE_NUMPY = np is not None
+
+
+class ReviewColumns:
+    """Struggle, last study and review membership arrays by ``seq``.
+
+    Slots of cards that left the review deck are only unmasked, so the
+    arrays grow with the number of cards ever added and are never compacted.
+    """
+
+    def __init__(self, index):
+        if np is None:
+            raise RuntimeError('ReviewColumns needs NumPy')
+        self.index = index
+        self.rebuild()
+
+    def rebuild(self):
+        index = self.index
+        capacity = max(16, index._next_seq)
+        self.struggle = np.zeros(capacity, dtype=np.int64)
+        self.last = np.zeros(capacity, dtype=np.float64)
+        self.member = np.zeros(capacity, dtype=bool)
+        self.ids = np.empty(capacity, dtype=object)
+        review = list(index.ids('review'))
+        if not review:
+            return
+        cards = index.cards
+        seq = index.seq
+        rows = [
+            (seq[cid], _total_struggle(cards[cid]), _last_study(cards[cid]))
+            for cid in review
+        ]
+        seqs, struggle, last = zip(*rows)
+        seqs = np.array(seqs, dtype=np.int64)
+        self.struggle[seqs] = struggle
+        self.last[seqs] = last
+        self.member[seqs] = True
+        self.ids[seqs] = review
+
+    def _grow(self, size):
+        capacity = len(self.member)
+        while capacity < size:
+            capacity *= 2
+        extra = capacity - len(self.member)
+        self.struggle = np.concatenate(
+            (self.struggle, np.zeros(extra, dtype=np.int64))
+        )
+        self.last = np.concatenate(
+            (self.last, np.zeros(extra, dtype=np.float64))
+        )
+        self.member = np.concatenate(
+            (self.member, np.zeros(extra, dtype=bool))
+        )
+        self.ids = np.concatenate((self.ids, np.empty(extra, dtype=object)))
+
+    def update(self, cid):
+        i = self.index.seq[cid]
+        if i >= len(self.member):
+            self._grow(i + 1)
+        card = self.index.cards[cid]
+        self.struggle[i] = _total_struggle(card)
+        self.last[i] = _last_study(card)
+        self.member[i] = True
+        self.ids[i] = cid
+
+    def discard(self, cid):
+        i = self.index.seq[cid]
+        self.member[i] = False
+        self.ids[i] = None
+
+    def top(self, count):
+        """Runs in O(N) array operations plus O(c log c) for c candidates."""
+        seqs = np.flatnonzero(self.member)
+        if len(seqs) == 0:
+            return []
+        struggle = self.struggle[seqs]
+        if count < len(seqs):
+            # Only cards at least as struggling as the count-th card qualify.
+            cutoff = np.partition(struggle, len(seqs) - count)[len(seqs) - count]
+            keep = struggle >= cutoff
+            seqs = seqs[keep]
+            struggle = struggle[keep]
+        order = np.lexsort((seqs, self.last[seqs], -struggle))[:count]
+        return self.ids[seqs[order]].tolist()
@@ -1,9 +1,11 @@
-from japan_niche.gui import MainWindow
-from PyQt5.QtWidgets import QApplication
 import sys
 
 
 def gui_main():
+    # PyQt is only imported for the GUI so the command line starts quickly.
+    from PyQt5.QtWidgets import QApplication
+    from japan_niche.gui import MainWindow
+
     app = QApplication(sys.argv)
     window = MainWindow()
     window.resize(800, 600)
@@ -12,4 +14,7 @@ def gui_main():
 
 
 if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        from japan_niche.cli import main
+        sys.exit(main())
     gui_main()
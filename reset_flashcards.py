@@ -1,8 +1,21 @@
 import os
+import shutil
 
-for fname in ['flashcard_data.json']:
+for fname in [
+    'flashcard_data.json',
+    'flashcard_data.journal',
+    'flashcard_data.sqlite3',
+    'flashcard_data.snap',
+    'flashcard_data.snap.journal',
+    'flashcard_cache.json',
+]:
     if os.path.exists(fname):
         os.remove(fname)
         print(f"Removed {fname}")
     else:
         print(f"{fname} does not exist")
+
+for dname in ['flashcard_shards', 'flashcard_history', 'flashcard_learners']:
+    if os.path.isdir(dname):
+        shutil.rmtree(dname)
+        print(f"Removed {dname}")
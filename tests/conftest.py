@@ -0,0 +1,23 @@
+import pytest
+
+from japan_niche import cards
+from japan_niche.data import set_storage
+from japan_niche.history import set_history
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """Run in an empty directory with no storage backend or history open.
+
+    The data file names are relative, so every file a test writes ends up
+    in ``tmp_path``.
+    """
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(cards, '_parse_cache', None)
+    monkeypatch.setattr(cards, '_owners', None)
+    monkeypatch.setattr(cards, '_cache_dirty', False)
+    storage = set_storage(None)
+    history = set_history(None)
+    yield tmp_path
+    set_storage(storage)
+    set_history(history)
@@ -0,0 +1,78 @@
+import io
+import copy
+import json
+import random
+import contextlib
+
+import pytest
+
+import convert_flashcard_data
+from convert_flashcard_data import DATA_FILE, convert
+from japan_niche.migrations import SCHEMA_VERSION, migrate
+
+
+def legacy_data(seed, words=15):
+    """A pre-versioning data file mixing word cards and split halves.
+
+    Every word has a random subset of a word card and direction halves in
+    the old front/back format, and the cards come in random order.
+    """
+    rng = random.Random(seed)
+    cards = {}
+    for w in range(words):
+        jp = f'言葉{w}'
+        kinds = ['word', 'J2E', 'E2J', 'J2E again']
+        kinds = rng.sample(kinds, rng.randint(1, 4))
+        for kind in kinds:
+            if kind == 'word':
+                cards[jp] = {
+                    'id': jp, 'jp': jp, 'en': f'word {w}', 'pron': 'p',
+                    'hira': 'h', 'deck': rng.choice(['no_deck', 'review']),
+                    'ratings': {'J2E': ['D'], 'E2J': ['A']},
+                    'skill': {'J2E': 1, 'E2J': 2},
+                    'struggle': {'J2E': 3, 'E2J': 4},
+                    'last_study': {'J2E': 5.0, 'E2J': 6.0},
+                }
+                continue
+            direction = kind.split()[0]
+            answer = rng.choice(['', f'answer {w}'])
+            cid = f'deck|{w}|{jp}|en {w}|{direction}|{kind}'
+            cards[cid] = {
+                'id': f'deck|{w}|{jp}|en {w}|{direction}',
+                'back': f'{answer or jp} [pron {w}] [hira {w}]',
+                'deck': rng.choice(['no_deck', 'study']),
+                'ratings': ['SDF'[rng.randint(0, 2)]],
+                'skill': rng.randint(0, 2),
+                'struggle': rng.randint(0, 3),
+                'last_study': rng.choice([None, 7.0]),
+            }
+    items = list(cards.items())
+    rng.shuffle(items)
+    return {
+        'cards': dict(items),
+        'study_deck': [cid for cid in cards if rng.random() < 0.3],
+        'last_session': '2020-01-01',
+    }
+
+
+@pytest.mark.parametrize('window', [1, 3, 10000])
+@pytest.mark.parametrize('seed', range(8))
+def test_convert_matches_migrate(workdir, monkeypatch, seed, window):
+    # A small window makes halves arrive after their word was written.
+    monkeypatch.setattr(convert_flashcard_data, 'MERGE_WINDOW', window)
+    data = legacy_data(seed)
+    with open(DATA_FILE, 'w', encoding='utf-8') as f:
+        json.dump(data, f)
+    expected = copy.deepcopy(data)
+    migrate(expected)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        convert()
+    with open(DATA_FILE, encoding='utf-8') as f:
+        converted = json.load(f)
+    migrate(converted)
+
+    assert converted['cards'] == expected['cards']
+    assert converted['study_deck'] == expected['study_deck']
+    assert converted['last_session'] == expected['last_session']
+    assert converted['schema_version'] == SCHEMA_VERSION
@@ -0,0 +1,81 @@
+import random
+
+import pytest
+
+from japan_niche.decks import (
+    DECKS,
+    add_card,
+    deck_index,
+    remove_card,
+    set_deck,
+    use_review_engine,
+)
+from japan_niche.model import Card, DirectionPair
+from japan_niche.study_queue import StudyQueue
+from japan_niche.vectorized import HAVE_NUMPY
+
+
+def make_card(cid, rng):
+    return Card(
+        cid, cid, 'en', 'pron', 'hira',
+        deck=rng.choice(DECKS),
+        struggle=DirectionPair(rng.randint(0, 5), rng.randint(0, 5)),
+        last_study=DirectionPair(
+            rng.choice([None, rng.random()]), rng.choice([None, rng.random()])
+        ),
+    )
+
+
+@pytest.fixture(params=['heap', 'numpy'])
+def engine(request):
+    if request.param == 'numpy' and not HAVE_NUMPY:
+        pytest.skip('NumPy is not installed')
+    use_review_engine(request.param)
+    yield request.param
+    use_review_engine('auto')
+
+
+def test_verify_after_random_changes(engine):
+    rng = random.Random(6)
+    data = {
+        'cards': {f'c{i}': make_card(f'c{i}', rng) for i in range(50)},
+        'study_deck': StudyQueue(),
+    }
+    index = deck_index(data)
+    assert index.verify(data['cards']) == []
+    next_id = 50
+    for step in range(500):
+        action = rng.random()
+        if action < 0.3 or not data['cards']:
+            cid = f'c{next_id}'
+            next_id += 1
+            add_card(data, make_card(cid, rng))
+        elif action < 0.5:
+            remove_card(data, rng.choice(list(data['cards'])))
+        else:
+            cid = rng.choice(list(data['cards']))
+            set_deck(data, cid, rng.choice(DECKS))
+            if index.deck_of[cid] == 'review':
+                data['cards'][cid]['struggle']['J2E'] = rng.randint(0, 5)
+                index.update(cid)
+        if step % 50 == 0:
+            # Ranking the review deck builds the engine, which later
+            # changes then have to keep up to date.
+            index.top_review(5)
+        assert index.verify(data['cards']) == [], step
+    assert index.counts() == {
+        deck: sum(1 for c in data['cards'].values() if c['deck'] == deck)
+        for deck in DECKS
+    }
+
+
+def test_verify_reports_direct_deck_changes():
+    rng = random.Random(1)
+    data = {
+        'cards': {f'c{i}': make_card(f'c{i}', rng) for i in range(5)},
+        'study_deck': StudyQueue(),
+    }
+    index = deck_index(data)
+    card = data['cards']['c0']
+    card['deck'] = 'study' if card['deck'] != 'study' else 'review'
+    assert index.verify(data['cards'])
@@ -0,0 +1,143 @@
+import os
+
+from japan_niche import cards
+from japan_niche.cards import FLASHCARD_DIR
+from japan_niche.data import load_data
+from japan_niche.decks import deck_index, set_deck
+
+
+def write(name, *entries, category='Words'):
+    path = os.path.join(FLASHCARD_DIR, name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    lines = [f'# {category}']
+    lines += [f'- {jp}: {en} [{jp}] [{jp}]' for jp, en in entries]
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('\n'.join(lines) + '\n')
+    return path
+
+
+def path(name):
+    return os.path.join(FLASHCARD_DIR, name)
+
+
+def change(data, *names):
+    """Re-read ``names`` the way the file watcher does and merge them."""
+    files = cards.load_parse_cache()['files']
+    hashes = {p: entry['hash'] for p, entry in files.items()}
+    changes = cards.read_file_changes([path(n) for n in names], hashes)
+    return cards.apply_file_changes(data, changes)
+
+
+def texts(card_map):
+    return {
+        cid: tuple(card[k] for k in cards.CARD_TEXT_FIELDS)
+        for cid, card in card_map.items()
+    }
+
+
+def check(data):
+    """``data`` agrees with a full parse and its indexes are consistent."""
+    assert texts(data['cards']) == texts(cards.parse_markdown_files())
+    assert cards._owners == cards._owner_index(cards._parse_cache['files'])
+    assert deck_index(data).verify(data['cards']) == []
+    assert all(cid in data['cards'] for cid in data['study_deck'])
+
+
+def scanned():
+    write('a.md', ('犬', 'dog'), ('猫', 'cat'))
+    write('b.md', ('鳥', 'bird'))
+    data = load_data()
+    cards.scan_files(data)
+    return data
+
+
+def empty_diff():
+    return {'added': [], 'updated': [], 'removed': []}
+
+
+def test_edit_updates_only_that_card(workdir):
+    data = scanned()
+    data['cards']['犬']['skill']['J2E'] = 2
+    write('a.md', ('犬', 'hound'), ('猫', 'cat'), ('魚', 'fish'))
+    diff = change(data, 'a.md')
+    assert diff == {'added': ['魚'], 'updated': ['犬'], 'removed': []}
+    assert data['cards']['犬']['en'] == 'hound'
+    assert data['cards']['犬']['skill']['J2E'] == 2
+    assert cards._cache_dirty
+    check(data)
+
+
+def test_deleted_file_removes_its_cards(workdir):
+    data = scanned()
+    set_deck(data, '犬', 'study')
+    data['study_deck'].append('犬')
+    os.remove(path('a.md'))
+    diff = change(data, 'a.md')
+    assert set(diff['removed']) == {'犬', '猫'}
+    assert '犬' not in data['study_deck']
+    assert deck_index(data).count('study') == 0
+    check(data)
+
+
+def test_rename_keeps_the_cards(workdir):
+    data = scanned()
+    data['cards']['猫']['skill']['E2J'] = -1
+    os.rename(path('a.md'), path('c.md'))
+    assert change(data, 'a.md', 'c.md') == empty_diff()
+    assert data['cards']['猫']['skill']['E2J'] == -1
+    assert cards._owners['猫'] == [path('c.md')]
+    check(data)
+
+
+def test_card_moving_between_files_keeps_its_progress(workdir):
+    data = scanned()
+    data['cards']['犬']['skill']['J2E'] = 3
+    write('a.md', ('猫', 'cat'))
+    write('b.md', ('鳥', 'bird'), ('犬', 'dog'))
+    assert change(data, 'a.md', 'b.md') == empty_diff()
+    assert data['cards']['犬']['skill']['J2E'] == 3
+    assert cards._owners['犬'] == [path('b.md')]
+    check(data)
+
+
+def test_duplicate_ids_follow_the_first_file(workdir):
+    data = scanned()
+    write('b.md', ('鳥', 'bird'), ('犬', 'puppy'))
+    assert change(data, 'b.md') == empty_diff()
+    assert data['cards']['犬']['en'] == 'dog'
+    assert cards._owners['犬'] == [path('a.md'), path('b.md')]
+    check(data)
+
+    # Without the first definition the second one takes over.
+    write('a.md', ('猫', 'cat'))
+    assert change(data, 'a.md')['updated'] == ['犬']
+    assert data['cards']['犬']['en'] == 'puppy'
+    check(data)
+
+    # Files in subdirectories come after the files next to them.
+    write('sub/a.md', ('猫', 'kitten'))
+    assert change(data, 'sub/a.md') == empty_diff()
+    assert cards._owners['猫'] == [path('a.md'), path('sub/a.md')]
+    os.remove(path('a.md'))
+    assert change(data, 'a.md')['updated'] == ['猫']
+    assert data['cards']['猫']['en'] == 'kitten'
+    check(data)
+
+
+def test_touched_file_without_changes_is_not_merged(workdir):
+    data = scanned()
+    os.utime(path('a.md'), ns=(0, 0))
+    assert change(data, 'a.md') == empty_diff()
+    assert cards._parse_cache['files'][path('a.md')]['mtime'] == 0
+    check(data)
+
+
+def test_merged_cache_is_written_on_flush(workdir):
+    data = scanned()
+    write('b.md', ('鳥', 'bird'), ('魚', 'fish'))
+    change(data, 'b.md')
+    cards.flush_parse_cache()
+    assert not cards._cache_dirty
+    cards._parse_cache = None
+    cards._owners = None
+    assert cards.scan_files(data) == empty_diff()
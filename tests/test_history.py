@@ -0,0 +1,62 @@
+import os
+
+import pytest
+
+from japan_niche import history
+from japan_niche.history import HISTORY_DIR, ReviewHistory
+from japan_niche.persist import SaveError
+
+NOW = 1750000000.0
+DAY = 86400
+
+
+def test_nothing_is_read_or_created_before_use(workdir):
+    log = ReviewHistory()
+    log.flush()
+    log.close()
+    assert not os.path.exists(HISTORY_DIR)
+
+
+@pytest.mark.parametrize('interval', [0, 0.05])
+def test_records_survive_reopening(workdir, interval):
+    log = ReviewHistory(interval=interval)
+    log.record('犬', 'J2E', 'A', NOW)
+    log.record('猫', 'E2J', 'D', NOW)
+    log.record('犬', 'E2J', 'S', NOW)
+    log.close()
+    log = ReviewHistory()
+    assert len(log) == 3
+    assert log.hardest_cards(days=1, now=NOW) == [('犬', 4, 2)]
+    assert log.card_summary('猫')['ratings'] == {
+        'A': 0, 'S': 0, 'D': 1, 'F': 0
+    }
+    log.close()
+
+
+@pytest.mark.parametrize('numpy', [True, False])
+def test_hardest_cards_with_the_clock_set_back(workdir, monkeypatch, numpy):
+    if not numpy:
+        monkeypatch.setattr(history, '_numpy', lambda: None)
+    log = ReviewHistory()
+    log.record('new', 'J2E', 'A', NOW)
+    # Graded 40 days "earlier", after the time column already moved on.
+    log.record('old', 'J2E', 'A', NOW - 40 * DAY)
+    log.record('new', 'E2J', 'S', NOW)
+    assert log.hardest_cards(days=30, now=NOW) == [('new', 4, 2)]
+    assert log.hardest_cards(days=None) == [('new', 4, 2), ('old', 3, 1)]
+    log.close()
+
+
+def test_close_releases_files_when_writing_failed(workdir, monkeypatch):
+    log = ReviewHistory(interval=0.05)
+    log.record('犬', 'J2E', 'A', NOW)
+
+    def fail(ids, chunks):
+        raise OSError('disk full')
+
+    monkeypatch.setattr(log, '_write', fail)
+    log.record('猫', 'J2E', 'A', NOW)
+    with pytest.raises(SaveError):
+        log.close()
+    assert all(f.closed for f in log._files.values())
+    assert os.path.exists(os.path.join(HISTORY_DIR, 'aggregates.json'))
@@ -0,0 +1,73 @@
+import doctest
+
+import pytest
+
+from japan_niche import kana
+from japan_niche.kana import romaji, segments
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('きって', 'kitte'),
+    ('がっこう', 'gakkou'),
+    ('マッチ', 'matchi'),
+    ('ちょっと', 'chotto'),
+    # Nothing to double: the sokuon is written as a glottal stop.
+    ('あっ', "a'"),
+    ('っあ', "'a"),
+])
+def test_sokuon_doubles_the_next_consonant(text, expected):
+    assert romaji(text) == expected
+
+
+def test_sokuon_is_one_segment_with_its_syllable():
+    assert segments('マッチ') == (('マ', 'ma'), ('ッチ', 'tchi'))
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('コーヒー', 'koohii'),
+    ('ティー', 'tii'),
+    ('らーめん', 'raamen'),
+    # Without a vowel before it the mark is kept as a dash.
+    ('ーあ', '-a'),
+    ('ンー', 'n-'),
+])
+def test_long_vowel_mark_repeats_the_vowel(text, expected):
+    assert romaji(text) == expected
+
+
+def test_long_vowel_mark_joins_the_previous_segment():
+    assert segments('コーヒー') == (('コー', 'koo'), ('ヒー', 'hii'))
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('きんえん', "kin'en"),
+    ('こんやく', "kon'yaku"),
+    ('ほんや', "hon'ya"),
+    ('しんぶん', 'shinbun'),
+    ('かんじ', 'kanji'),
+    ('コンニチハ', 'konnichiha'),
+])
+def test_n_before_a_vowel_or_y(text, expected):
+    assert romaji(text) == expected
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('きゃく', (('きゃ', 'kya'), ('く', 'ku'))),
+    ('じゅう', (('じゅ', 'ju'), ('う', 'u'))),
+    ('しょ', (('しょ', 'sho'),)),
+    ('チェック', (('チェ', 'che'), ('ック', 'kku'))),
+    ('ファイル', (('ファ', 'fa'), ('イ', 'i'), ('ル', 'ru'))),
+    ('ヴァ', (('ヴァ', 'va'),)),
+    ('ぁ', (('ぁ', 'a'),)),
+])
+def test_small_kana_digraphs_are_one_syllable(text, expected):
+    assert segments(text) == expected
+
+
+def test_other_characters_pass_through():
+    assert segments('A水') == (('A', 'A'), ('水', '水'))
+    assert romaji('') == ''
+
+
+def test_module_examples():
+    assert doctest.testmod(kana).failed == 0
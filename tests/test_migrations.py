@@ -0,0 +1,142 @@
+import copy
+import json
+
+import pytest
+
+from japan_niche.data import DATA_FILE
+from japan_niche.migrations import (
+    MIGRATIONS,
+    SCHEMA_VERSION,
+    migrate,
+    migration,
+    schema_version,
+)
+from japan_niche.storage import JsonStorage
+
+SPLIT_ID = 'vocab|1|水|water|J2E'
+
+# The same card as written by every old version of the data file.
+OLD_FILES = {
+    0: {
+        'cards': {
+            SPLIT_ID: {
+                'id': SPLIT_ID,
+                'back': 'water [mizu] [みず]',
+                'deck': 'study',
+                'ratings': ['D'],
+                'skill': 1,
+                'struggle': 2,
+                'last_study': 5.0,
+            },
+        },
+        'study_deck': [SPLIT_ID],
+        'last_session': '2020-01-01',
+    },
+    1: {
+        'schema_version': 1,
+        'cards': {
+            SPLIT_ID: {
+                'id': SPLIT_ID, 'jp': '水', 'en': 'water', 'pron': 'mizu',
+                'hira': 'みず', 'direction': 'J2E', 'front': '水',
+                'deck': 'study',
+                'ratings': ['D'],
+                'skill': 1,
+                'struggle': 2,
+                'last_study': 5.0,
+            },
+        },
+        'study_deck': [SPLIT_ID],
+        'last_session': '2020-01-01',
+    },
+    2: {
+        'schema_version': 2,
+        'cards': {
+            SPLIT_ID: {
+                'id': SPLIT_ID, 'jp': '水', 'en': 'water', 'pron': 'mizu',
+                'hira': 'みず', 'direction': 'J2E', 'front': '水',
+                'deck': 'study',
+                'ratings': {'J2E': ['D'], 'E2J': []},
+                'skill': {'J2E': 1, 'E2J': 0},
+                'struggle': {'J2E': 2, 'E2J': 0},
+                'last_study': {'J2E': 5.0, 'E2J': None},
+            },
+        },
+        'study_deck': [SPLIT_ID],
+        'last_session': '2020-01-01',
+    },
+}
+
+CURRENT = {
+    'schema_version': SCHEMA_VERSION,
+    'cards': {
+        '水': {
+            'id': '水', 'jp': '水', 'en': 'water', 'pron': 'mizu',
+            'hira': 'みず', 'deck': 'study',
+            'ratings': {'J2E': ['D'], 'E2J': []},
+            'skill': {'J2E': 1, 'E2J': 0},
+            'struggle': {'J2E': 2, 'E2J': 0},
+            'last_study': {'J2E': 5.0, 'E2J': None},
+        },
+    },
+    'study_deck': ['水'],
+    'last_session': '2020-01-01',
+}
+
+
+def test_every_old_version_has_a_sample():
+    assert sorted(OLD_FILES) == list(range(SCHEMA_VERSION))
+    assert [version for version, _ in MIGRATIONS] == list(
+        range(1, SCHEMA_VERSION + 1)
+    )
+
+
+@pytest.mark.parametrize('version', sorted(OLD_FILES))
+def test_old_versions_upgrade_to_the_current_one(version):
+    data = copy.deepcopy(OLD_FILES[version])
+    assert schema_version(data) == version
+    assert migrate(data)
+    assert data == CURRENT
+    assert not migrate(data)
+    assert data == CURRENT
+
+
+@pytest.mark.parametrize('version', sorted(OLD_FILES))
+def test_old_files_are_upgraded_on_load(workdir, version):
+    with open(DATA_FILE, 'w', encoding='utf-8') as f:
+        json.dump(OLD_FILES[version], f)
+    storage = JsonStorage()
+    data = storage.load()
+    assert {cid: c.to_dict() for cid, c in data['cards'].items()} == (
+        CURRENT['cards']
+    )
+    assert list(data['study_deck']) == ['水']
+    storage.close()
+    with open(DATA_FILE, encoding='utf-8') as f:
+        assert json.load(f)['schema_version'] == SCHEMA_VERSION
+    with open(DATA_FILE + '.bak', encoding='utf-8') as f:
+        assert json.load(f) == OLD_FILES[version]
+
+
+@pytest.mark.parametrize('version', [SCHEMA_VERSION + 1, -1, '2', 2.0, None])
+def test_unknown_versions_are_refused(version):
+    data = copy.deepcopy(CURRENT)
+    data['schema_version'] = version
+    with pytest.raises(ValueError):
+        migrate(data)
+    assert data['schema_version'] == version
+
+
+def test_files_from_a_newer_version_are_not_loaded(workdir):
+    future = dict(CURRENT, schema_version=SCHEMA_VERSION + 1)
+    with open(DATA_FILE, 'w', encoding='utf-8') as f:
+        json.dump(future, f)
+    with pytest.raises(ValueError, match='newer'):
+        JsonStorage().load()
+    with open(DATA_FILE, encoding='utf-8') as f:
+        assert json.load(f) == future
+
+
+def test_steps_must_be_registered_in_order():
+    with pytest.raises(ValueError):
+        migration(SCHEMA_VERSION)(lambda data: False)
+    assert MIGRATIONS[-1][0] == SCHEMA_VERSION
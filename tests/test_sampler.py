@@ -0,0 +1,73 @@
+from collections import Counter
+
+from japan_niche.model import Card, DirectionPair
+from japan_niche.sampler import (
+    COOLDOWN,
+    RECENT_FACTOR,
+    AdaptivePicker,
+    card_weight,
+    direction_weight,
+)
+from japan_niche.study_queue import StudyQueue
+
+DRAWS = 20000
+# Chi-square critical values at p = 0.001.
+CRITICAL = {1: 10.83, 9: 27.88}
+
+
+def chi_square(observed, expected):
+    return sum((observed[k] - e) ** 2 / e for k, e in expected.items())
+
+
+def study_data(n=10):
+    cards = {}
+    for i in range(n):
+        cid = f'c{i}'
+        cards[cid] = Card(
+            cid, cid, 'en', 'pron', 'hira', deck='study',
+            skill=DirectionPair(i % 3 - 1, (i + 1) % 3),
+            struggle=DirectionPair(i, 2 * i % 5),
+        )
+    return {'cards': cards, 'study_deck': StudyQueue(cards)}
+
+
+def test_picks_follow_card_weights():
+    data = study_data()
+    picker = AdaptivePicker(data, seed=8)
+    observed = Counter(picker.pick() for _ in range(DRAWS))
+    weights = {cid: card_weight(c) for cid, c in data['cards'].items()}
+    total = sum(weights.values())
+    expected = {cid: DRAWS * w / total for cid, w in weights.items()}
+    assert chi_square(observed, expected) < CRITICAL[len(expected) - 1]
+
+
+def test_directions_follow_direction_weights():
+    data = study_data()
+    picker = AdaptivePicker(data, seed=8)
+    card = data['cards']['c3']
+    directions = ['J2E', 'E2J']
+    observed = Counter(
+        picker.pick_direction(card, directions) for _ in range(DRAWS)
+    )
+    weights = {d: direction_weight(card, d) for d in directions}
+    total = sum(weights.values())
+    expected = {d: DRAWS * w / total for d, w in weights.items()}
+    assert chi_square(observed, expected) < CRITICAL[1]
+
+
+def test_only_restricts_the_choice():
+    data = study_data()
+    picker = AdaptivePicker(data, seed=8, only={'c1', 'c4'})
+    assert {picker.pick() for _ in range(500)} == {'c1', 'c4'}
+
+
+def test_graded_cards_cool_down():
+    data = study_data()
+    queue = data['study_deck']
+    picker = AdaptivePicker(data, seed=8)
+    full = card_weight(data['cards']['c0'])
+    picker.rated('c0')
+    assert queue.weight('c0') == full * RECENT_FACTOR
+    for cid in ('c1', 'c2', 'c3')[:COOLDOWN]:
+        picker.rated(cid)
+    assert queue.weight('c0') == full
@@ -0,0 +1,83 @@
+import os
+
+import pytest
+
+from japan_niche import cards
+from japan_niche.cards import FLASHCARD_DIR
+from japan_niche.data import load_data
+
+
+def write(name, *entries):
+    path = os.path.join(FLASHCARD_DIR, name)
+    os.makedirs(FLASHCARD_DIR, exist_ok=True)
+    lines = ['# Words'] + [f'- {jp}: {en} [{jp}] [{jp}]' for jp, en in entries]
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('\n'.join(lines) + '\n')
+    return path
+
+
+@pytest.fixture
+def parsed(monkeypatch):
+    """Records the entries of every file that is parsed."""
+    calls = []
+    parse = cards._parse_entries
+
+    def counting(raw):
+        entries = parse(raw)
+        calls.append([e[0] for e in entries])
+        return entries
+
+    monkeypatch.setattr(cards, '_parse_entries', counting)
+    return calls
+
+
+@pytest.fixture
+def data(workdir):
+    write('a.md', ('犬', 'dog'), ('猫', 'cat'))
+    write('b.md', ('鳥', 'bird'))
+    data = load_data()
+    cards.scan_files(data)
+    return data
+
+
+def test_unchanged_tree_is_not_parsed(data, parsed):
+    no_changes = {'added': [], 'updated': [], 'removed': []}
+    assert cards.scan_files(data) == no_changes
+    # Also when the cache has to be read back from its file.
+    cards._parse_cache = None
+    assert cards.scan_files(data) == no_changes
+    assert parsed == []
+
+
+def test_only_the_changed_file_is_parsed(data, parsed):
+    write('a.md', ('犬', 'hound'), ('猫', 'cat'))
+    diff = cards.scan_files(data)
+    assert diff == {'added': [], 'updated': ['犬'], 'removed': []}
+    assert parsed == [['犬', '猫']]
+    assert data['cards']['犬']['en'] == 'hound'
+
+
+def test_touched_file_with_the_same_content_is_not_parsed(data, parsed):
+    path = os.path.join(FLASHCARD_DIR, 'b.md')
+    os.utime(path, ns=(0, 0))
+    diff = cards.scan_files(data)
+    assert diff == {'added': [], 'updated': [], 'removed': []}
+    assert parsed == []
+    assert cards._parse_cache['files'][path]['mtime'] == 0
+
+
+def test_deleted_file_removes_its_cards(data, parsed):
+    data['study_deck'].append('犬')
+    os.remove(os.path.join(FLASHCARD_DIR, 'a.md'))
+    diff = cards.scan_files(data)
+    assert set(diff['removed']) == {'犬', '猫'}
+    assert sorted(data['cards']) == ['鳥']
+    assert '犬' not in data['study_deck']
+    assert parsed == []
+
+
+def test_cache_of_another_collection_is_not_trusted(data, parsed):
+    data['cards'].pop('鳥')
+    diff = cards.scan_files(data)
+    assert diff == {'added': ['鳥'], 'updated': [], 'removed': []}
+    assert parsed == []
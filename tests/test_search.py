@@ -0,0 +1,116 @@
+import random
+
+import pytest
+
+from japan_niche.model import Card
+from japan_niche.search import SearchIndex, TermIndex, normalize
+
+WORDS = [
+    ('水', 'water', 'mizu', 'みず', 'nature'),
+    ('滝', 'waterfall', 'taki', 'たき', 'nature'),
+    ('見ず', 'without seeing', 'mizu', 'みず', 'verbs'),
+    ('行く', 'to go', 'iku', 'いく', 'verbs'),
+    ('水曜日', 'wednesday', 'suiyoubi', 'すいようび', 'time'),
+    ('ラーメン', 'ramen noodles', 'raamen', 'ラーメン', 'food'),
+    ('水着', 'swimsuit', 'mizugi', 'みずぎ', 'clothes'),
+]
+
+
+def card(jp, en, pron, hira):
+    return Card(jp, jp, en, pron, hira)
+
+
+@pytest.fixture
+def index():
+    index = SearchIndex()
+    index.add_many(
+        (jp, card(jp, en, pron, hira), f'flashcards/{category}.md',
+         category.title())
+        for jp, en, pron, hira, category in WORDS
+    )
+    return index
+
+
+def test_term_index_prefix_follows_changes():
+    terms = TermIndex()
+    terms.add('water', 1)
+    terms.add('waterfall', 2)
+    terms.add('wednesday', 3)
+    assert terms.prefix('wat') == {1, 2}
+    terms.add('watch', 4)
+    terms.discard('waterfall', 2)
+    assert terms.prefix('wat') == {1, 4}
+    assert terms.prefix('x') == set()
+    assert terms.get('waterfall') == frozenset()
+
+
+def test_grams_index_every_substring_of_two(index):
+    grams = index.grams['hira'].postings
+    assert grams['み'] == {'水', '見ず', '水着'}
+    assert grams['みず'] == {'水', '見ず', '水着'}
+    assert grams['ずぎ'] == {'水着'}
+    # Katakana is folded onto hiragana.
+    assert grams['らー'] == {'ラーメン'}
+
+
+def test_queries(index):
+    assert index.matches('water') == {'水', '滝'}
+    assert index.matches('水') == {'水', '水曜日', '水着'}
+    assert index.matches('曜日') == {'水曜日'}
+    assert index.matches('みずぎ') == {'水着'}
+    assert index.matches('いようび') == {'水曜日'}
+    assert index.matches('ミズ') == {'水', '見ず', '水着'}
+    assert index.matches('らあ') == set()
+    assert index.matches('ラーメ') == {'ラーメン'}
+    assert index.matches('みず water') == {'水'}
+    assert index.matches('') == set()
+
+
+def test_field_filters(index):
+    assert index.matches('category:verbs') == {'見ず', '行く'}
+    assert index.matches('category:verbs みず') == {'見ず'}
+    assert index.matches('file:nat') == {'水', '滝'}
+    assert index.matches('en:without seeing') == {'見ず'}
+    assert index.matches('en:seeing') == {'見ず'}
+    assert index.matches('en:mizu') == set()
+    assert index.matches('hira:すい') == {'水曜日'}
+
+
+def test_search_ranks_short_text_first(index):
+    assert index.search('みず') == ['水', '水着', '見ず']
+    assert index.search('みず', limit=1) == ['水']
+    assert index.search('category:verbs category:nature') == []
+
+
+def test_term_cache_follows_changed_cards(index):
+    assert index.matches('みず') == {'水', '見ず', '水着'}
+    assert index.matches('swim') == {'水着'}
+    index.add('水着', card('水着', 'bathing suit', 'mizugi', 'みづぎ'))
+    assert index.matches('みず') == {'水', '見ず'}
+    assert index.matches('swim') == set()
+    assert index.matches('bath') == {'水着'}
+    index.remove('水')
+    assert index.matches('みず') == {'見ず'}
+    assert len(index) == len(WORDS) - 1
+    index.cache_clear()
+    assert index.matches('みず') == {'見ず'}
+
+
+def test_matches_agree_with_a_full_scan():
+    rng = random.Random(3)
+    kana = 'あいうえおかきくけこさしすせそみずラーメン'
+    index = SearchIndex()
+    texts = {}
+    for i in range(300):
+        hira = ''.join(rng.choice(kana) for _ in range(rng.randint(1, 6)))
+        cid = f'c{i}'
+        texts[cid] = normalize(hira)
+        index.add(cid, card(cid, f'word{i}', 'x', hira))
+    for _ in range(200):
+        start = rng.randrange(len(kana))
+        query = kana[start:start + rng.randint(1, 4)]
+        expected = {cid for cid, t in texts.items() if normalize(query) in t}
+        assert index.matches(f'hira:{query}') == expected
+        found = index.search(f'hira:{query}', limit=5)
+        assert set(found) <= expected
+        assert len(found) == min(5, len(expected))
@@ -0,0 +1,121 @@
+import json
+import asyncio
+
+from japan_niche.model import Card
+from japan_niche.server import StudyServer
+
+CONFIG = {'new_cards': 4, 'review_cards': 2, 'save_interval': 0.05}
+
+
+def make_corpus(n=10):
+    return {
+        f'語{i}': Card(f'語{i}', f'語{i}', f'word {i}', f'go{i}', f'ご{i}')
+        for i in range(n)
+    }
+
+
+async def request(port, method, path, body=None):
+    """Send one HTTP request; returns the status and the decoded JSON."""
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    payload = b'' if body is None else json.dumps(body).encode()
+    writer.write(
+        f'{method} {path} HTTP/1.1\r\nHost: localhost\r\n'
+        f'Content-Length: {len(payload)}\r\nConnection: close\r\n\r\n'
+        .encode() + payload
+    )
+    await writer.drain()
+    response = await reader.read()
+    writer.close()
+    head, _, raw = response.partition(b'\r\n\r\n')
+    return int(head.split()[1]), json.loads(raw)
+
+
+async def study_all(port, name):
+    """Answer every card of the study deck right until none is left."""
+    graded = 0
+    while True:
+        status, shown = await request(port, 'GET', f'/learners/{name}/next')
+        assert status == 200
+        if shown['card'] is None:
+            return graded, shown['counts']
+        status, result = await request(
+            port, 'POST', f'/learners/{name}/grade',
+            {'rating': 'F', 'id': shown['card']['id']},
+        )
+        assert status == 200
+        graded += 1
+        assert graded < 100
+
+
+def test_study_session_survives_a_restart(workdir):
+    corpus = make_corpus()
+
+    async def first_run():
+        server = StudyServer(corpus, CONFIG, root='learners')
+        _, port = await server.start()
+        try:
+            status, info = await request(port, 'GET', '/')
+            assert (status, info['cards']) == (200, len(corpus))
+
+            status, day = await request(port, 'POST', '/learners/ann/new-day')
+            assert status == 200
+            assert day['study'] == CONFIG['new_cards']
+            assert day['counts']['no_deck'] == len(corpus) - 4
+
+            graded, counts = await study_all(port, 'ann')
+            assert graded >= 2 * CONFIG['new_cards']
+            assert counts == {'study': 0, 'review': 4, 'no_deck': 6}
+
+            status, counts = await request(port, 'GET', '/learners/bob/counts')
+            assert counts == {'study': 0, 'review': 0, 'no_deck': 10}
+        finally:
+            await server.close()
+
+    async def second_run():
+        server = StudyServer(corpus, CONFIG, root='learners')
+        _, port = await server.start()
+        try:
+            status, counts = await request(port, 'GET', '/learners/ann/counts')
+            assert (status, counts) == (
+                200, {'study': 0, 'review': 4, 'no_deck': 6}
+            )
+            status, day = await request(port, 'POST', '/learners/ann/new-day')
+            # Four new cards and the two hardest review cards.
+            assert day['study'] == 6
+            assert day['counts']['no_deck'] == 2
+        finally:
+            await server.close()
+
+    asyncio.run(first_run())
+    asyncio.run(second_run())
+
+
+def test_request_errors(workdir):
+    async def run():
+        server = StudyServer(make_corpus(3), CONFIG, root='learners')
+        _, port = await server.start()
+        try:
+            status, _ = await request(port, 'POST', '/learners/ann/grade', {
+                'rating': 'D',
+            })
+            assert status == 409  # nothing was asked yet
+            await request(port, 'POST', '/learners/ann/new-day')
+            await request(port, 'GET', '/learners/ann/next')
+            status, _ = await request(port, 'POST', '/learners/ann/grade', {
+                'rating': 'X',
+            })
+            assert status == 400
+            status, _ = await request(port, 'POST', '/learners/ann/grade', {
+                'rating': 'D', 'id': 'another card',
+            })
+            assert status == 409
+            for method, path, expected in (
+                ('GET', '/learners/ann/grade', 405),
+                ('GET', '/learners/ann/nope', 404),
+                ('GET', '/learners/a.b/next', 404),
+            ):
+                assert (await request(port, method, path))[0] == expected
+        finally:
+            await server.close()
+
+    asyncio.run(run())
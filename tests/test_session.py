@@ -0,0 +1,142 @@
+import os
+
+import pytest
+
+from japan_niche import cli
+from japan_niche.cards import FLASHCARD_DIR, apply_rating
+from japan_niche.data import close_storage, load_config
+from japan_niche.history import close_history
+from japan_niche.model import Card
+from japan_niche.session import StudySession, open_collection
+from japan_niche.study_queue import StudyQueue
+
+WORDS = [('水', 'water'), ('火', 'fire'), ('木', 'tree'), ('金', 'gold')]
+NOW = 1.7e9
+
+
+def card_data(n=len(WORDS)):
+    cards = {}
+    for jp, en in WORDS[:n]:
+        cards[jp] = Card(jp, jp, en, 'pron', 'hira', deck='study')
+    return {
+        'cards': cards,
+        'study_deck': StudyQueue(cards),
+        'last_session': None,
+    }
+
+
+@pytest.fixture
+def collection(workdir):
+    """Scanned cards with a started day, as ``main.py`` leaves them."""
+    os.makedirs(FLASHCARD_DIR)
+    with open(os.path.join(FLASHCARD_DIR, 'words.md'), 'w',
+              encoding='utf-8') as f:
+        f.write('# Words\n')
+        for jp, en in WORDS:
+            f.write(f'- {jp}: {en} [pron] [hira]\n')
+    assert cli.main(['scan']) == 0
+    assert cli.main(['new-day']) == 0
+    return workdir
+
+
+def test_right_answers_graduate_every_card(workdir):
+    data = card_data()
+    session = StudySession(data, seed=1)
+    asked = []
+    while session.next_card() is not None:
+        asked.append((session.cid, session.direction))
+        session.grade('F', NOW + len(asked))
+    # One F brings a direction to skill 2; both directions graduate a card.
+    assert sorted(asked) == sorted(
+        (jp, d) for jp, _ in WORDS for d in ('J2E', 'E2J')
+    )
+    assert session.graduated == len(WORDS)
+    assert not data['study_deck']
+    assert session.counts() == {
+        'study': 0, 'review': len(WORDS), 'no_deck': 0
+    }
+    for card in data['cards'].values():
+        assert card['deck'] == 'review'
+        # Graduation resets the progress for the next time it is studied.
+        assert card['skill']['J2E'] == card['skill']['E2J'] == 0
+
+
+def test_wrong_answers_delay_graduation(workdir):
+    data = card_data(1)
+    session = StudySession(data, seed=2)
+    grades = iter('ADFSFFFF')
+    results = []
+    while session.next_card() is not None:
+        results.append((session.direction, session.grade(next(grades))))
+    card = data['cards']['水']
+    assert card['deck'] == 'review'
+    assert results[-1][1] is True
+    assert all(done is False for _, done in results[:-1])
+    assert len(results) > 2
+
+
+def test_skill_counts_the_last_three_ratings(workdir):
+    data = card_data(1)
+    for rating in 'AAD':
+        apply_rating(data, '水', 'J2E', rating, NOW)
+    card = data['cards']['水']
+    assert card['skill']['J2E'] == -3
+    assert card['struggle']['J2E'] == 6
+    assert not apply_rating(data, '水', 'J2E', 'F', NOW)
+    assert card['ratings']['J2E'] == ['A', 'D', 'F']
+    assert not apply_rating(data, '水', 'E2J', 'F', NOW)
+    assert apply_rating(data, '水', 'J2E', 'F', NOW)
+    assert card['deck'] == 'review'
+    assert '水' not in data['study_deck']
+
+
+def test_session_limited_to_some_cards(workdir):
+    data = card_data()
+    session = StudySession(data, seed=3, only=['火', '木', 'missing'])
+    asked = set()
+    while session.next_card() is not None:
+        asked.add(session.cid)
+        session.grade('F', NOW)
+    assert asked == {'火', '木'}
+    assert set(data['study_deck']) == {'水', '金'}
+
+
+def test_removed_card_is_not_graded(workdir):
+    data = card_data(2)
+    session = StudySession(data, seed=4)
+    cid, _ = session.next_card()
+    data['cards'].pop(cid)
+    data['study_deck'].discard(cid)
+    assert session.grade('F') is None
+
+
+def test_session_progress_is_saved(collection):
+    data = open_collection(load_config())
+    try:
+        session = StudySession(data, seed=5)
+        while session.next_card() is not None:
+            session.grade('F', NOW)
+    finally:
+        close_history()
+        close_storage()
+    data = open_collection(load_config())
+    try:
+        assert not data['study_deck']
+        assert {c['deck'] for c in data['cards'].values()} == {'review'}
+    finally:
+        close_history()
+        close_storage()
+
+
+def test_stats_command(collection, capsys):
+    capsys.readouterr()
+    assert cli.main(['stats']) == 0
+    lines = capsys.readouterr().out.splitlines()
+    assert lines[:4] == [
+        f'Cards: {len(WORDS)}',
+        f'Study: {len(WORDS)}',
+        'Review: 0',
+        'No Deck: 0',
+    ]
+    assert lines[4].startswith('Last session: ')
+    assert lines[4] != 'Last session: never'
@@ -0,0 +1,55 @@
+import pytest
+
+from japan_niche.decks import review_engine, use_review_engine
+from japan_niche.vectorized import HAVE_NUMPY
+
+pytestmark = pytest.mark.skipif(not HAVE_NUMPY, reason='needs NumPy')
+
+BASE = {'cards': 300, 'days': 30, 'new_cards': 10, 'review_cards': 20}
+SEEDS = range(4)
+
+
+def mean(results, key):
+    return sum(r['summary'][key] for r in results) / len(results)
+
+
+@pytest.fixture
+def simulator(workdir):
+    from japan_niche import simulator
+    engine = review_engine()
+    yield simulator
+    use_review_engine(engine)
+
+
+def test_batched_mode_agrees_with_a_real_session(simulator):
+    runs = {
+        mode: simulator.sweep(
+            [dict(BASE, mode=mode, seed=seed) for seed in SEEDS]
+        )
+        for mode in ('batched', 'session')
+    }
+    batched, session = runs['batched'], runs['session']
+    assert mean(batched, 'mean_grades') == pytest.approx(
+        mean(session, 'mean_grades'), rel=0.05
+    )
+    assert mean(batched, 'mean_due') == pytest.approx(
+        mean(session, 'mean_due'), rel=0.05
+    )
+    assert mean(batched, 'retention') == pytest.approx(
+        mean(session, 'retention'), abs=0.05
+    )
+    for b, s in zip(batched, session):
+        assert b['summary']['days_to_exhaust_new'] == (
+            s['summary']['days_to_exhaust_new']
+        )
+
+
+def test_engine_is_chosen_per_configuration(simulator):
+    use_review_engine('heap')
+    configs = [dict(BASE, engine=engine) for engine in ('numpy', 'heap')]
+    numpy, heap = simulator.sweep(configs)
+    # Both engines pick the same review cards.
+    assert numpy['curves'] == heap['curves']
+    assert review_engine() == 'heap'
+    with pytest.raises(ValueError):
+        simulator.simulate(dict(BASE, engine='gpu'))
@@ -0,0 +1,201 @@
+import os
+import json
+
+import pytest
+
+from japan_niche import cards
+from japan_niche.data import DATA_FILE, SHARD_DIR, set_storage
+from japan_niche.migrations import migrate
+from japan_niche.model import Card, DirectionPair
+from japan_niche.storage import (
+    STORAGE_BACKENDS,
+    BackgroundStorage,
+    JsonStorage,
+    ShardedStorage,
+    SqliteStorage,
+)
+from japan_niche.snapshot import json_to_snapshot, snapshot_to_json
+
+
+def sample_cards():
+    cards = {}
+    for i in range(20):
+        cid = f'語{i}'
+        cards[cid] = Card(
+            cid, cid, f'word {i}', f'go{i}', f'ご{i}',
+            deck=('study', 'review', 'no_deck')[i % 3],
+            ratings=DirectionPair(list('ADF'[:i % 4]), ['S'] * (i % 2)),
+            skill=DirectionPair(i % 3, -(i % 2)),
+            struggle=DirectionPair(i, i % 4),
+            last_study=DirectionPair(
+                None if i % 2 else 1700000000.5 + i, 1700000100.25
+            ),
+            extra={'legacy': [i]} if i % 5 == 0 else None,
+        )
+    return cards
+
+
+def fill(data):
+    data['cards'].update(sample_cards())
+    for cid, card in data['cards'].items():
+        if card['deck'] == 'study':
+            data['study_deck'].append(cid)
+    data['last_session'] = '2026-01-02'
+
+
+def snapshot(data):
+    """Everything a backend has to keep, independent of the card order."""
+    return (
+        {cid: card.to_dict() for cid, card in data['cards'].items()},
+        list(data['study_deck']),
+        data['last_session'],
+    )
+
+
+@pytest.fixture(params=sorted(STORAGE_BACKENDS))
+def backend(request, workdir):
+    return STORAGE_BACKENDS[request.param]
+
+
+def reopen(backend, storage):
+    storage.close()
+    storage = backend()
+    return storage, storage.load()
+
+
+def test_full_save_round_trip(backend):
+    storage = backend()
+    data = storage.load()
+    fill(data)
+    storage.save(data)
+    expected = snapshot(data)
+    storage, loaded = reopen(backend, storage)
+    assert snapshot(loaded) == expected
+    storage.close()
+
+
+def test_partial_writes_round_trip(backend):
+    storage = backend()
+    data = storage.load()
+    fill(data)
+    storage.save(data)
+    storage, data = reopen(backend, storage)
+
+    card = data['cards']['語4']
+    card['struggle']['J2E'] = 9
+    card['ratings']['E2J'] = ['F']
+    storage.record_card(data, '語4')
+
+    removed = '語1'
+    data['cards'].pop(removed)
+    data['study_deck'].discard(removed)
+    data['cards']['新'] = Card('新', '新', 'new', 'shin', 'しん')
+    data['cards']['語2']['deck'] = 'review'
+    data['study_deck'].discard('語2')
+    storage.save_cards(data, ['新', removed, '語2'])
+    expected = snapshot(data)
+
+    storage, loaded = reopen(backend, storage)
+    assert snapshot(loaded) == expected
+    storage.close()
+
+
+def test_background_writes_round_trip(backend):
+    storage = BackgroundStorage(backend(), interval=0.05)
+    data = storage.load()
+    fill(data)
+    storage.save(data)
+    data['cards']['語3']['skill']['J2E'] = 2
+    storage.record_card(data, '語3')
+    expected = snapshot(data)
+    storage.close()
+    storage = backend()
+    assert snapshot(storage.load()) == expected
+    storage.close()
+
+
+def test_migrates_from_json(backend):
+    json_storage = JsonStorage()
+    data = json_storage.load()
+    fill(data)
+    json_storage.save(data)
+    expected = snapshot(data)
+    json_storage.close()
+    storage = backend()
+    assert snapshot(storage.load()) == expected
+    storage.close()
+
+
+def test_sharded_cards_follow_their_files(workdir):
+    storage = ShardedStorage()
+    data = storage.load()
+    fill(data)
+    storage.save(data)
+    assert storage.needs_sources()
+    sources = {
+        cid: os.path.join('flashcards', f'{i % 2}.md')
+        for i, cid in enumerate(data['cards'])
+    }
+    moved = storage.assign_sources(sources)
+    assert sorted(moved) == sorted(data['cards'])
+    assert not storage.needs_sources()
+    storage.save_cards(data, moved)
+    expected = snapshot(data)
+    storage, loaded = reopen(ShardedStorage, storage)
+    assert snapshot(loaded) == expected
+    shards = sorted(os.listdir(SHARD_DIR))
+    assert not [name for name in shards if name.startswith('unsorted')]
+    assert len(shards) == 3  # two files and the manifest
+    storage.close()
+
+
+def test_snapshot_conversion_round_trip(workdir):
+    legacy = {
+        'cards': {
+            'x|y|犬|dog|J2E': {
+                'id': 'x|y|犬|dog|J2E', 'back': 'dog [inu] [いぬ]',
+                'ratings': ['D'], 'skill': 1, 'struggle': 2,
+            },
+        },
+        'study_deck': ['x|y|犬|dog|J2E'],
+    }
+    with open(DATA_FILE, 'w', encoding='utf-8') as f:
+        json.dump(legacy, f)
+    migrated = json.loads(json.dumps(legacy))
+    migrate(migrated)
+    assert json_to_snapshot(DATA_FILE, 'data.bin') == 1
+    assert snapshot_to_json('data.bin', 'back.json') == 1
+    with open('back.json', encoding='utf-8') as f:
+        back = json.load(f)
+    assert back['cards'] == migrated['cards']
+    assert back['study_deck'] == migrated['study_deck'] == ['犬']
+
+
+def test_sqlite_save_cards_writes_only_the_named_rows(workdir):
+    storage = SqliteStorage()
+    data = storage.load()
+    fill(data)
+    storage.save(data)
+    before = storage.conn.total_changes
+    data['cards']['語5']['deck'] = 'review'
+    storage.save_cards(data, ['語5'])
+    study = len(data['study_deck'])
+    # The card itself, the study positions and the last session.
+    assert storage.conn.total_changes - before <= 1 + 2 * study + 1
+    storage.close()
+
+
+def test_counts_do_not_wait_for_background_writes(workdir):
+    storage = BackgroundStorage(SqliteStorage(), interval=60)
+    set_storage(storage)
+    data = storage.load()
+    fill(data)
+    storage.save(data)
+    expected = cards.deck_index(data).counts()
+    assert storage.pending_writes()
+    assert cards.deck_counts(data) == expected
+    # Answered from memory: the queued save is still waiting.
+    assert storage.pending_writes()
+    storage.flush()
+    assert cards.deck_counts(data) == storage.storage.deck_counts()
+    storage.close()